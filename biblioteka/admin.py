@@ -1,7 +1,28 @@
 from django.contrib import admin
-from biblioteka.models import Author, Book, Library
+from biblioteka.models import Author, Book, Library, Work
 
-# Register your models here.
-admin.site.register(Author)
-admin.site.register(Book)
-admin.site.register(Library)
\ No newline at end of file
+
+# Related works, authors and libraries are picked with autocomplete widgets rather
+# than selects listing every row, which need the search_fields below.
+@admin.register(Author)
+class AuthorAdmin(admin.ModelAdmin):
+    search_fields = ['name']
+
+
+@admin.register(Library)
+class LibraryAdmin(admin.ModelAdmin):
+    search_fields = ['location']
+
+
+@admin.register(Book)
+class BookAdmin(admin.ModelAdmin):
+    list_select_related = ['work__author', 'library']
+    autocomplete_fields = ['work', 'library']
+    search_fields = ['work__title']
+
+
+@admin.register(Work)
+class WorkAdmin(admin.ModelAdmin):
+    list_select_related = ['author']
+    autocomplete_fields = ['author']
+    search_fields = ['title']
@@ -0,0 +1,34 @@
+"""Helpers for the async views."""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connections
+
+
+def _in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all())
+
+
+def _closing_connections(read):
+    def run():
+        try:
+            return read()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def gather_reads(*reads):
+    """
+    Runs independent blocking reads concurrently, each in a worker thread
+    with its own database connection, and returns their results in order.
+
+    Other connections can't see the writes of an open transaction (e.g. of a
+    TestCase), so inside one the reads run one after another on the
+    caller's connection instead.
+    """
+    if await sync_to_async(_in_transaction)():
+        return [await sync_to_async(read)() for read in reads]
+    return await asyncio.gather(*(
+        sync_to_async(_closing_connections(read), thread_sensitive=False)() for read in reads
+    ))
@@ -0,0 +1,215 @@
+"""
+Read-only JSON API over the catalogue.
+
+Every resource supports sparse fieldsets (`?fields=title,genre`, and
+`?fields[authors]=name` for included resources), `?include=author,library`
+for related objects, resolved with one batched query per relation instead
+of one per row, and keyset pagination with `?after=`, `?before=` and `?size=`.
+"""
+from biblioteka.models import WORK_FIELDS, Author, Book, Library, book_lookup, chunks
+from biblioteka.pagination import parse_cursor, get_page_size, keyset_paginate
+from biblioteka.utils import author_bibliography, find_title_availability
+
+RESOURCES = {
+    'books': (Book, ('title', 'genre', 'author', 'library')),
+    'authors': (Author, ('name',)),
+    'libraries': (Library, ('location',)),
+}
+# Resources with suggestions for autocomplete widgets, as resource -> field.
+SUGGESTIONS = {'authors': 'name', 'libraries': 'location'}
+# Relations that can be included, as field -> resource.
+INCLUDES = {
+    'books': {'author': 'authors', 'library': 'libraries'},
+    'authors': {},
+    'libraries': {},
+}
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+def parse_fields(resource, requested=None):
+    """Returns the fields of `resource` to serialize, `id` always included."""
+    available = RESOURCES[resource][1]
+    fields = _split(requested) or list(available)
+    unknown = [field for field in fields if field not in available and field != 'id']
+    if unknown:
+        raise ValueError(
+            f"Unknown fields of {resource}: {', '.join(unknown)}. "
+            f"Available: {', '.join(available)}"
+        )
+    return [field for field in fields if field != 'id']
+
+
+def parse_include(resource, requested=None):
+    include = _split(requested)
+    unknown = [name for name in include if name not in INCLUDES[resource]]
+    if unknown:
+        raise ValueError(
+            f"Cannot include {', '.join(unknown)} in {resource}. "
+            f"Available: {', '.join(INCLUDES[resource]) or 'none'}"
+        )
+    return include
+
+
+def _attname(model, field):
+    # Fields of the work of a book are properties of the book.
+    if model == Book and field in WORK_FIELDS:
+        return 'author_id' if field == 'author' else field
+    return model._meta.get_field(field).attname
+
+
+def _columns(model, fields):
+    # Foreign keys are serialized as ids, so only the id column is loaded.
+    columns = [_attname(model, field) for field in fields]
+    if model == Book:
+        columns = [book_lookup(column) for column in columns]
+        if any(column.startswith('work__') for column in columns):
+            columns.append('work')
+    return columns
+
+
+def _serialize(obj, fields):
+    data = {'id': obj.pk}
+    for field in fields:
+        data[field] = getattr(obj, _attname(type(obj), field))
+    return data
+
+
+def _related(resource, ids, fields):
+    model = RESOURCES[resource][0]
+    objects = []
+    for chunk in chunks(sorted(ids)):
+        objects.extend(model.objects.filter(pk__in=chunk).only(*_columns(model, fields)))
+    return [_serialize(obj, fields) for obj in sorted(objects, key=lambda obj: obj.pk)]
+
+
+def _included(resource, objects, include, params):
+    included = {}
+    for relation in include:
+        related = INCLUDES[resource][relation]
+        attname = _attname(RESOURCES[resource][0], relation)
+        ids = {getattr(obj, attname) for obj in objects} - {None}
+        fields = parse_fields(related, params.get(f'fields[{related}]'))
+        included[related] = _related(related, ids, fields)
+    return included
+
+
+def _query(resource, fields, include):
+    model = RESOURCES[resource][0]
+    # Included relations need their foreign keys even if they are not serialized.
+    return model.objects.only(*_columns(model, set(fields) | set(include)))
+
+
+def api_page(resource, params):
+    """
+    Returns one page of `resource` as a JSON-serializable dict. `params` is
+    a mapping of the query parameters described in the module docstring.
+    Raises ValueError on unknown resources, fields or includes.
+    """
+    if resource not in RESOURCES:
+        raise ValueError(f"Resource should be one of: {', '.join(RESOURCES)}")
+    fields = parse_fields(resource, params.get('fields'))
+    include = parse_include(resource, params.get('include'))
+
+    page = keyset_paginate(
+        _query(resource, fields, include),
+        after=parse_cursor(params.get('after')),
+        before=parse_cursor(params.get('before')),
+        page_size=params.get('size'),
+    )
+    result = {
+        'data': [_serialize(obj, fields) for obj in page],
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    }
+    if include:
+        result['included'] = _included(resource, page.items, include, params)
+    return result
+
+
+def api_object(resource, pk, params):
+    """
+    Returns a single object of `resource` as a JSON-serializable dict, or
+    None when it does not exist. Raises ValueError like api_page().
+    """
+    if resource not in RESOURCES:
+        raise ValueError(f"Resource should be one of: {', '.join(RESOURCES)}")
+    fields = parse_fields(resource, params.get('fields'))
+    include = parse_include(resource, params.get('include'))
+
+    obj = _query(resource, fields, include).filter(pk=pk).first()
+    if obj is None:
+        return None
+    result = {'data': _serialize(obj, fields)}
+    if include:
+        result['included'] = _included(resource, [obj], include, params)
+    return result
+
+
+def api_bibliography(pk, params):
+    """
+    Returns one page of the distinct titles of author `pk`, alphabetically,
+    after the title in `?after=`; `?details=1` adds copies and genres.
+    Returns None when the author does not exist.
+    """
+    author = Author.objects.filter(pk=pk).first()
+    if author is None:
+        return None
+    page_size = get_page_size(params.get('size'))
+    titles = author_bibliography(
+        author,
+        after=params.get('after'),
+        limit=page_size + 1,
+        details=params.get('details') in ('1', 'true'),
+    )
+    has_more = len(titles) > page_size
+    titles = titles[:page_size]
+    last = titles[-1] if titles else None
+    return {
+        'data': titles,
+        'next': (last['title'] if isinstance(last, dict) else last) if has_more else None,
+    }
+
+
+def api_availability(params):
+    """
+    Returns the libraries holding the title in `?title=` with their number
+    of copies. Raises ValueError without a title.
+    """
+    title = params.get('title')
+    if not title:
+        raise ValueError("Give a title")
+    libraries = [
+        {'id': library.pk, 'location': library.location, 'copies': copies}
+        for library, copies in find_title_availability(title).items()
+    ]
+    return {
+        'title': title,
+        'copies': sum(library['copies'] for library in libraries),
+        'libraries': libraries,
+    }
+
+
+def api_suggestions(resource, params):
+    """
+    Returns the `resource` objects whose name starts with `?q=`,
+    alphabetically, one page after the name in `?after=`, as {id, text}
+    pairs for autocomplete widgets.
+    """
+    if resource not in SUGGESTIONS:
+        raise ValueError(f"Resource should be one of: {', '.join(SUGGESTIONS)}")
+    model, field = RESOURCES[resource][0], SUGGESTIONS[resource]
+    page_size = get_page_size(params.get('size'))
+
+    objects = model.objects.filter(**{f'{field}__isnull': False})
+    if params.get('q'):
+        objects = objects.filter(**{f'{field}__istartswith': params['q']})
+    if params.get('after'):
+        objects = objects.filter(**{f'{field}__gt': params['after']})
+    rows = list(objects.order_by(field).values_list('pk', field)[:page_size + 1])
+    return {
+        'results': [{'id': pk, 'text': text} for pk, text in rows[:page_size]],
+        'next': rows[page_size - 1][1] if len(rows) > page_size else None,
+    }
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BibliotekaConfig(AppConfig):
     name = 'biblioteka'
+
+    def ready(self):
+        from biblioteka import receivers  # noqa: F401
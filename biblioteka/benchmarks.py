@@ -0,0 +1,576 @@
+"""
+Benchmarks for the catalogue helpers and views.
+
+`manage.py bench` times every helper from biblioteka.utils and every URL from
+biblioteka.urls on a synthetic catalogue. The bench_* functions compare a
+single optimisation with the code it replaced; they seed their own data
+inside a transaction that is rolled back afterwards:
+
+    python manage.py shell -c "from biblioteka.benchmarks import *; bench_count_titles()"
+
+`manage.py load_test` runs concurrent_writes() against the configured
+database engine and `manage.py bench_servers` compares the read throughput
+of the WSGI and ASGI handlers.
+"""
+import asyncio
+import inspect
+import itertools
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from wsgiref.util import setup_testing_defaults
+
+from django.core.asgi import get_asgi_application
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from biblioteka import urls, utils
+from biblioteka.models import BULK_BATCH_SIZE, Author, Book, Library, Work, attach_works
+from biblioteka.profiling import profile_block
+from biblioteka.utils import count_books, count_titles, search_books
+
+
+def seed_catalogue(authors=10, books_per_author=100, libraries=1, titles_per_author=10):
+    library_objects = [
+        Library.objects.create(location=f"Bench library {i}") for i in range(libraries)
+    ]
+    for a in range(authors):
+        author = Author.objects.create(name=f"Bench author {a}")
+        books = [
+            Book(
+                title=f"Bench title {a}-{b % titles_per_author}",
+                genre=f"genre {b % 5}",
+                author=author,
+                library=library_objects[b % libraries] if library_objects else None,
+            )
+            for b in range(books_per_author)
+        ]
+        attach_works(books)
+        Book.objects.bulk_create(books, batch_size=BULK_BATCH_SIZE)
+    return library_objects
+
+
+def measure(func, *args, repeat=5, **kwargs):
+    """
+    Times `repeat` calls of `func`. The first call runs on cold caches, so
+    `queries` and `render_first` are those of the first call and
+    `queries_warm` and `render_warm` the lowest of the others. Queries are
+    counted on every connection, worker threads included.
+    """
+    timings = []
+    queries = []
+    renders = []
+    for _ in range(repeat):
+        with profile_block() as profile:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+        queries.append(profile.queries)
+        renders.append(profile.template_seconds)
+    return {
+        'first': timings[0],
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'queries': queries[0],
+        'queries_warm': min(queries[1:] or queries),
+        'render_first': renders[0],
+        'render_warm': min(renders[1:] or renders),
+        'result': result,
+    }
+
+
+def peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def seed_sample(authors, books_per_author, libraries):
+    library_objects = seed_catalogue(
+        authors=authors, books_per_author=books_per_author, libraries=libraries
+    )
+    author = Author.objects.order_by('pk').first()
+    return {
+        'user': User.objects.create_user('bench'),
+        'author': author,
+        'library': library_objects[0] if library_objects else None,
+        'book': author.books.first(),
+        'authors': list(Author.objects.order_by('pk')),
+        'libraries': library_objects,
+        'books': list(author.books),
+    }
+
+
+def utils_cases(sample):
+    """
+    Returns {name: callable} timing every public helper of biblioteka.utils
+    against the seeded `sample`. Helpers that write use fresh names on every
+    call, so they can be repeated inside one transaction.
+    """
+    names = (f"Bench {i}" for i in itertools.count())
+    author, library, book = sample['author'], sample['library'], sample['book']
+    return {
+        'add_author': lambda: utils.add_author(next(names)),
+        'add_library': lambda: utils.add_library(next(names)),
+        'build_book': lambda: utils.build_book("Bench", "bench", author, library),
+        'add_book': lambda: utils.add_book("Bench", "bench", author, library),
+        'view_books_by_author': lambda: utils.view_books_by_author(author.name),
+        'view_books_in_library': lambda: utils.view_books_in_library(library.location),
+        'view_books_in_library_stream': lambda: sum(1 for _ in utils.view_books_in_library(
+            library.location, stream=True, fields=['title', 'author__name']
+        )),
+        'count_books': lambda: utils.count_books(library, by='author'),
+        'count_titles': lambda: utils.count_titles(library),
+        'view_titles_by_author': lambda: utils.view_titles_by_author(author),
+        'author_bibliography': lambda: utils.author_bibliography(author, limit=50, details=True),
+        'find_libraries_with_book': lambda: utils.find_libraries_with_book(book),
+        'search_books': lambda: utils.search_books(book.title),
+        'view_books_by_authors': lambda: utils.view_books_by_authors(sample['authors']),
+        'view_books_in_libraries': lambda: utils.view_books_in_libraries(sample['libraries']),
+        'count_books_in_libraries': lambda: utils.count_books_in_libraries(
+            sample['libraries'], by='genre'
+        ),
+        'count_titles_in_libraries': lambda: utils.count_titles_in_libraries(sample['libraries']),
+        'find_libraries_with_books': lambda: utils.find_libraries_with_books(sample['books']),
+        'find_title_availability': lambda: utils.find_title_availability(book.title),
+        'library_stats': lambda: utils.library_stats(library),
+        'library_titles': lambda: utils.library_titles(library),
+        'author_stats': lambda: utils.author_stats(author.name),
+        'genre_stats': lambda: utils.genre_stats(book.genre),
+        'update_books': lambda: utils.update_books(
+            utils.view_books_in_library(library), genre=book.genre
+        ),
+        # Removes the books added by the add_book case.
+        'delete_books': lambda: utils.delete_books(Book.objects.filter(work__genre="bench")),
+    }
+
+
+def untimed_utils(cases):
+    return sorted(
+        name for name, func in inspect.getmembers(utils, inspect.isfunction)
+        if func.__module__ == utils.__name__ and not name.startswith('_') and name not in cases
+    )
+
+
+def _request(client, url, data=None):
+    response = client.get(url) if data is None else client.post(url, data)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def url_cases(sample, client=None):
+    """
+    Returns {url name: callable} requesting every URL of biblioteka.urls as
+    the sample's user. POST-only views get a request that changes nothing.
+    """
+    client = client or Client()
+    client.force_login(sample['user'])
+    query_strings = {
+        'book-search': f"?q={sample['book'].title}",
+        'api-list': "?include=author,library",
+        'api-detail': "?include=author,library",
+        'api-author-bibliography': "?details=1",
+        'api-title-availability': f"?title={sample['book'].title}",
+        'api-suggest': "?q=Bench",
+    }
+    posts = {
+        'book-bulk': {
+            'action': 'update',
+            'ids': [book.pk for book in sample['books'] if book.genre == sample['book'].genre],
+            'set_genre': sample['book'].genre,
+        },
+    }
+    cases = {}
+    for pattern in urls.urlpatterns:
+        kwargs = {}
+        for parameter in pattern.pattern.converters:
+            if parameter == 'resource':
+                kwargs[parameter] = 'authors' if pattern.name == 'api-suggest' else 'books'
+                continue
+            entity = pattern.name.split('-')[0]
+            if parameter == 'author_pk':
+                entity = 'author'
+            elif entity == 'api':
+                entity = 'author' if pattern.name.startswith('api-author') else 'book'
+            kwargs[parameter] = sample[entity].pk
+        url = reverse(f'{urls.app_name}:{pattern.name}', kwargs=kwargs)
+        url += query_strings.get(pattern.name, '')
+        data = posts.get(pattern.name)
+        cases[pattern.name] = lambda url=url, data=data: _request(client, url, data)
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of the cases that got slower than the baseline by more
+    than `threshold` (0.2 = 20%) or issue more queries than before, on cold
+    or on warm caches.
+    """
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if stats['best_ms'] > previous['best_ms'] * (1 + threshold):
+            regressions.append(f"{name}: {previous['best_ms']:.2f} ms -> {stats['best_ms']:.2f} ms")
+        if stats['queries'] > previous['queries']:
+            regressions.append(f"{name}: {previous['queries']} -> {stats['queries']} queries")
+        # Baselines written before warm queries were recorded lack them.
+        if stats.get('queries_warm', 0) > previous.get('queries_warm', float('inf')):
+            regressions.append(
+                f"{name}: {previous['queries_warm']} -> {stats['queries_warm']} warm queries"
+            )
+    return regressions
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Creates a test database with the configured engine for the duration of
+    the block. SQLite gets a temporary file: threads share an in-memory
+    database through a single cache with table-level locks, a file behaves
+    like production.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def _percentile(values, fraction):
+    return values[int(fraction * (len(values) - 1))] if values else 0
+
+
+def concurrent_writes(authors, libraries, threads=8, writes=100):
+    """
+    Starts `threads` writers at once, each adding `writes` books in its own
+    transaction and database connection. Returns the throughput, write
+    latencies and the database errors, e.g. {"database is locked": 3}.
+    """
+    latencies = []
+    failures = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def writer(number):
+        try:
+            barrier.wait()
+            for i in range(writes):
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        utils.add_book(
+                            f"Load title {number}-{i}", f"genre {i % 5}",
+                            authors[(number + i) % len(authors)], libraries[i % len(libraries)],
+                        )
+                except DatabaseError as e:
+                    with lock:
+                        failures[str(e)] += 1
+                else:
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=writer, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'writes': len(latencies),
+        'failures': dict(failures),
+        'seconds': elapsed,
+        'writes_per_second': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p95_ms': _percentile(latencies, 0.95) * 1000,
+        'max_ms': _percentile(latencies, 1) * 1000,
+    }
+
+
+def _sleeping_wrapper(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+@contextmanager
+def simulated_db_latency(seconds):
+    """Delays every query of connections opened in the block by `seconds`."""
+    wrapper = _sleeping_wrapper(seconds)
+
+    def install(sender, connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(install, weak=False)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+        for alias in connections:
+            if wrapper in connections[alias].execute_wrappers:
+                connections[alias].execute_wrappers.remove(wrapper)
+
+
+def _throughput(statuses, elapsed):
+    return {
+        'requests': len(statuses),
+        'errors': sum(status >= 400 for status in statuses),
+        'seconds': elapsed,
+        'requests_per_second': len(statuses) / elapsed,
+    }
+
+
+def wsgi_throughput(paths, requests=400, threads=8):
+    """
+    Sends `requests` GETs for `paths` (round-robin) through the WSGI handler
+    from a pool of `threads` workers, like a threaded WSGI server.
+    """
+    application = get_wsgi_application()
+
+    def get(path):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_HOST': 'testserver'}
+        setup_testing_defaults(environ)
+        statuses = []
+        response = application(environ, lambda status, headers: statuses.append(int(status[:3])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return statuses[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = list(executor.map(get, itertools.islice(itertools.cycle(paths), requests)))
+    return _throughput(statuses, time.perf_counter() - start)
+
+
+async def _asgi_get(application, path):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    requested = asyncio.Event()
+    statuses = []
+
+    async def receive():
+        if requested.is_set():
+            # Nothing more to send, the client stays connected.
+            await asyncio.Future()
+        requested.set()
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+def asgi_throughput(paths, requests=400, concurrency=64):
+    """
+    Sends `requests` GETs for `paths` (round-robin) through the ASGI handler
+    on one event loop, at most `concurrency` at a time.
+    """
+    application = get_asgi_application()
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get(path):
+            async with slots:
+                return await _asgi_get(application, path)
+
+        return await asyncio.gather(
+            *(get(path) for path in itertools.islice(itertools.cycle(paths), requests))
+        )
+
+    start = time.perf_counter()
+    statuses = asyncio.run(run())
+    return _throughput(statuses, time.perf_counter() - start)
+
+
+def _count_titles_in_python(library):
+    # The loop count_titles used before the aggregation moved to the database.
+    titles = dict()
+    for book in Book.objects.filter(library=library):
+        if book.title in titles:
+            titles[book.title] += 1
+        else:
+            titles[book.title] = 1
+    return titles
+
+
+def _report(name, stats, rows):
+    print(
+        f"{name:<24} best {stats['best'] * 1000:9.2f} ms   "
+        f"mean {stats['mean'] * 1000:9.2f} ms   "
+        f"queries {stats['queries']:5d}   rows {rows}"
+    )
+
+
+def bench_count_titles(authors=50, books_per_author=400, repeat=5):
+    with transaction.atomic():
+        library, = seed_catalogue(authors=authors, books_per_author=books_per_author)
+        copies = Book.objects.filter(library=library).count()
+        print(f"count_titles over {copies} copies in one library")
+
+        legacy = measure(_count_titles_in_python, library, repeat=repeat)
+        aggregated = measure(count_titles, library, repeat=repeat)
+        assert legacy['result'] == aggregated['result']
+
+        _report("python loop", legacy, copies)
+        _report("GROUP BY", aggregated, len(aggregated['result']))
+        print(f"speedup: {legacy['best'] / aggregated['best']:.1f}x")
+
+        transaction.set_rollback(True)
+
+
+def _publish_books_one_by_one(author, books):
+    # The per-item path publish_books used before it wrote in bulk.
+    for book in books:
+        author.publish_book(book)
+
+
+def bench_publish_books(books=10000):
+    with transaction.atomic():
+        author = Author.objects.create(name="Bench author")
+        library = Library.objects.create(location="Bench library")
+        print(f"publishing {books} new books")
+
+        def batch():
+            return [
+                Book(title=f"Bench title {i}", genre="bench", library=library)
+                for i in range(books)
+            ]
+
+        legacy = measure(_publish_books_one_by_one, author, batch(), repeat=1)
+        bulk = measure(author.publish_books, batch(), repeat=1)
+
+        _report("publish_book loop", legacy, books)
+        _report("publish_books", bulk, books)
+        print(f"speedup: {legacy['best'] / bulk['best']:.1f}x")
+
+        transaction.set_rollback(True)
+
+
+def _search_with_icontains(query, limit=20):
+    return list(Book.objects.filter(work__title__icontains=query)[:limit])
+
+
+def bench_search_books(authors=200, books_per_author=1000, repeat=5):
+    with transaction.atomic():
+        seed_catalogue(authors=authors, books_per_author=books_per_author, titles_per_author=1000)
+        print(f"searching {authors * books_per_author} books")
+
+        scan = measure(_search_with_icontains, "17-990", repeat=repeat)
+        indexed = measure(search_books, "17-990", repeat=repeat)
+
+        _report("work__title__icontains", scan, len(scan['result']))
+        _report("search_books (FTS5)", indexed, len(indexed['result']))
+        print(f"speedup: {scan['best'] / indexed['best']:.1f}x")
+
+        transaction.set_rollback(True)
+
+
+def _sqlite_bytes(condition, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+            f"(SELECT name FROM sqlite_schema WHERE {condition})",
+            params,
+        )
+        return cursor.fetchone()[0]
+
+
+LEGACY_BOOKS = 'bench_legacy_book'
+
+# The book table before works existed: every copy repeats the title, genre
+# and author of its work, with the indexes it had for them.
+LEGACY_SCHEMA = [
+    f"CREATE TABLE {LEGACY_BOOKS} AS "
+    f"SELECT b.id, w.title, w.genre, w.author_id, b.library_id "
+    f"FROM biblioteka_book b JOIN biblioteka_work w ON w.id = b.work_id",
+    f"CREATE INDEX {LEGACY_BOOKS}_author_idx ON {LEGACY_BOOKS} (author_id)",
+    f"CREATE INDEX {LEGACY_BOOKS}_library_idx ON {LEGACY_BOOKS} (library_id)",
+    f"CREATE INDEX {LEGACY_BOOKS}_library_title_idx ON {LEGACY_BOOKS} (library_id, title)",
+    f"CREATE INDEX {LEGACY_BOOKS}_author_title_idx ON {LEGACY_BOOKS} (author_id, title)",
+    f"CREATE INDEX {LEGACY_BOOKS}_genre_idx ON {LEGACY_BOOKS} (genre)",
+]
+
+
+def _count_legacy_titles(library):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT title, COUNT(*) FROM {LEGACY_BOOKS} WHERE library_id = %s GROUP BY title",
+            [library.pk],
+        )
+        return dict(cursor.fetchall())
+
+
+def bench_works(authors=1000, books_per_author=1000, libraries=20, repeat=5):
+    """
+    Compares books stored as copies of works with the legacy book table
+    repeating the title, genre and author in every row: their size and
+    counting the copies in a library by title. Sizes are reported on
+    SQLite only.
+    """
+    with transaction.atomic():
+        library = seed_catalogue(
+            authors=authors, books_per_author=books_per_author,
+            libraries=libraries, titles_per_author=100,
+        )[0]
+        print(f"{Book.objects.count()} copies of {Work.objects.count()} works")
+        with connection.cursor() as cursor:
+            for statement in LEGACY_SCHEMA:
+                cursor.execute(statement)
+
+        if connection.vendor == 'sqlite':
+            tables = [Book._meta.db_table, Work._meta.db_table]
+            sizes = [
+                ("legacy book table with indexes", _sqlite_bytes("tbl_name = %s", [LEGACY_BOOKS])),
+                ("books and works with indexes", _sqlite_bytes("tbl_name IN (%s, %s)", tables)),
+            ]
+            for name, size in sizes:
+                print(f"{name:<34} {size / 2 ** 20:8.1f} MiB")
+
+        legacy = measure(_count_legacy_titles, library, repeat=repeat)
+        by_title = measure(count_books, library, by='title', repeat=repeat)
+        by_work = measure(count_books, library, by='work', repeat=repeat)
+        assert legacy['result'] == by_title['result']
+        _report("legacy count by title", legacy, len(legacy['result']))
+        _report("count by title", by_title, len(by_title['result']))
+        _report("count by work", by_work, len(by_work['result']))
+
+        transaction.set_rollback(True)
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from biblioteka.models import Author, CatalogueVersion, Library
+from biblioteka.routers import use_primary
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def detail_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def detail_key(model, pk):
+    return f"biblioteka:detail:{model._meta.model_name}:{pk}"
+
+
+async def aget_detail(model, pk, build):
+    """
+    Returns the cached detail context of `model` with primary key `pk`,
+    awaiting `build()` and caching its result on a miss. `build()` reads from
+    the primary: a lagging replica would keep stale data in the cache until
+    the entry expires.
+    """
+    key = detail_key(model, pk)
+    detail = await cache.aget(key)
+    if detail is not None:
+        _count('hits')
+        return detail
+
+    _count('misses')
+    with use_primary():
+        detail = await build()
+    await cache.aset(key, detail, getattr(settings, 'BIBLIOTEKA_DETAIL_CACHE_TIMEOUT', 300))
+    return detail
+
+
+def invalidate_detail(model, pks):
+    keys = [detail_key(model, pk) for pk in pks if pk is not None]
+    if keys:
+        cache.delete_many(keys)
+        # A request running concurrently with the transaction may cache the
+        # old detail again before it commits.
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def bump_catalogue_version():
+    """
+    Marks the catalogue as changed once the current transaction commits:
+    the version is the time of the last change in nanoseconds, so it
+    doubles as Last-Modified. Bumping after the commit keeps the version
+    row locked only for one short UPDATE, not for the whole write.
+    """
+    def bump():
+        with use_primary():
+            updated = CatalogueVersion.objects.filter(pk=1).update(
+                version=Greatest(F('version') + 1, Value(time.time_ns()))
+            )
+            if not updated:
+                CatalogueVersion.objects.bulk_create(
+                    [CatalogueVersion(pk=1, version=time.time_ns())], ignore_conflicts=True,
+                )
+
+    transaction.on_commit(bump)
+
+
+def get_catalogue_version():
+    version = CatalogueVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    if version is None:
+        # A missing row starts a new version, like a change would.
+        with use_primary():
+            CatalogueVersion.objects.bulk_create(
+                [CatalogueVersion(pk=1, version=time.time_ns())], ignore_conflicts=True,
+            )
+            version = CatalogueVersion.objects.values_list('version', flat=True).get(pk=1)
+    return version
+
+
+async def aget_catalogue_version():
+    return await sync_to_async(get_catalogue_version)()
+
+
+class NameCache:
+    """
+    In-process LRU of `model` rows by their unique `field` (author names,
+    library locations), holding at most BIBLIOTEKA_NAME_CACHE_SIZE rows for
+    BIBLIOTEKA_NAME_CACHE_TTL seconds each. Rows are only cached once the
+    transaction that read them commits, so a rollback cannot leave ids of
+    rows that never existed. Saves and deletes discard their row (see
+    receivers.py); other processes see those changes after the TTL.
+    """
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.fields = [field.attname for field in model._meta.concrete_fields]
+        self.name_index = self.fields.index(field)
+        self.pk_index = self.fields.index(model._meta.pk.attname)
+        self.lock = threading.Lock()
+        self.rows = OrderedDict()
+        self.names = {}
+
+    def get(self, name):
+        """Returns a fresh instance of the cached row named `name`, or None."""
+        with self.lock:
+            entry = self.rows.get(name)
+            if entry is None:
+                return None
+            expires, values = entry
+            if expires < time.monotonic():
+                self._remove(name)
+                return None
+            self.rows.move_to_end(name)
+        return self.model.from_db(None, self.fields, values)
+
+    def lookup(self, name):
+        """Returns the row named `name` from the cache or the database, or None."""
+        obj = self.get(name)
+        if obj is None:
+            obj = self.model.objects.filter(**{self.field: name}).first()
+            if obj is not None:
+                self.put(obj)
+        return obj
+
+    def put(self, obj):
+        values = tuple(getattr(obj, attname) for attname in self.fields)
+        transaction.on_commit(lambda: self._store(values), using=obj._state.db)
+
+    def _store(self, values):
+        name, pk = values[self.name_index], values[self.pk_index]
+        size = getattr(settings, 'BIBLIOTEKA_NAME_CACHE_SIZE', 1024)
+        ttl = getattr(settings, 'BIBLIOTEKA_NAME_CACHE_TTL', 60)
+        with self.lock:
+            self._remove(name)
+            self._remove(self.names.get(pk))
+            self.rows[name] = (time.monotonic() + ttl, values)
+            self.names[pk] = name
+            while len(self.rows) > size:
+                self._remove(next(iter(self.rows)))
+
+    def _remove(self, name):
+        entry = self.rows.pop(name, None)
+        if entry is not None:
+            self.names.pop(entry[1][self.pk_index], None)
+
+    def discard(self, obj):
+        """Drops the cached row of `obj`, under its old and current name."""
+        def discard():
+            with self.lock:
+                self._remove(self.names.get(obj.pk))
+                self._remove(getattr(obj, self.field))
+
+        discard()
+        # A lookup running concurrently with the transaction may cache the
+        # old row again before it commits.
+        transaction.on_commit(discard)
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+            self.names.clear()
+
+
+author_names = NameCache(Author, 'name')
+library_locations = NameCache(Library, 'location')
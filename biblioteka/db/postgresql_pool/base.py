@@ -0,0 +1,122 @@
+"""
+PostgreSQL backend handing out connections from a per-process pool.
+
+Django opens a new connection for every request (or keeps one per thread with
+CONN_MAX_AGE). With this backend closing a connection returns it to a
+psycopg2 ThreadedConnectionPool instead, so requests served by short-lived
+threads reuse warm connections. Configure the pool in OPTIONS:
+
+    'ENGINE': 'biblioteka.db.postgresql_pool',
+    'OPTIONS': {'pool': {'min_size': 2, 'max_size': 20, 'timeout': 10}},
+
+A request waits up to `timeout` seconds for a free connection.
+"""
+import threading
+
+import psycopg2.extras
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2 import pool as psycopg2_pool
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, conn_params, min_size=1, max_size=10, timeout=10):
+        self.pool = psycopg2_pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.timeout = timeout
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                f"No free connection in the pool after {self.timeout} s"
+            )
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            # Open transactions are rolled back by psycopg2.
+            self.pool.putconn(connection, close=close)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+def get_pool(conn_params, options):
+    key = tuple(sorted(conn_params.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(conn_params, **options)
+        return _pools[key]
+
+
+def close_pools(database=None):
+    with _pools_lock:
+        for key in list(_pools):
+            if database is None or dict(key)['database'] == database:
+                _pools.pop(key).closeall()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # DROP DATABASE fails while idle pooled connections are still open.
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        # Follows base.DatabaseWrapper.get_new_connection() of Django 4.2 with
+        # psycopg2, taking the connection from the pool instead of connecting.
+        # Keep the two in sync when upgrading Django.
+        options = self.settings_dict['OPTIONS']
+        set_isolation_level = False
+        try:
+            isolation_level_value = options['isolation_level']
+        except KeyError:
+            self.isolation_level = IsolationLevel.READ_COMMITTED
+        else:
+            try:
+                self.isolation_level = IsolationLevel(isolation_level_value)
+                set_isolation_level = True
+            except ValueError:
+                raise ImproperlyConfigured(
+                    f"Invalid transaction isolation level {isolation_level_value} "
+                    f"specified. Use one of the psycopg.IsolationLevel values."
+                )
+
+        self.pool = get_pool(conn_params, options.get('pool', {}))
+        connection = self.pool.getconn()
+        # A pooled connection keeps the session of its previous user, which
+        # may have come from another alias sharing the pool: None restores
+        # the server default.
+        connection.isolation_level = self.isolation_level if set_isolation_level else None
+        # Register dummy loads() to avoid a round trip from psycopg2's decode
+        # to json.dumps() to json.loads(), when using a custom decoder in
+        # JSONField.
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # Connections that raised errors may be broken, don't reuse them.
+                self.pool.putconn(self.connection, close=self.errors_occurred)
@@ -0,0 +1,21 @@
+"""
+SQLite backend tuned for concurrent writers.
+
+Every new connection runs settings.BIBLIOTEKA_SQLITE_PRAGMAS (WAL journal,
+busy timeout, synchronous=NORMAL) and transactions start with BEGIN
+IMMEDIATE. A deferred BEGIN takes the write lock only at the first write,
+and when another connection committed in between SQLite fails with
+"database is locked" right away instead of waiting for busy_timeout.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def init_connection_state(self):
+        super().init_connection_state()
+        for pragma, value in getattr(settings, 'BIBLIOTEKA_SQLITE_PRAGMAS', {}).items():
+            self.connection.execute(f'PRAGMA {pragma} = {value}')
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
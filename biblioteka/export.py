@@ -0,0 +1,85 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+
+from biblioteka.models import Author, Book, Library
+
+EXPORTS = {
+    'books': (Book, [
+        ('id', 'id'),
+        ('title', 'work__title'),
+        ('genre', 'work__genre'),
+        ('author', 'work__author__name'),
+        ('library', 'library__location'),
+    ]),
+    'authors': (Author, [('id', 'id'), ('name', 'name')]),
+    'libraries': (Library, [('id', 'id'), ('location', 'location')]),
+}
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class _Line:
+    def write(self, value):
+        return value
+
+
+def iter_rows(entity, chunk_size=DEFAULT_CHUNK_SIZE):
+    model, columns = EXPORTS[entity]
+    queryset = model.objects.order_by('pk').values_list(*[field for _, field in columns])
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def _as_csv(entity, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow([name for name, _ in EXPORTS[entity][1]])
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def _as_jsonl(entity, rows):
+    names = [name for name, _ in EXPORTS[entity][1]]
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+
+
+def iter_export(entity, file_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns an iterator over the export of `entity` as text, one chunk of
+    rows at a time, so neither the queryset nor the rendered file is ever
+    held in memory.
+    """
+    if entity not in EXPORTS:
+        raise ValueError(f"Entity should be one of: {', '.join(EXPORTS)}")
+    if file_format not in FORMATS:
+        raise ValueError(f"Format should be one of: {', '.join(FORMATS)}")
+
+    render = _as_csv if file_format == 'csv' else _as_jsonl
+    return _in_chunks(render(entity, iter_rows(entity, chunk_size)), chunk_size)
+
+
+def _in_chunks(lines, chunk_size):
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiter_chunks(chunks):
+    """
+    Serves the chunks of iter_export() to an ASGI server one at a time:
+    each is rendered in the sync thread, which also owns the database
+    cursor, instead of Django reading the whole export into memory first.
+    """
+    chunks = iter(chunks)
+    while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+        yield chunk
@@ -0,0 +1,43 @@
+from django import forms
+
+from biblioteka.models import WORK_FIELDS, Author, Book, Work
+from biblioteka.widgets import AutocompleteSelect
+
+
+class BookForm(forms.ModelForm):
+    # Fields of the work the book is a copy of; saving the book moves it to
+    # the work they name.
+    title = forms.CharField(max_length=Work._meta.get_field('title').max_length)
+    genre = forms.CharField(max_length=Work._meta.get_field('genre').max_length)
+    author = forms.ModelChoiceField(Author.objects.all(), widget=AutocompleteSelect('authors'))
+
+    class Meta:
+        model = Book
+        fields = ['title', 'genre', 'author', 'library']
+        widgets = {
+            'library': AutocompleteSelect('libraries'),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            work = self.instance.work
+            values = {'title': work.title, 'genre': work.genre, 'author': work.author_id}
+            for name in self.fields.keys() & values.keys():
+                self.initial.setdefault(name, values[name])
+
+    def _post_clean(self):
+        for name in WORK_FIELDS:
+            if name not in self.cleaned_data:
+                continue
+            value = self.cleaned_data[name]
+            if self.instance.pk is None or getattr(self.instance, name) != value:
+                setattr(self.instance, name, value)
+        super()._post_clean()
+
+
+class BookTitleForm(BookForm):
+    author = None
+
+    class Meta(BookForm.Meta):
+        fields = ['title', 'genre']
@@ -0,0 +1,121 @@
+import copy
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.db.models import Case, Value, When
+
+from biblioteka import search
+from biblioteka.models import BULK_BATCH_SIZE, Book, Work, get_works
+
+# Columns of biblioteka_book from before works existed; their values are
+# now those of the works.
+LEGACY_COLUMNS = ('title', 'genre', 'author_id')
+LEGACY_INDEXES = ('book_library_title_idx', 'book_author_title_idx', 'book_genre_idx')
+LEGACY_SEARCH_INDEX = 'biblioteka_book_fts'
+
+
+def _nullable_work_field():
+    field = copy.copy(Book._meta.get_field('work'))
+    field.null = True
+    return field
+
+
+def _legacy_field(column):
+    if column == 'author_id':
+        field = models.ForeignKey('biblioteka.Author', on_delete=models.CASCADE)
+        field.set_attributes_from_name('author')
+    else:
+        field = models.CharField(max_length=50)
+        field.set_attributes_from_name(column)
+    field.model = Book
+    return field
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves books stored with their own title, genre and author onto works, "
+        "creating the works, one committed batch at a time, then drops those columns "
+        "from biblioteka_book. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size has to be positive")
+
+        tables = connection.introspection.table_names()
+        columns = self.book_columns()
+        if 'title' not in columns:
+            self.stdout.write("Books are already stored as copies of works.")
+            return
+
+        with connection.schema_editor() as editor:
+            if Work._meta.db_table not in tables:
+                editor.create_model(Work)
+            if 'work_id' not in columns:
+                editor.add_field(Book, _nullable_work_field())
+                editor.add_index(Book, Book._meta.indexes[0])
+
+        linked = 0
+        start = time.perf_counter()
+        while True:
+            with transaction.atomic():
+                count = self.link_batch(batch_size)
+            if not count:
+                break
+            linked += count
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{linked} books linked ({linked / elapsed:.0f} books/s)")
+
+        self.drop_legacy_columns()
+        self.stdout.write(self.style.SUCCESS(
+            f"Linked {linked} books in {time.perf_counter() - start:.1f} s."
+        ))
+
+    def book_columns(self):
+        with connection.cursor() as cursor:
+            description = connection.introspection.get_table_description(
+                cursor, Book._meta.db_table
+            )
+        return {column.name for column in description}
+
+    def link_batch(self, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, author_id, title, genre FROM {Book._meta.db_table} "
+                f"WHERE work_id IS NULL ORDER BY id LIMIT %s",
+                [batch_size],
+            )
+            rows = cursor.fetchall()
+        works = get_works(tuple(row[1:]) for row in rows)
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            batch = rows[start:start + BULK_BATCH_SIZE]
+            ids = {}
+            for pk, *key in batch:
+                ids.setdefault(works[tuple(key)].pk, []).append(pk)
+            Book.objects.filter(pk__in=[pk for pk, *_ in batch]).update(work=Case(
+                *[When(pk__in=pks, then=Value(work_id)) for work_id, pks in ids.items()]
+            ))
+        return len(rows)
+
+    def drop_legacy_columns(self):
+        with connection.cursor() as cursor:
+            for name in LEGACY_INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
+            if search.is_supported():
+                cursor.execute(f"DROP TABLE IF EXISTS {LEGACY_SEARCH_INDEX}")
+                for trigger in ('book_insert', 'book_update', 'book_delete', 'author_update'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {LEGACY_SEARCH_INDEX}_{trigger}")
+
+        with connection.schema_editor() as editor:
+            # SQLite cannot drop the author_id foreign key column, but making
+            # work NOT NULL rebuilds the table with the model's columns only.
+            if connection.vendor != 'sqlite':
+                for column in LEGACY_COLUMNS:
+                    editor.remove_field(Book, _legacy_field(column))
+            editor.alter_field(Book, _nullable_work_field(), Book._meta.get_field('work'))
+        search.install_search_index()
@@ -0,0 +1,94 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from biblioteka.benchmarks import (
+    compare, measure, peak_memory, seed_sample, untimed_utils, url_cases, utils_cases,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times every helper from biblioteka.utils and every URL from biblioteka.urls "
+        "on a synthetic catalogue seeded into a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--books', type=int, default=20, help="Books per author.")
+        parser.add_argument('--libraries', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('-o', '--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="JSON file written by an earlier run to compare with.")
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help="Allowed slowdown against the baseline, 0.2 = 20%%.",
+        )
+
+    def handle(self, *args, **options):
+        if min(options['authors'], options['books'], options['libraries'], options['repeat']) < 1:
+            raise CommandError("--authors, --books, --libraries and --repeat have to be positive")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run_cases(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            catalogue = {key: options[key] for key in ('authors', 'books', 'libraries', 'repeat')}
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'catalogue': catalogue, 'results': results}, f, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def run_cases(self, options):
+        sample = seed_sample(options['authors'], options['books'], options['libraries'])
+        helpers = utils_cases(sample)
+        for name in untimed_utils(helpers):
+            self.stdout.write(self.style.WARNING(f"biblioteka.utils.{name} has no benchmark case"))
+
+        cases = {f"utils.{name}": func for name, func in helpers.items()}
+        cases.update({f"url.{name}": func for name, func in url_cases(sample).items()})
+
+        self.stdout.write(
+            f"{'case':<36} {'first ms':>9} {'best ms':>9} {'mean ms':>9} {'queries':>8} "
+            f"{'warm':>5} {'peak KiB':>9} {'render cold ms':>15} {'render warm ms':>15}"
+        )
+        results = {}
+        for name, func in cases.items():
+            cache.clear()
+            with transaction.atomic():
+                stats = measure(func, repeat=options['repeat'])
+                memory = peak_memory(func)
+                transaction.set_rollback(True)
+            results[name] = {
+                'first_ms': stats['first'] * 1000,
+                'best_ms': stats['best'] * 1000,
+                'mean_ms': stats['mean'] * 1000,
+                'queries': stats['queries'],
+                'queries_warm': stats['queries_warm'],
+                'peak_kib': memory / 1024,
+                'render_cold_ms': stats['render_first'] * 1000,
+                'render_warm_ms': stats['render_warm'] * 1000,
+            }
+            self.stdout.write(
+                f"{name:<36} {results[name]['first_ms']:9.2f} {results[name]['best_ms']:9.2f} "
+                f"{results[name]['mean_ms']:9.2f} {stats['queries']:8d} {stats['queries_warm']:5d} "
+                f"{memory / 1024:9.1f} "
+                f"{results[name]['render_cold_ms']:15.2f} {results[name]['render_warm_ms']:15.2f}"
+            )
+        return results
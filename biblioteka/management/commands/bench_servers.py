@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.urls import reverse
+
+from biblioteka.benchmarks import (
+    asgi_throughput, seed_sample, simulated_db_latency, throwaway_database, wsgi_throughput,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of the catalogue list and detail views served through "
+        "the WSGI handler (a pool of worker threads) and the ASGI handler (one event loop)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument('--concurrency', type=int, default=64, help="Concurrent ASGI requests.")
+        parser.add_argument(
+            '--db-latency', type=float, default=5,
+            help="Milliseconds added to every query, standing in for a network database.",
+        )
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--books', type=int, default=20, help="Books per author.")
+        parser.add_argument('--libraries', type=int, default=10)
+        parser.add_argument('-o', '--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if min(options['requests'], options['threads'], options['concurrency']) < 1:
+            raise CommandError("--requests, --threads and --concurrency have to be positive")
+        if options['db_latency'] < 0:
+            raise CommandError("--db-latency can't be negative")
+
+        with throwaway_database():
+            sample = seed_sample(options['authors'], options['books'], options['libraries'])
+            paths = [
+                reverse('biblioteka:book-list'),
+                reverse('biblioteka:author-list'),
+                reverse('biblioteka:library-list'),
+                reverse('biblioteka:book-detail', args=[sample['book'].pk]),
+                reverse('biblioteka:author-detail', args=[sample['author'].pk]),
+                reverse('biblioteka:library-detail', args=[sample['library'].pk]),
+            ]
+            connections.close_all()
+            with simulated_db_latency(options['db_latency'] / 1000):
+                results = {
+                    'wsgi': wsgi_throughput(paths, options['requests'], options['threads']),
+                    'asgi': asgi_throughput(paths, options['requests'], options['concurrency']),
+                }
+
+        for handler, stats in results.items():
+            self.stdout.write(
+                f"{handler}: {stats['requests']} requests in {stats['seconds']:.2f} s "
+                f"({stats['requests_per_second']:.0f} req/s), {stats['errors']} errors"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
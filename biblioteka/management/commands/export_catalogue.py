@@ -0,0 +1,27 @@
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteka.export import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = "Streams books, authors or libraries to a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entity', choices=list(EXPORTS), default='books')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('-o', '--output', help="Output file, standard output by default.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size has to be positive")
+        content = iter_export(options['entity'], options['format'], options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for chunk in content:
+                    output.write(chunk)
+        else:
+            for chunk in content:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,165 @@
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from biblioteka.models import (
+    BULK_BATCH_SIZE, Author, Book, ImportProgress, Library, attach_works, chunks,
+)
+from biblioteka.signals import books_changed
+from biblioteka.utils import build_book
+
+FORMATS = ('csv', 'jsonl')
+
+
+def read_csv(path, skip=0):
+    with open(path, newline='', encoding='utf-8') as source:
+        # Quoted values may span lines, so skipped rows are still parsed.
+        yield from islice(csv.DictReader(source), skip, None)
+
+
+def read_jsonl(path, skip=0):
+    with open(path, encoding='utf-8') as source:
+        lines = ((number, line) for number, line in enumerate(source, start=1) if line.strip())
+        for number, line in islice(lines, skip, None):
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise CommandError(f"Line {number}: {e}")
+            if not isinstance(row, dict):
+                raise CommandError(f"Line {number}: expected a JSON object")
+            yield row
+
+
+class LookupCache:
+    """
+    Resolves names to model objects, creating the missing ones in bulk.
+    Like cache.NameCache it is an LRU of at most `size` objects
+    (BIBLIOTEKA_NAME_CACHE_SIZE by default), but never evicts the names
+    of the chunk being resolved.
+    """
+
+    def __init__(self, model, field, size=None):
+        self.model = model
+        self.field = field
+        self.size = size or getattr(settings, 'BIBLIOTEKA_NAME_CACHE_SIZE', 1024)
+        self.objects = OrderedDict()
+
+    def resolve(self, names):
+        missing = {name for name in names if name not in self.objects}
+        if missing:
+            self._load(missing)
+            to_create = missing - set(self.objects)
+            if to_create:
+                self.model.objects.bulk_create(
+                    [self.model(**{self.field: name}) for name in to_create],
+                    batch_size=BULK_BATCH_SIZE,
+                )
+                self._load(to_create)
+        for name in names:
+            if name in self.objects:
+                self.objects.move_to_end(name)
+        while len(self.objects) > max(self.size, len(names)):
+            self.objects.popitem(last=False)
+
+    def _load(self, names):
+        for chunk in chunks(names):
+            for obj in self.model.objects.filter(**{f'{self.field}__in': chunk}):
+                self.objects[getattr(obj, self.field)] = obj
+
+    def __getitem__(self, name):
+        return self.objects[name]
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports books from a CSV or JSON Lines file with title, genre, author and library "
+        "columns. An interrupted import resumes after the last committed row: JSON Lines "
+        "files skip the committed lines without decoding them, CSV files parse them again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore the progress saved by a previous, interrupted import of this file.",
+        )
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f"File {path} does not exist")
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Unknown format {file_format!r}, use --format ({', '.join(FORMATS)})")
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size has to be positive")
+
+        progress, _ = ImportProgress.objects.get_or_create(source=path)
+        if options['restart']:
+            progress.rows = 0
+            progress.save()
+        elif progress.rows:
+            self.stdout.write(f"Resuming after row {progress.rows}.")
+
+        authors = LookupCache(Author, 'name')
+        libraries = LookupCache(Library, 'location')
+        read = read_csv if file_format == 'csv' else read_jsonl
+        rows = read(path, skip=progress.rows)
+
+        imported = 0
+        start = time.perf_counter()
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                self.import_chunk(chunk, progress.rows, authors, libraries)
+                progress.rows += len(chunk)
+                progress.save(update_fields=['rows'])
+            imported += len(chunk)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{progress.rows} rows committed ({imported / elapsed:.0f} rows/s)"
+            )
+
+        progress.delete()
+        elapsed = time.perf_counter() - start
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} books in {elapsed:.1f} s ({rate:.0f} rows/s)."
+        ))
+
+    def import_chunk(self, chunk, offset, authors, libraries):
+        authors.resolve({row.get('author') or '' for row in chunk} - {''})
+        libraries.resolve({row.get('library') or '' for row in chunk} - {''})
+
+        books = []
+        for number, row in enumerate(chunk, start=offset + 1):
+            if not row.get('author'):
+                raise CommandError(f"Row {number}: missing author")
+            library = libraries[row['library']] if row.get('library') else None
+            try:
+                books.append(build_book(
+                    row.get('title'), row.get('genre'), authors[row['author']], library
+                ))
+            except ValueError as e:
+                raise CommandError(f"Row {number}: {e}")
+        attach_works(books)
+        Book.objects.bulk_create(books, batch_size=BULK_BATCH_SIZE)
+        books_changed.send(
+            sender=Book,
+            book_ids=[],
+            author_ids={book.author_id for book in books},
+            library_ids={book.library_id for book in books} - {None},
+            genres={book.genre for book in books},
+        )
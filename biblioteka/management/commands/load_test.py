@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from biblioteka.benchmarks import concurrent_writes, throwaway_database
+from biblioteka.models import Author, Library
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent writers adding books to a throwaway test database created "
+        "with the configured engine (a file for SQLite, test_<NAME> for PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=100, help="Books added by every thread.")
+        parser.add_argument('--authors', type=int, default=20)
+        parser.add_argument('--libraries', type=int, default=5)
+        parser.add_argument('-o', '--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['writes'], options['authors'], options['libraries']) < 1:
+            raise CommandError("--threads, --writes, --authors and --libraries have to be positive")
+
+        with throwaway_database():
+            results = self.run_writers(options)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    def run_writers(self, options):
+        Author.objects.bulk_create(
+            Author(name=f"Load author {i}") for i in range(options['authors'])
+        )
+        Library.objects.bulk_create(
+            Library(location=f"Load library {i}") for i in range(options['libraries'])
+        )
+        # bulk_create sets primary keys on PostgreSQL only.
+        authors = list(Author.objects.order_by('pk'))
+        libraries = list(Library.objects.order_by('pk'))
+        connection.close()
+
+        results = concurrent_writes(authors, libraries, options['threads'], options['writes'])
+        results['vendor'] = connection.vendor
+        self.stdout.write(
+            f"{connection.vendor}: {results['writes']} writes in {results['seconds']:.2f} s "
+            f"({results['writes_per_second']:.0f} writes/s), p50 {results['p50_ms']:.1f} ms, "
+            f"p95 {results['p95_ms']:.1f} ms, max {results['max_ms']:.1f} ms"
+        )
+        for error, count in results['failures'].items():
+            self.stdout.write(self.style.ERROR(f"{count} x {error}"))
+        return results
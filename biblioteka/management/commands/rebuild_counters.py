@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from biblioteka.stats import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes the per-library, per-author and per-genre book counters from scratch."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f"Counters rebuilt in {time.perf_counter() - start:.1f} s."
+        ))
@@ -0,0 +1,116 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from biblioteka.models import Book
+
+AUTHOR_LINKS = 'biblioteka_author_books'
+LIBRARY_LINKS = 'biblioteka_library_books'
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves book ownership stored in the legacy Author.books/Library.books "
+        "junction tables onto the Work.author/Book.library foreign keys. "
+        "Run it before applying the migration that drops those tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report drift between the junction tables and the foreign keys.",
+        )
+        parser.add_argument(
+            '--drop-legacy', action='store_true',
+            help="Drop the junction tables once the foreign keys have been repaired.",
+        )
+
+    def handle(self, *args, **options):
+        tables = set(connection.introspection.table_names())
+        legacy = [table for table in (AUTHOR_LINKS, LIBRARY_LINKS) if table in tables]
+        if not legacy:
+            self.stdout.write("No legacy junction tables found, nothing to do.")
+            return
+
+        if AUTHOR_LINKS in tables:
+            self.report_author_drift()
+        if LIBRARY_LINKS in tables:
+            self.report_library_drift()
+            if not options['dry_run']:
+                self.repair_library_links(options['batch_size'])
+
+        if options['drop_legacy'] and not options['dry_run']:
+            with connection.cursor() as cursor:
+                for table in legacy:
+                    cursor.execute(f"DROP TABLE {connection.ops.quote_name(table)}")
+            self.stdout.write(f"Dropped {', '.join(legacy)}.")
+
+    def count(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def report_author_drift(self):
+        mismatched = self.count(
+            f"SELECT COUNT(*) FROM {AUTHOR_LINKS} l "
+            f"JOIN biblioteka_book b ON b.id = l.book_id "
+            f"JOIN biblioteka_work w ON w.id = b.work_id "
+            f"WHERE w.author_id <> l.author_id"
+        )
+        self.stdout.write(
+            f"{mismatched} author links disagree with the authors of the works "
+            f"(the works are kept)."
+        )
+
+    def report_library_drift(self):
+        missing = self.count(
+            f"SELECT COUNT(DISTINCT l.book_id) FROM {LIBRARY_LINKS} l "
+            f"JOIN biblioteka_book b ON b.id = l.book_id "
+            f"WHERE b.library_id IS NULL"
+        )
+        mismatched = self.count(
+            f"SELECT COUNT(*) FROM {LIBRARY_LINKS} l "
+            f"JOIN biblioteka_book b ON b.id = l.book_id "
+            f"WHERE b.library_id IS NOT NULL AND b.library_id <> l.library_id"
+        )
+        ambiguous = self.count(
+            f"SELECT COUNT(*) FROM (SELECT book_id FROM {LIBRARY_LINKS} "
+            f"GROUP BY book_id HAVING COUNT(*) > 1) shared"
+        )
+        self.stdout.write(f"{missing} books are linked to a library only through {LIBRARY_LINKS}.")
+        self.stdout.write(
+            f"{mismatched} library links disagree with Book.library (the foreign key is kept)."
+        )
+        if ambiguous:
+            self.stdout.write(self.style.WARNING(
+                f"{ambiguous} books are linked to several libraries; "
+                f"the one with the lowest id is kept."
+            ))
+
+    def repair_library_links(self, batch_size):
+        last_id = 0
+        repaired = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT l.book_id, MIN(l.library_id) FROM {LIBRARY_LINKS} l "
+                    f"JOIN biblioteka_book b ON b.id = l.book_id "
+                    f"WHERE b.library_id IS NULL AND l.book_id > %s "
+                    f"GROUP BY l.book_id ORDER BY l.book_id LIMIT %s",
+                    [last_id, batch_size],
+                )
+                rows = cursor.fetchall()
+            if not rows:
+                break
+
+            by_library = {}
+            for book_id, library_id in rows:
+                by_library.setdefault(library_id, []).append(book_id)
+            with transaction.atomic():
+                for library_id, book_ids in by_library.items():
+                    repaired += Book.objects.filter(pk__in=book_ids).update(library_id=library_id)
+
+            last_id = rows[-1][0]
+            self.stdout.write(f"Repaired {repaired} books so far (last book id {last_id}).")
+
+        self.stdout.write(self.style.SUCCESS(f"Book.library set for {repaired} books."))
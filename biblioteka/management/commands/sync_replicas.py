@@ -0,0 +1,37 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the SQLite primary database into the replica files with the SQLite "
+        "backup API, standing in for replication when running locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help="Replica files, by default the NAMEs of settings.BIBLIOTEKA_DB_REPLICAS.",
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError("Only SQLite replicas can be synced, use the database's replication")
+        paths = options['paths'] or [
+            connections[alias].settings_dict['NAME'] for alias in settings.BIBLIOTEKA_DB_REPLICAS
+        ]
+        if not paths:
+            raise CommandError("No replicas configured, set BIBLIOTEKA_DB_REPLICAS or pass paths")
+
+        primary.ensure_connection()
+        for path in paths:
+            target = sqlite3.connect(path)
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"Copied the primary to {path}.")
@@ -1,25 +1,151 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Case, Value, When
 from django.urls import reverse
 
+from biblioteka.routers import use_primary
+from biblioteka.signals import books_changed
 
-class Book(models.Model):
+BULK_BATCH_SIZE = 500
+
+
+def chunks(items, size=BULK_BATCH_SIZE):
+    """Yields `items` as lists of at most `size`, e.g. for bounded IN (...) lists."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Work(models.Model):
+    """A title by an author in a genre, of which books are the copies."""
     title = models.CharField(max_length=50)
-    author = models.ForeignKey(
-        "Author",
-        on_delete=models.CASCADE,
-        verbose_name="author",
-        related_name='+',
-    )
+    author = models.ForeignKey("Author", on_delete=models.CASCADE, related_name='works')
     genre = models.CharField(max_length=25)
+
+    class Meta:
+        # The unique index also serves the lookups by author and title.
+        unique_together = [('author', 'title', 'genre')]
+        indexes = [
+            models.Index(fields=['title'], name='work_title_idx'),
+            models.Index(fields=['genre'], name='work_genre_idx'),
+        ]
+
+    def __str__(self):
+        return str(f"{self.author} - {self.title}")
+
+
+# Fields of a book that are those of its work. Book takes them as properties;
+# queries reach them through work__, see book_lookup().
+WORK_FIELDS = ('title', 'genre', 'author')
+
+
+def book_lookup(lookup):
+    """Returns the Book lookup for `lookup`, which may name a field of the work."""
+    if lookup.split('__')[0] in WORK_FIELDS + ('author_id',):
+        return f'work__{lookup}'
+    return lookup
+
+
+def _work_field(name):
+    def get(self):
+        new_work = self.__dict__.get('_new_work', {})
+        if name in new_work:
+            return new_work[name]
+        return getattr(self.work, name)
+
+    def set(self, value):
+        self.__dict__.setdefault('_new_work', {})[name] = value
+
+    return property(get, set)
+
+
+class BookManager(models.Manager):
+    def get_queryset(self):
+        # A book without its work has no title: always read them together.
+        return super().get_queryset().select_related('work')
+
+
+class Book(models.Model):
+    work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='copies')
     library = models.ForeignKey(
         "Library",
         on_delete=models.CASCADE,
         verbose_name="library",
-        related_name='+',
+        related_name='books',
         blank=True,
         null=True,
     )
 
+    objects = BookManager()
+
+    # Setting any of these moves the book to another work when it is saved.
+    title = _work_field('title')
+    genre = _work_field('genre')
+    author = _work_field('author')
+
+    class Meta:
+        ordering = ['id']
+        # The single-column foreign key indexes keep per-work and per-library
+        # lists in id order; this one serves the per-library groupings.
+        indexes = [
+            models.Index(fields=['library', 'work'], name='book_library_work_idx'),
+        ]
+
+    @property
+    def author_id(self):
+        new_work = self.__dict__.get('_new_work', {})
+        if 'author' in new_work:
+            return new_work['author'] and new_work['author'].pk
+        return self.work.author_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # Lets signal receivers see where a book was before it got moved.
+        book._loaded_values = dict(zip(field_names, values))
+        return book
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields} - set(WORK_FIELDS)
+        # The work and the counters (see receivers.py) are written with the
+        # book or not at all. delete() is atomic already, the collector sends
+        # post_delete inside its transaction.
+        using = kwargs.get('using') or router.db_for_write(Book, instance=self)
+        with transaction.atomic(using=using):
+            if self.__dict__.get('_new_work'):
+                if Book.work.is_cached(self):
+                    # Keeps the replaced work for the receivers, see loaded_work().
+                    self._loaded_work = self.work
+                attach_works([self])
+                if update_fields is not None:
+                    kwargs['update_fields'].add('work')
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+    def loaded_work(self):
+        """
+        Returns the work the book was a copy of when it was loaded or last
+        saved, or None when that is unknown.
+        """
+        work_id = getattr(self, '_loaded_values', {}).get('work_id')
+        if work_id is None:
+            return None
+        if work_id == self.work_id:
+            return self.work
+        loaded = self.__dict__.get('_loaded_work')
+        if loaded is None or loaded.pk != work_id:
+            # Works never change: this one still holds the previous values.
+            loaded = self._loaded_work = Work.objects.filter(pk=work_id).first()
+        return loaded
+
+    def work_key(self):
+        """Returns the (author id, title, genre) of the book's work."""
+        return (self.author_id, self.title, self.genre)
+
     def __str__(self):
         return str(f"{self.author} - {self.title}")
 
@@ -27,26 +153,98 @@ class Book(models.Model):
         return reverse('biblioteka:book-detail', kwargs={'id': self.pk})
 
 
+def get_works(keys):
+    """
+    Returns {(author_id, title, genre): Work} for `keys`, creating the
+    missing works in bulk.
+    """
+    keys = list(set(keys))
+    found = {}
+
+    def load(batch):
+        works = Work.objects.filter(
+            author_id__in={author_id for author_id, _, _ in batch},
+            title__in={title for _, title, _ in batch},
+        )
+        for work in works:
+            found[(work.author_id, work.title, work.genre)] = work
+
+    for batch in chunks(keys):
+        load(batch)
+        missing = [key for key in batch if key not in found]
+        if missing:
+            # Another writer may create the same works concurrently.
+            Work.objects.bulk_create(
+                [Work(author_id=author_id, title=title, genre=genre)
+                 for author_id, title, genre in missing],
+                ignore_conflicts=True,
+            )
+            load(missing)
+    return {key: found[key] for key in keys}
+
+
+def attach_works(books):
+    """
+    Points every book of the batch whose title, genre or author was set at
+    its work, creating the missing works.
+    """
+    books = [book for book in books if book.__dict__.get('_new_work')]
+    keys = [book.work_key() for book in books]
+    works = get_works(keys)
+    for book, key in zip(books, keys):
+        author = book.__dict__.pop('_new_work').get('author')
+        book.work = works[key]
+        if author is not None:
+            # Saves a query when the author is read back.
+            book.work.author = author
+
+
+def relink_works(books, **changes):
+    """
+    Moves the saved `books` (a queryset) to the works with `changes` (title,
+    genre and/or author) applied, creating the missing works, with one
+    UPDATE per BULK_BATCH_SIZE distinct works. Returns {book id: work}.
+    """
+    if 'author' in changes:
+        changes['author_id'] = changes.pop('author').pk
+    rows = list(books.values_list('pk', 'work_id', 'work__author_id', 'work__title', 'work__genre'))
+    old_keys = {}
+    for _, work_id, author_id, title, genre in rows:
+        old_keys[work_id] = (
+            changes.get('author_id', author_id),
+            changes.get('title', title),
+            changes.get('genre', genre),
+        )
+    works = get_works(old_keys.values())
+    moves = {work_id: works[key] for work_id, key in old_keys.items()}
+    for batch in chunks(moves):
+        books.filter(work_id__in=batch).update(work=Case(
+            *[When(work_id=work_id, then=Value(moves[work_id].pk)) for work_id in batch]
+        ))
+    return {pk: moves[work_id] for pk, work_id, _, _, _ in rows}
+
+
 class Author(models.Model):
     name = models.CharField(max_length=50, unique=True)
-    books = models.ManyToManyField(
-        "Book",
-        verbose_name="books",
-        related_name='+',
-        blank=True,
-    )
 
+    @use_primary()
     def publish_book(self, book):
         if type(book) != Book:
             raise ValueError("Given argument is not a Book object")
-        self.books.add(book)
         book.author = self
-        self.save()
-        book.save()
+        if book.pk is None:
+            book.save()
+        else:
+            book.save(update_fields=['author'])
     
+    @use_primary()
     def publish_books(self, books):
-        for book in books:
-            self.publish_book(book)
+        return _assign_books(books, author=self)
+
+    @property
+    def books(self):
+        """The copies of the author's works."""
+        return Book.objects.filter(work__author=self)
 
     def __str__(self):
         return str(self.name)
@@ -57,27 +255,171 @@ class Author(models.Model):
 
 class Library(models.Model):
     location = models.CharField(max_length=100, blank=True, null=True, unique=True)
-    books = models.ManyToManyField(
-        Book,
-        verbose_name="books",
-        related_name='+',
-        blank=True,
-    )
 
+    @use_primary()
     def add_book(self, book):
         if type(book) != Book:
             raise ValueError("Given argument is not a Book object")
-        self.books.add(book)
         book.library = self
-        self.save()
-        book.save()
+        if book.pk is None:
+            book.save()
+        else:
+            book.save(update_fields=['library'])
     
+    @use_primary()
     def add_books(self, books):
-        for book in books:
-            self.publish_book(book)
+        return _assign_books(books, library=self)
 
     def __str__(self):
         return str(self.location)
 
     def get_absolute_url(self):
         return reverse('biblioteka:library-detail', kwargs={'id': self.pk})
+
+
+
+class ImportProgress(models.Model):
+    source = models.CharField(max_length=255, unique=True)
+    rows = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(f"{self.source}: {self.rows}")
+
+
+class LibraryStats(models.Model):
+    library = models.OneToOneField(
+        Library, on_delete=models.CASCADE, primary_key=True, related_name='stats'
+    )
+    books = models.PositiveIntegerField(default=0)
+    titles = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(f"{self.library}: {self.books} books, {self.titles} titles")
+
+
+class LibraryTitleCount(models.Model):
+    library = models.ForeignKey(Library, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=50)
+    copies = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('library', 'title')]
+        # Covers the title availability lookups (utils.find_title_availability).
+        indexes = [
+            models.Index(fields=['title', 'library', 'copies'], name='title_availability_idx'),
+        ]
+
+    def __str__(self):
+        return str(f"{self.library} - {self.title}: {self.copies}")
+
+
+class AuthorStats(models.Model):
+    author = models.OneToOneField(
+        Author, on_delete=models.CASCADE, primary_key=True, related_name='stats'
+    )
+    books = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(f"{self.author}: {self.books} books")
+
+
+class GenreTitleCount(models.Model):
+    genre = models.CharField(max_length=25)
+    title = models.CharField(max_length=50)
+    copies = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('genre', 'title')]
+
+    def __str__(self):
+        return str(f"{self.genre} - {self.title}: {self.copies}")
+
+
+class GenreStats(models.Model):
+    genre = models.CharField(max_length=25, primary_key=True)
+    books = models.PositiveIntegerField(default=0)
+    titles = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(f"{self.genre}: {self.books} books, {self.titles} titles")
+
+
+class CatalogueVersion(models.Model):
+    """
+    A single row holding the time of the last catalogue change in
+    nanoseconds (see biblioteka.cache.bump_catalogue_version). It lives in
+    the database so that every worker process sees the same version.
+    """
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+
+def _assign_books(books, **values):
+    """
+    Sets `values` (author or library) on every book of the batch and writes
+    the whole batch in one transaction: unsaved books are inserted with
+    bulk_create and saved ones are moved with UPDATE ... WHERE id IN (...),
+    BULK_BATCH_SIZE rows per statement. Returns a (book, created) pair for
+    every book.
+    """
+    books = list(books)
+    if any(type(book) != Book for book in books):
+        raise ValueError("Given argument is not a Book object")
+
+    results = [(book, book.pk is None) for book in books]
+    new_books = [book for book, created in results if created]
+    existing_ids = [book.pk for book, created in results if not created]
+    for book in new_books:
+        for field, value in values.items():
+            setattr(book, field, value)
+
+    author_ids = {book.author_id for book in new_books}
+    library_ids = {book.library_id for book in new_books}
+    genres = {book.genre for book in new_books}
+    works = {}
+    with transaction.atomic():
+        attach_works(new_books)
+        Book.objects.bulk_create(new_books, batch_size=BULK_BATCH_SIZE)
+        for chunk in chunks(existing_ids):
+            batch = Book.objects.filter(pk__in=chunk)
+            for author_id, library_id in batch.values_list('work__author_id', 'library_id'):
+                author_ids.add(author_id)
+                library_ids.add(library_id)
+            if 'author' in values:
+                works.update(relink_works(batch, author=values['author']))
+            else:
+                batch.update(**values)
+    author_ids.update(work.author_id for work in works.values())
+    if 'library' in values:
+        library_ids.add(values['library'] and values['library'].pk)
+
+    # The rows changed behind the instances' backs: record what is stored
+    # now, or a later save() would count the move again (see receivers.py).
+    for book, created in results:
+        if created:
+            book._loaded_values = {
+                field.attname: getattr(book, field.attname)
+                for field in Book._meta.concrete_fields
+            }
+            continue
+        if book.pk in works:
+            book.work = works[book.pk]
+            book.work.author = values['author']
+        if 'library' in values:
+            book.library = values['library']
+        loaded = getattr(book, '_loaded_values', None)
+        if loaded is not None:
+            loaded['work_id'] = book.work_id
+            if 'library' in values:
+                loaded['library_id'] = book.library_id
+
+    books_changed.send(
+        sender=Book,
+        book_ids=existing_ids,
+        author_ids=author_ids - {None},
+        library_ids=library_ids - {None},
+        genres=genres,
+    )
+    return results
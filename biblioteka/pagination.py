@@ -0,0 +1,82 @@
+from django.conf import settings
+
+
+def get_page_size(requested=None):
+    default = getattr(settings, 'BIBLIOTEKA_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'BIBLIOTEKA_MAX_PAGE_SIZE', 500)
+    try:
+        size = int(requested)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def parse_cursor(value):
+    """Returns the id a keyset cursor parameter points at, or None."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, page_size, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def keyset_paginate(queryset, after=None, before=None, page_size=None):
+    """
+    Returns one page of `queryset` ordered by primary key.
+
+    Rows are located with `pk > after` / `pk < before` instead of OFFSET,
+    so the cost of a page does not depend on how deep into the table it is.
+    """
+    page_size = get_page_size(page_size)
+
+    if before is not None:
+        rows = list(queryset.filter(pk__lt=before).order_by('-pk')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        next_cursor = rows[-1].pk if rows else None
+        prev_cursor = rows[0].pk if has_more else None
+    else:
+        ordered = queryset.order_by('pk')
+        if after is not None:
+            ordered = ordered.filter(pk__gt=after)
+        rows = list(ordered[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = rows[-1].pk if has_more else None
+        prev_cursor = rows[0].pk if after is not None and rows else None
+
+    return KeysetPage(rows, page_size, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def paginate_request(request, queryset):
+    return keyset_paginate(
+        queryset,
+        after=parse_cursor(request.GET.get('after')),
+        before=parse_cursor(request.GET.get('before')),
+        page_size=request.GET.get('size'),
+    )
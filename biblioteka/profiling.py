@@ -0,0 +1,254 @@
+"""
+Per-route request profiling.
+
+QueryProfilingMiddleware records query counts, database time, template
+render time and total latency of every request into in-process histograms,
+and warns about N+1 patterns: the same SQL shape executed many times in one
+request. The `metrics` view exposes everything in the Prometheus text format.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+from biblioteka.cache import detail_cache_stats
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, value):
+        with self.lock:
+            series = self.series.setdefault(
+                route, {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for route, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{route="{route}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{route="{route}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{route="{route}"}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{route="{route}"}} {series["count"]}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, route, amount=1):
+        with self.lock:
+            self.series[route] += amount
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self.lock:
+            for route, value in sorted(self.series.items()):
+                lines.append(f'{self.name}{{route="{route}"}} {value}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'biblioteka_request_duration_seconds', "Total time spent handling a request.", SECONDS_BUCKETS
+)
+DB_SECONDS = Histogram(
+    'biblioteka_request_db_seconds', "Time spent executing SQL in a request.", SECONDS_BUCKETS
+)
+TEMPLATE_SECONDS = Histogram(
+    'biblioteka_request_template_seconds', "Time spent rendering templates in a request.",
+    SECONDS_BUCKETS,
+)
+QUERIES = Histogram(
+    'biblioteka_request_queries', "Number of SQL queries executed in a request.", QUERY_BUCKETS
+)
+N_PLUS_ONE = CounterMetric(
+    'biblioteka_n_plus_one_total', "Requests repeating one SQL shape at least the N+1 threshold."
+)
+METRICS = [REQUEST_SECONDS, DB_SECONDS, TEMPLATE_SECONDS, QUERIES, N_PLUS_ONE]
+
+
+class RequestProfile:
+    def __init__(self, parent=None):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.shapes = Counter()
+        # Async views run a request's queries in several threads.
+        self.lock = threading.Lock()
+        # The profile of an enclosing profile_block(), which counts the
+        # queries and renders of the requests made inside it too.
+        self.parent = parent
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - start)
+
+    def record_query(self, sql, seconds):
+        with self.lock:
+            self.db_seconds += seconds
+            self.queries += 1
+            self.shapes[sql_shape(sql)] += 1
+        if self.parent is not None:
+            self.parent.record_query(sql, seconds)
+
+    def record_render(self, seconds):
+        with self.lock:
+            self.template_seconds += seconds
+        if self.parent is not None:
+            self.parent.record_render(seconds)
+
+
+_profile = contextvars.ContextVar('biblioteka_request_profile', default=None)
+
+
+def profile_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper of every connection (installed by receivers.py), so the
+    queries async views run in worker threads are profiled too.
+    """
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+@contextmanager
+def profile_block():
+    """
+    Profiles the block like a request: the queries of every connection,
+    including those of threads that copy the context (sync_to_async,
+    gather_reads), and the template renders.
+    """
+    profile = RequestProfile(parent=_profile.get())
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+
+def sql_shape(sql):
+    # IN (%s, %s, ...) lists of any length count as the same statement.
+    return re.sub(r'%s(, %s)+', '%s, ...', sql)
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile = _profile.get()
+            if profile is not None:
+                profile.record_render(time.perf_counter() - start)
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend timing every top-level template render."""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
+
+
+class QueryProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile(parent=_profile.get())
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.observe(request, profile, start)
+        return response
+
+    async def __acall__(self, request):
+        profile = RequestProfile(parent=_profile.get())
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.observe(request, profile, start)
+        return response
+
+    def observe(self, request, profile, start):
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        REQUEST_SECONDS.observe(route, time.perf_counter() - start)
+        DB_SECONDS.observe(route, profile.db_seconds)
+        TEMPLATE_SECONDS.observe(route, profile.template_seconds)
+        QUERIES.observe(route, profile.queries)
+        self.check_n_plus_one(route, profile)
+
+    def check_n_plus_one(self, route, profile):
+        threshold = getattr(settings, 'BIBLIOTEKA_N_PLUS_ONE_THRESHOLD', 5)
+        repeated = [(sql, count) for sql, count in profile.shapes.items() if count >= threshold]
+        if repeated:
+            N_PLUS_ONE.inc(route)
+            for sql, count in repeated:
+                logger.warning("Possible N+1 in %s: %d x %s", route, count, sql)
+
+
+def metrics(request):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    stats = detail_cache_stats()
+    for name in ('hits', 'misses'):
+        lines.append(f"# HELP biblioteka_detail_cache_{name}_total Detail page cache {name}.")
+        lines.append(f"# TYPE biblioteka_detail_cache_{name}_total counter")
+        lines.append(f"biblioteka_detail_cache_{name}_total {stats[name]}")
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
@@ -0,0 +1,151 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from biblioteka.cache import (
+    author_names, bump_catalogue_version, invalidate_detail, library_locations,
+)
+from biblioteka.models import Author, Book, Library
+from biblioteka.profiling import profile_queries
+from biblioteka.search import install_search_index
+from biblioteka.signals import books_changed
+from biblioteka.stats import (
+    count_book, refresh_author_stats, refresh_genre_stats, refresh_library_stats,
+)
+
+# Book values each group of counters in biblioteka.stats depends on.
+COUNTED_FIELDS = {
+    'author': ('author_id',),
+    'genre': ('genre', 'title'),
+    'library': ('library_id', 'title'),
+}
+
+
+def _current_and_loaded(book, attname):
+    loaded = getattr(book, '_loaded_values', {})
+    return {getattr(book, attname), loaded.get(attname)}
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_details(sender, instance, **kwargs):
+    invalidate_detail(Book, [instance.pk])
+    loaded_work = instance.loaded_work()
+    invalidate_detail(Author, {instance.author_id, loaded_work and loaded_work.author_id})
+    invalidate_detail(Library, _current_and_loaded(instance, 'library_id'))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_details(sender, instance, created=False, **kwargs):
+    invalidate_detail(Author, [instance.pk])
+    if kwargs['signal'] is post_save and not created:
+        # Book and library pages show the author's name.
+        books = list(instance.books.values_list('pk', 'library_id'))
+        invalidate_detail(Book, [pk for pk, _ in books])
+        invalidate_detail(Library, {library_id for _, library_id in books})
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+def invalidate_library_details(sender, instance, created=False, **kwargs):
+    invalidate_detail(Library, [instance.pk])
+    if kwargs['signal'] is post_save and not created:
+        # Book pages show the library's location.
+        invalidate_detail(Book, Book.objects.filter(library=instance).values_list('pk', flat=True))
+
+
+@receiver(books_changed)
+def invalidate_changed_details(sender, book_ids=(), author_ids=(), library_ids=(), **kwargs):
+    invalidate_detail(Book, book_ids)
+    invalidate_detail(Author, author_ids)
+    invalidate_detail(Library, library_ids)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+@receiver(books_changed)
+def bump_catalogue(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def discard_author_name(sender, instance, **kwargs):
+    author_names.discard(instance)
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+def discard_library_location(sender, instance, **kwargs):
+    library_locations.discard(instance)
+
+
+def _counted(work, library_id):
+    return {
+        'author_id': work.author_id, 'library_id': library_id,
+        'title': work.title, 'genre': work.genre,
+    }
+
+
+def _counted_values(values):
+    return [values['author_id'], values['library_id'], values['title'], values['genre']]
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, created, **kwargs):
+    current = _counted(instance.work, instance.library_id)
+    if created:
+        count_book(*_counted_values(current), 1)
+        return
+
+    loaded = getattr(instance, '_loaded_values', {})
+    previous_work = instance.loaded_work()
+    if previous_work is None or 'library_id' not in loaded:
+        # Not loaded from the database (or only partially), the previous
+        # values are unknown: recount what the book belongs to now.
+        refresh_author_stats([current['author_id']])
+        refresh_library_stats([current['library_id']])
+        refresh_genre_stats([current['genre']])
+        return
+
+    previous = _counted(previous_work, loaded['library_id'])
+    changed = [
+        counter for counter, names in COUNTED_FIELDS.items()
+        if any(previous[name] != current[name] for name in names)
+    ]
+    if changed:
+        count_book(*_counted_values(previous), -1, fields=changed)
+        count_book(*_counted_values(current), 1, fields=changed)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, **kwargs):
+    count_book(*_counted_values(_counted(instance.work, instance.library_id)), -1)
+
+
+@receiver(books_changed)
+def recount_changed_books(sender, author_ids=(), library_ids=(), genres=(), **kwargs):
+    refresh_author_stats(author_ids)
+    refresh_library_stats(library_ids)
+    refresh_genre_stats(genres)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    if sender.name == 'biblioteka':
+        install_search_index(using)
+        # Also sent after the flush between TransactionTestCases.
+        author_names.clear()
+        library_locations.clear()
+
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    # The wrapper list outlives reconnects of the same DatabaseWrapper.
+    if profile_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_queries)
@@ -0,0 +1,143 @@
+"""
+Read-replica routing.
+
+ReplicaRouter sends reads of the catalogue models to the aliases listed in
+settings.BIBLIOTEKA_DB_REPLICAS, round-robin, skipping replicas that failed
+their last health check. Writes, reads inside a transaction and reads under
+use_primary() stay on the primary.
+
+ReplicaRoutingMiddleware pins whole requests to the primary: unsafe methods,
+views with `use_primary = True` and, for BIBLIOTEKA_REPLICA_STICKY_SECONDS
+after a write, every request of the same client, so users read their own
+writes while the replicas catch up.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = 'biblioteka_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_use_primary = contextvars.ContextVar('biblioteka_use_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Routes every read in the block (or decorated function) to the primary."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.health = {}
+        self.counter = itertools.count()
+
+    @property
+    def replicas(self):
+        return getattr(settings, 'BIBLIOTEKA_DB_REPLICAS', [])
+
+    def is_healthy(self, alias):
+        interval = getattr(settings, 'BIBLIOTEKA_REPLICA_HEALTH_INTERVAL', 5)
+        now = time.monotonic()
+        with self.lock:
+            checked = self.health.get(alias)
+        if checked is not None and now - checked[0] < interval:
+            return checked[1]
+
+        try:
+            # Fails on an empty SQLite file too, unlike SELECT 1.
+            apps.get_model('biblioteka', 'Book').objects.using(alias).exists()
+            healthy = True
+        except (DatabaseError, ConnectionDoesNotExist) as e:
+            logger.warning("Replica %s failed its health check: %s", alias, e)
+            healthy = False
+        with self.lock:
+            self.health[alias] = (now, healthy)
+        return healthy
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'biblioteka' or _use_primary.get():
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        replicas = self.replicas
+        start = next(self.counter)
+        for i in range(len(replicas)):
+            alias = replicas[(start + i) % len(replicas)]
+            if self.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold copies of the primary's rows.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.replicas
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _use_primary.set(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        return self.stick(request, response)
+
+    async def __acall__(self, request):
+        token = _use_primary.set(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        return self.stick(request, response)
+
+    def pinned(self, request):
+        return request.method not in SAFE_METHODS or PRIMARY_COOKIE in request.COOKIES
+
+    def stick(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PRIMARY_COOKIE, '1', httponly=True, samesite='Lax',
+                max_age=getattr(settings, 'BIBLIOTEKA_REPLICA_STICKY_SECONDS', 10),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        if getattr(view, 'use_primary', False):
+            _use_primary.set(True)
@@ -0,0 +1,112 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+FTS_TABLE = 'biblioteka_work_fts'
+
+# Column weights for bm25(): a hit in the title counts more than one in the
+# author's name, which counts more than one in the genre.
+RANKING = f"bm25({FTS_TABLE}, 10.0, 2.0, 5.0)"
+
+# Tables the triggers below read; the app has no migrations, so they only
+# exist after `migrate --run-syncdb`.
+INDEXED_TABLES = ('biblioteka_work', 'biblioteka_author')
+
+# Works are indexed once, however many copies of them there are; matches are
+# joined to their copies.
+SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, genre, author, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_work_insert
+    AFTER INSERT ON biblioteka_work BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, title, genre, author)
+        SELECT new.id, new.title, new.genre, name
+        FROM biblioteka_author WHERE id = new.author_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_work_update
+    AFTER UPDATE OF title, genre, author_id ON biblioteka_work BEGIN
+        UPDATE {FTS_TABLE} SET
+            title = new.title,
+            genre = new.genre,
+            author = (SELECT name FROM biblioteka_author WHERE id = new.author_id)
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_work_delete
+    AFTER DELETE ON biblioteka_work BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_author_update
+    AFTER UPDATE OF name ON biblioteka_author BEGIN
+        UPDATE {FTS_TABLE} SET author = new.name
+        WHERE rowid IN (SELECT id FROM biblioteka_work WHERE author_id = new.id);
+    END
+    """,
+]
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def install_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Creates the FTS5 index with the triggers keeping it in sync with
+    biblioteka_work and biblioteka_author. Works that already exist are
+    indexed when the table is created. Does nothing until those tables exist.
+    """
+    if not is_supported(using):
+        return
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if any(table not in tables for table in INDEXED_TABLES):
+        return
+    created = FTS_TABLE not in tables
+    with connection.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+    if created:
+        rebuild_search_index(using)
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, genre, author) "
+            f"SELECT w.id, w.title, w.genre, a.name "
+            f"FROM biblioteka_work w JOIN biblioteka_author a ON a.id = w.author_id"
+        )
+
+
+def match_expression(query):
+    # Every word has to appear, the last one may be a prefix (search-as-you-type).
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def ranked_book_ids(query, limit, offset=0, using=DEFAULT_DB_ALIAS):
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT b.id FROM {FTS_TABLE} JOIN biblioteka_book b ON b.work_id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY {RANKING}, b.id LIMIT %s OFFSET %s",
+            [expression, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent by write paths that bypass Model.save() and Model.delete() (queryset
+# updates, bulk_create), with the ids of every book, author and library whose
+# data changed and the genres whose books were added or removed.
+# Arguments: book_ids, author_ids, library_ids, genres.
+books_changed = Signal()
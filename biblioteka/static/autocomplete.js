@@ -0,0 +1,60 @@
+// Search-as-you-type for <select data-autocomplete-url> (biblioteka.widgets.AutocompleteSelect).
+// The select starts with only the chosen option; typing in the search box
+// above it loads the matching options one page at a time.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(function (select) {
+        var search = document.createElement('input');
+        search.type = 'search';
+        search.className = 'form-control';
+        search.placeholder = 'Szukaj…';
+        select.parentNode.insertBefore(search, select);
+        select.classList.add('form-control');
+
+        var more = document.createElement('button');
+        more.type = 'button';
+        more.className = 'btn btn-link';
+        more.textContent = 'Więcej…';
+        more.hidden = true;
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        var next = null;
+        var timer = null;
+
+        function load(query, after) {
+            var url = new URL(select.dataset.autocompleteUrl, window.location.href);
+            url.searchParams.set('q', query);
+            if (after) {
+                url.searchParams.set('after', after);
+            }
+            fetch(url).then(function (response) {
+                return response.json();
+            }).then(function (page) {
+                if (!after) {
+                    // Keep the chosen (and the empty) option, drop the old results.
+                    Array.from(select.options).forEach(function (option) {
+                        if (!option.selected && option.value !== '') {
+                            option.remove();
+                        }
+                    });
+                }
+                page.results.forEach(function (result) {
+                    if (!select.querySelector('option[value="' + result.id + '"]')) {
+                        select.add(new Option(result.text, result.id));
+                    }
+                });
+                next = page.next;
+                more.hidden = next === null;
+            });
+        }
+
+        search.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                load(search.value, null);
+            }, 250);
+        });
+        more.addEventListener('click', function () {
+            load(search.value, next);
+        });
+    });
+});
@@ -0,0 +1,160 @@
+"""
+Materialized catalogue counters: books and distinct titles per library,
+books per author and books and distinct titles per genre.
+
+Single-book writes adjust the counters by one (see receivers.py); bulk writes
+recompute them for the authors, libraries and genres they touched, and
+`manage.py rebuild_counters` recomputes everything.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from biblioteka.models import (
+    BULK_BATCH_SIZE, AuthorStats, Book, GenreStats, GenreTitleCount, LibraryStats,
+    LibraryTitleCount, chunks,
+)
+
+
+def _increment(model, lookup, **fields):
+    """
+    Adds `fields` to the counters of the `model` row matching `lookup`,
+    creating the row when there is none. Returns whether it was created.
+    """
+    increments = {field: F(field) + value for field, value in fields.items()}
+    if model.objects.filter(**lookup).update(**increments):
+        return False
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **fields)
+        return True
+    except IntegrityError:
+        # Another transaction created the row after our UPDATE.
+        model.objects.filter(**lookup).update(**increments)
+        return False
+
+
+def _add(model, lookup, delta, **fields):
+    if delta > 0:
+        _increment(model, lookup, **fields)
+    else:
+        model.objects.filter(**lookup).update(
+            **{field: F(field) + value for field, value in fields.items()}
+        )
+        # Keep the tables identical to what rebuild_counters() produces.
+        model.objects.filter(**lookup, books__lte=0).delete()
+
+
+def _add_copies(counts, stats, lookup, title, delta):
+    """
+    Adds `delta` copies of `title` to its row of `counts` and to the `stats`
+    row of `lookup`, whose titles go up or down with the rows of `counts`.
+    """
+    if delta > 0:
+        created = _increment(counts, {**lookup, 'title': title}, copies=delta)
+        _add(stats, lookup, delta, books=delta, titles=int(created))
+    else:
+        counts.objects.filter(**lookup, title=title).update(copies=F('copies') + delta)
+        gone, _ = counts.objects.filter(**lookup, title=title, copies__lte=0).delete()
+        _add(stats, lookup, delta, books=delta, titles=-gone)
+
+
+def count_book(author_id, library_id, title, genre, delta, fields=('author', 'library', 'genre')):
+    """Adds `delta` (+1/-1) copies of a book to the counters named in `fields`."""
+    # Called inside the transaction of the book's save() or delete().
+    with transaction.atomic(savepoint=False):
+        if 'author' in fields:
+            _add(AuthorStats, {'author_id': author_id}, delta, books=delta)
+        if 'genre' in fields:
+            _add_copies(GenreTitleCount, GenreStats, {'genre': genre}, title, delta)
+        if 'library' in fields and library_id is not None:
+            _add_copies(
+                LibraryTitleCount, LibraryStats, {'library_id': library_id}, title, delta
+            )
+
+
+def refresh_library_stats(library_ids):
+    for chunk in chunks(set(library_ids) - {None}):
+        with transaction.atomic():
+            LibraryTitleCount.objects.filter(library_id__in=chunk).delete()
+            LibraryStats.objects.filter(library_id__in=chunk).delete()
+            titles = (
+                Book.objects.filter(library_id__in=chunk)
+                .values_list('library_id', 'work__title')
+                .annotate(copies=Count('pk'))
+                .order_by()
+            )
+            _save_title_counts(LibraryTitleCount, LibraryStats, 'library_id', titles)
+
+
+def _save_title_counts(counts, stats, field, titles):
+    """Saves the (`field` value, title, copies) rows of `titles` and their totals."""
+    totals = {}
+    batch = []
+    for value, title, copies in titles:
+        batch.append(counts(**{field: value, 'title': title, 'copies': copies}))
+        total = totals.setdefault(value, stats(**{field: value}))
+        total.books += copies
+        total.titles += 1
+        if len(batch) >= BULK_BATCH_SIZE:
+            counts.objects.bulk_create(batch)
+            batch = []
+    counts.objects.bulk_create(batch)
+    stats.objects.bulk_create(totals.values(), batch_size=BULK_BATCH_SIZE)
+
+
+def refresh_author_stats(author_ids):
+    for chunk in chunks(set(author_ids) - {None}):
+        with transaction.atomic():
+            AuthorStats.objects.filter(author_id__in=chunk).delete()
+            counts = (
+                Book.objects.filter(work__author_id__in=chunk)
+                .values_list('work__author_id')
+                .annotate(books=Count('pk'))
+                .order_by()
+            )
+            AuthorStats.objects.bulk_create(
+                [AuthorStats(author_id=author_id, books=books) for author_id, books in counts]
+            )
+
+
+def refresh_genre_stats(genres):
+    for chunk in chunks(set(genres)):
+        with transaction.atomic():
+            GenreTitleCount.objects.filter(genre__in=chunk).delete()
+            GenreStats.objects.filter(genre__in=chunk).delete()
+            titles = (
+                Book.objects.filter(work__genre__in=chunk)
+                .values_list('work__genre', 'work__title')
+                .annotate(copies=Count('pk'))
+                .order_by()
+            )
+            _save_title_counts(GenreTitleCount, GenreStats, 'genre', titles)
+
+
+def rebuild_counters():
+    with transaction.atomic():
+        for model in (
+            LibraryTitleCount, LibraryStats, AuthorStats, GenreTitleCount, GenreStats,
+        ):
+            model.objects.all().delete()
+
+        _save_title_counts(
+            LibraryTitleCount, LibraryStats, 'library_id',
+            Book.objects.filter(library__isnull=False)
+            .values_list('library_id', 'work__title')
+            .annotate(copies=Count('pk'))
+            .order_by()
+            .iterator(),
+        )
+        _save_title_counts(
+            GenreTitleCount, GenreStats, 'genre',
+            Book.objects.values_list('work__genre', 'work__title')
+            .annotate(copies=Count('pk'))
+            .order_by()
+            .iterator(),
+        )
+        counts = Book.objects.values_list('work__author_id').annotate(books=Count('pk')).order_by()
+        AuthorStats.objects.bulk_create(
+            (AuthorStats(author_id=pk, books=books) for pk, books in counts.iterator()),
+            batch_size=BULK_BATCH_SIZE,
+        )
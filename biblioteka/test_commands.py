@@ -0,0 +1,431 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from biblioteka.benchmarks import (
+    compare, concurrent_writes, measure, seed_sample, untimed_utils, url_cases, utils_cases,
+)
+from biblioteka.management.commands.import_catalogue import LookupCache
+from biblioteka.models import Author, Book, ImportProgress, Library, LibraryStats, Work
+from biblioteka.utils import *
+
+
+class SyncBookOwnershipTestCase(TestCase):
+    def setUp(self):
+        self.author = add_author(name="Tim Ferriss")
+        self.library1 = add_library("Plac Narutowicza")
+        self.library2 = add_library("Marszałkowska")
+        self.book1 = add_book(title="4h workweek", genre="biznes", author=self.author)
+        self.book2 = add_book(
+            title="Narzędzia tytanów", genre="biznes", author=self.author, library=self.library1
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE biblioteka_library_books "
+                "(id integer PRIMARY KEY, library_id integer, book_id integer)"
+            )
+            cursor.executemany(
+                "INSERT INTO biblioteka_library_books (library_id, book_id) VALUES (%s, %s)",
+                [
+                    (self.library2.pk, self.book1.pk),
+                    (self.library2.pk, self.book2.pk),
+                ],
+            )
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('sync_book_ownership', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_drift_without_changes(self):
+        # When
+        output = self.run_command('--dry-run')
+
+        # Then
+        self.assertIn("1 books are linked to a library only through", output)
+        self.assertIn("1 library links disagree with Book.library", output)
+        self.book1.refresh_from_db()
+        self.assertIsNone(self.book1.library)
+
+    def test_repairs_foreign_keys_and_drops_legacy_table(self):
+        # When
+        self.run_command('--batch-size', '1', '--drop-legacy')
+
+        # Then
+        self.book1.refresh_from_db()
+        self.book2.refresh_from_db()
+        self.assertEqual(self.book1.library, self.library2)
+        self.assertEqual(self.book2.library, self.library1)
+        self.assertNotIn('biblioteka_library_books', connection.introspection.table_names())
+
+    def test_nothing_to_do_without_legacy_tables(self):
+        # Given
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE biblioteka_library_books")
+
+        # When
+        output = self.run_command()
+
+        # Then
+        self.assertIn("nothing to do", output)
+
+
+
+class ImportCatalogueTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.existing_author = add_author(name="Tim Ferriss")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('import_catalogue', *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_csv(self):
+        # Given
+        path = self.write("feed.csv", (
+            "title,genre,author,library\n"
+            "4h workweek,biznes,Tim Ferriss,Plac Narutowicza\n"
+            "Krew elfów,fantasy,Sapkowski,Plac Narutowicza\n"
+            "Czas pogardy,fantasy,Sapkowski,\n"
+        ))
+
+        # When
+        output = self.run_command(path, '--chunk-size', '2')
+
+        # Then
+        self.assertIn("rows/s", output)
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(self.existing_author.books.count(), 1)
+        library = Library.objects.get(location="Plac Narutowicza")
+        self.assertEqual(count_titles(library), {"4h workweek": 1, "Krew elfów": 1})
+        self.assertIsNone(Book.objects.get(work__title="Czas pogardy").library)
+        self.assertFalse(ImportProgress.objects.exists())
+
+    def test_import_jsonl(self):
+        # Given
+        rows = [
+            {"title": "Krew elfów", "genre": "fantasy", "author": "Sapkowski"},
+            {"title": "Czas pogardy", "genre": "fantasy", "author": "Sapkowski"},
+        ]
+        path = self.write("feed.jsonl", "\n".join(json.dumps(row) for row in rows))
+
+        # When
+        self.run_command(path)
+
+        # Then
+        self.assertEqual(view_titles_by_author("Sapkowski"), ["Krew elfów", "Czas pogardy"])
+        self.assertFalse(Book.objects.filter(work__isnull=True).exists())
+
+    def test_resume_after_failed_chunk(self):
+        # Given
+        path = self.write("feed.csv", (
+            "title,genre,author,library\n"
+            "Krew elfów,fantasy,Sapkowski,\n"
+            "Czas pogardy,fantasy,Sapkowski,\n"
+            "Chrzest ognia,fantasy,,\n"
+        ))
+        with self.assertRaises(CommandError):
+            self.run_command(path, '--chunk-size', '2')
+        self.write("feed.csv", (
+            "title,genre,author,library\n"
+            "Krew elfów,fantasy,Sapkowski,\n"
+            "Czas pogardy,fantasy,Sapkowski,\n"
+            "Chrzest ognia,fantasy,Sapkowski,\n"
+        ))
+
+        # When
+        output = self.run_command(path, '--chunk-size', '2')
+
+        # Then
+        self.assertIn("Resuming after row 2", output)
+        self.assertEqual(Book.objects.filter(work__title="Krew elfów").count(), 1)
+        self.assertEqual(Book.objects.filter(work__title="Chrzest ognia").count(), 1)
+
+    def test_resume_skips_committed_jsonl_lines_without_decoding(self):
+        # Given
+        path = self.write("feed.jsonl", "\n".join([
+            '{"title": "Krew elfów", "genre": "fantasy", "author": "Sapkowski"}',
+            '{"title": "Czas pogardy", "genre": "fantasy"}',
+        ]))
+        with self.assertRaises(CommandError):
+            self.run_command(path, '--chunk-size', '1')
+        self.write("feed.jsonl", "\n".join([
+            'already imported',
+            '{"title": "Czas pogardy", "genre": "fantasy", "author": "Sapkowski"}',
+        ]))
+
+        # When
+        self.run_command(path, '--chunk-size', '1')
+
+        # Then
+        self.assertEqual(view_titles_by_author("Sapkowski"), ["Krew elfów", "Czas pogardy"])
+
+    def test_jsonl_lines_have_to_be_objects(self):
+        # Given
+        path = self.write("feed.jsonl", (
+            '{"title": "Krew elfów", "genre": "fantasy", "author": "Sapkowski"}\n'
+            '\n'
+            '["Czas pogardy", "fantasy", "Sapkowski"]\n'
+        ))
+
+        # When
+        with self.assertRaisesMessage(CommandError, "Line 3: expected a JSON object"):
+            self.run_command(path)
+
+        # Then
+        self.assertFalse(Book.objects.exists())
+
+    def test_lookup_cache_keeps_recent_names(self):
+        # Given
+        authors = LookupCache(Author, 'name', size=2)
+        authors.resolve({"Tim Ferriss", "Sapkowski"})
+
+        # When
+        authors.resolve({"Tim Ferriss"})
+        authors.resolve({"Lem"})
+
+        # Then
+        self.assertEqual(list(authors.objects), ["Tim Ferriss", "Lem"])
+        self.assertEqual(authors["Tim Ferriss"], self.existing_author)
+
+
+class BackfillWorksTestCase(TransactionTestCase):
+    def test_converts_legacy_books_in_batches(self):
+        # Given
+        author = add_author(name="Sapkowski")
+        library = add_library("Plac Narutowicza")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE biblioteka_book")
+            cursor.execute(
+                "CREATE TABLE biblioteka_book (id integer PRIMARY KEY AUTOINCREMENT, "
+                "title varchar(50) NOT NULL, genre varchar(25) NOT NULL, "
+                "author_id integer NOT NULL REFERENCES biblioteka_author (id), "
+                "library_id integer NULL REFERENCES biblioteka_library (id))"
+            )
+            for title in ["Krew elfów", "Krew elfów", "Czas pogardy"]:
+                cursor.execute(
+                    "INSERT INTO biblioteka_book (title, genre, author_id, library_id) "
+                    "VALUES (%s, %s, %s, %s)",
+                    [title, "fantasy", author.pk, library.pk],
+                )
+
+        # When
+        out = StringIO()
+        call_command('backfill_works', '--batch-size', '2', stdout=out)
+
+        # Then
+        self.assertIn("Linked 3 books", out.getvalue())
+        self.assertEqual(
+            list(Book.objects.values_list('work__title', 'work__author', 'library')),
+            [
+                ("Krew elfów", author.pk, library.pk),
+                ("Krew elfów", author.pk, library.pk),
+                ("Czas pogardy", author.pk, library.pk),
+            ],
+        )
+        self.assertEqual(Work.objects.count(), 2)
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, 'biblioteka_book')
+        self.assertEqual(sorted(column.name for column in columns), ['id', 'library_id', 'work_id'])
+        self.assertEqual(search_books("pogardy"), [Book.objects.get(work__title="Czas pogardy")])
+
+    def test_nothing_to_convert(self):
+        # When
+        out = StringIO()
+        call_command('backfill_works', stdout=out)
+
+        # Then
+        self.assertIn("already stored as copies of works", out.getvalue())
+
+
+class ExportCatalogueTestCase(TestCase):
+    def test_export_round_trips_through_import(self):
+        # Given
+        author = add_author(name="Sapkowski")
+        library = add_library("Plac Narutowicza")
+        add_book(title="Krew elfów", genre="fantasy", author=author, library=library)
+        add_book(title="Czas pogardy", genre="fantasy", author=author)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "books.csv")
+
+            # When
+            call_command('export_catalogue', '--chunk-size', '1', '-o', path)
+            Book.objects.all().delete()
+            call_command('import_catalogue', path, stdout=StringIO())
+
+        # Then
+        self.assertEqual(count_titles(library), {"Krew elfów": 1})
+        self.assertEqual(view_titles_by_author(author), ["Krew elfów", "Czas pogardy"])
+
+
+class BenchmarkComparisonTestCase(TestCase):
+    def test_compare_reports_slowdowns_and_extra_queries(self):
+        # Given
+        baseline = {
+            'utils.count_titles': {'best_ms': 1.0, 'queries': 1},
+            'url.book-list': {'best_ms': 5.0, 'queries': 1, 'queries_warm': 0},
+            'url.removed': {'best_ms': 1.0, 'queries': 1},
+        }
+        results = {
+            'utils.count_titles': {'best_ms': 1.1, 'queries': 2, 'queries_warm': 2},
+            'url.book-list': {'best_ms': 7.0, 'queries': 1, 'queries_warm': 1},
+            'url.added': {'best_ms': 1.0, 'queries': 1},
+        }
+
+        # When
+        regressions = compare(results, baseline, threshold=0.2)
+
+        # Then
+        self.assertEqual(regressions, [
+            "utils.count_titles: 1 -> 2 queries",
+            "url.book-list: 5.00 ms -> 7.00 ms",
+            "url.book-list: 0 -> 1 warm queries",
+        ])
+
+    def test_measure_counts_cold_queries_and_worker_threads(self):
+        # Given
+        cached = []
+
+        def select_one():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            finally:
+                connection.close()
+
+        def read():
+            if not cached:
+                cached.append(Library.objects.count())
+            async_to_sync(sync_to_async(select_one, thread_sensitive=False))()
+
+        # When
+        stats = measure(read, repeat=3)
+
+        # Then
+        self.assertEqual((stats['queries'], stats['queries_warm']), (2, 1))
+
+    def test_url_cases_reach_the_views(self):
+        # Given
+        sample = seed_sample(authors=1, books_per_author=2, libraries=1)
+
+        # When
+        statuses = {name: func().status_code for name, func in url_cases(sample).items()}
+
+        # Then
+        redirects = {name: status for name, status in statuses.items() if status != 200}
+        self.assertEqual(redirects, {'index': 302})
+
+    def test_every_utils_helper_has_a_case(self):
+        # Given
+        sample = seed_sample(authors=1, books_per_author=1, libraries=1)
+
+        # Then
+        self.assertEqual(untimed_utils(utils_cases(sample)), [])
+
+
+class ConcurrentWritesTestCase(TransactionTestCase):
+    def test_sqlite_connections_are_tuned(self):
+        # When
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            busy_timeout = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+
+        # Then
+        self.assertEqual(busy_timeout, 5000)
+        self.assertEqual(synchronous, 1)  # NORMAL
+
+    def test_every_write_is_committed_or_reported(self):
+        # Given
+        authors = [add_author("Sapkowski"), add_author("Tim Ferriss")]
+        libraries = [add_library("Plac Narutowicza")]
+
+        # When
+        results = concurrent_writes(authors, libraries, threads=3, writes=10)
+
+        # Then
+        self.assertEqual(results['writes'] + sum(results['failures'].values()), 30)
+        self.assertEqual(Book.objects.count(), results['writes'])
+        self.assertEqual(LibraryStats.objects.get().books, results['writes'])
+
+
+class SyncReplicasTestCase(TransactionTestCase):
+    def test_copies_primary_into_replica_file(self):
+        # Given
+        add_book("Krew elfów", "fantasy", add_author("Sapkowski"), add_library("Plac Narutowicza"))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+
+            # When
+            call_command('sync_replicas', path, stdout=StringIO())
+
+            # Then
+            replica = sqlite3.connect(path)
+            try:
+                titles = replica.execute(
+                    'SELECT w.title FROM biblioteka_book b '
+                    'JOIN biblioteka_work w ON w.id = b.work_id'
+                ).fetchall()
+            finally:
+                replica.close()
+        self.assertEqual(titles, [("Krew elfów",)])
+
+    def test_requires_replicas(self):
+        with self.assertRaises(CommandError):
+            call_command('sync_replicas', stdout=StringIO())
+
+
+class MigrateTestCase(SimpleTestCase):
+    def migrate(self, path, *args):
+        env = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith('BIBLIOTEKA_DB_')
+        }
+        env['BIBLIOTEKA_DB_NAME'] = path
+        return subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'migrate', *args],
+            env=env, capture_output=True, text=True,
+        )
+
+    def test_migrate_on_empty_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+
+            # When
+            plain = self.migrate(path)
+            syncdb = self.migrate(path, '--run-syncdb')
+
+            # Then
+            self.assertEqual(plain.returncode, 0, plain.stderr)
+            self.assertEqual(syncdb.returncode, 0, syncdb.stderr)
+            database = sqlite3.connect(path)
+            try:
+                tables = {
+                    name for name, in database.execute("SELECT name FROM sqlite_schema")
+                }
+            finally:
+                database.close()
+        self.assertIn('biblioteka_work_fts', tables)
@@ -0,0 +1,62 @@
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+has_psycopg2 = find_spec('psycopg2') is not None
+
+
+class FakeConnection:
+    isolation_level = 'left by the previous user'
+
+
+class FakePool:
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def getconn(self):
+        return self.connection
+
+
+@skipUnless(has_psycopg2, "needs psycopg2")
+class PooledConnectionTestCase(SimpleTestCase):
+    def connect(self, **options):
+        from biblioteka.db.postgresql_pool import base
+
+        wrapper = base.DatabaseWrapper({
+            'NAME': 'biblioteka', 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+            'OPTIONS': options, 'TIME_ZONE': None, 'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': False, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+        })
+        with (
+            mock.patch.object(base, 'get_pool', return_value=FakePool()),
+            mock.patch('psycopg2.extras.register_default_jsonb') as register_jsonb,
+        ):
+            connection = wrapper.get_new_connection({})
+        return wrapper, connection, register_jsonb
+
+    def test_default_isolation_level(self):
+        from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+        # When
+        wrapper, connection, register_jsonb = self.connect()
+
+        # Then
+        self.assertEqual(wrapper.isolation_level, IsolationLevel.READ_COMMITTED)
+        self.assertIsNone(connection.isolation_level)
+        register_jsonb.assert_called_once_with(conn_or_curs=connection, loads=mock.ANY)
+
+    def test_isolation_level_from_options(self):
+        from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+        # When
+        wrapper, connection, _ = self.connect(isolation_level=IsolationLevel.SERIALIZABLE)
+
+        # Then
+        self.assertEqual(wrapper.isolation_level, IsolationLevel.SERIALIZABLE)
+        self.assertEqual(connection.isolation_level, IsolationLevel.SERIALIZABLE)
+
+    def test_invalid_isolation_level(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.connect(isolation_level=-1)
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.test import Client, TestCase
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from biblioteka.models import Author, Book, Library
@@ -20,7 +22,7 @@ class BookTestCase(TestCase):
 
     def test_created_book_exists_by_title(self):
         # When
-        book = Book.objects.get(title=self.title)
+        book = Book.objects.get(work__title=self.title)
 
         # Then
         self.assertIsNotNone(book)
@@ -37,7 +39,7 @@ class BookTestCase(TestCase):
         )
 
         # When
-        books = Book.objects.filter(title=self.title)
+        books = Book.objects.filter(work__title=self.title)
         
         # Then
         self.assertEqual(books.count(), 2)
@@ -53,7 +55,7 @@ class BookTestCase(TestCase):
         )
 
         # When
-        books = Book.objects.filter(title=self.title)
+        books = Book.objects.filter(work__title=self.title)
         author1 = books[0].author.name
         author2 = books[1].author.name
         genre1 = books[0].genre
@@ -77,7 +79,7 @@ class BookTestCase(TestCase):
         )
 
         # When
-        book = Book.objects.get(title=new_title)
+        book = Book.objects.get(work__title=new_title)
 
         # Then
         self.assertIsNotNone(book)
@@ -86,16 +88,16 @@ class BookTestCase(TestCase):
 
     def test_deleting_book(self):
         # Given
-        Book.objects.filter(title=self.title).delete()
+        Book.objects.filter(work__title=self.title).delete()
 
         # When
-        book = Book.objects.filter(title=self.title)
+        book = Book.objects.filter(work__title=self.title)
 
         # Then
         result = bool(book)
         self.assertFalse(result)
         with self.assertRaises(Book.DoesNotExist):
-            Book.objects.get(title=self.title).pk
+            Book.objects.get(work__title=self.title).pk
 
 
 class LibraryTestCase(TestCase):
@@ -312,4 +314,119 @@ class AuthorTestCase(TestCase):
         )
         books_list = [book, "Jakiś tam tytuł"]
         with self.assertRaises(ValueError):
-            self.author.publish_books(books_list)
\ No newline at end of file
+            self.author.publish_books(books_list)
+
+    def test_publish_books_creates_unsaved_books(self):
+        # Given
+        books_list = [
+            Book(title="Krew elfów", genre="fantasy"),
+            Book(title="Czas pogardy", genre="fantasy"),
+        ]
+
+        # When
+        with CaptureQueriesContext(connection) as two_books:
+            results = self.author.publish_books(books_list)
+        with CaptureQueriesContext(connection) as twenty_books:
+            self.author.publish_books(Book(title="Sezon burz", genre="fantasy") for _ in range(20))
+
+        # Then
+        self.assertEqual([created for _, created in results], [True, True])
+        self.assertEqual(Book.objects.filter(work__author=self.author).count(), 22)
+        self.assertEqual(len(two_books), len(twenty_books))
+
+    def test_publish_books_writes_nothing_when_batch_is_invalid(self):
+        # Given
+        other_author = Author.objects.create(name="Stephen King")
+        book = Book.objects.create(title="Lśnienie", genre="horror", author=other_author)
+
+        # When
+        with self.assertRaises(ValueError):
+            self.author.publish_books([book, Book(title="Krew elfów", genre="fantasy"), 1])
+
+        # Then
+        book.refresh_from_db()
+        self.assertEqual(book.author, other_author)
+        self.assertEqual(Book.objects.count(), 1)
+
+    def test_add_books_to_library(self):
+        # Given
+        library = Library.objects.create(location="Plac Politechniki 1")
+        book1 = Book.objects.create(title="Krew elfów", genre="fantasy", author=self.author)
+        book2 = Book(title="Czas pogardy", genre="fantasy", author=self.author)
+
+        # When
+        results = library.add_books([book1, book2])
+
+        # Then
+        self.assertEqual(results, [(book1, False), (book2, True)])
+        self.assertEqual(library.books.count(), 2)
+
+
+class WorkTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = Author.objects.create(name="Andrzej Sapkowski")
+        self.ferriss = Author.objects.create(name="Tim Ferriss")
+        self.library = Library.objects.create(location="Plac Politechniki 1")
+
+    def test_copies_share_a_work(self):
+        # When
+        book1 = add_book("Krew elfów", "fantasy", self.sapkowski, self.library)
+        book2 = add_book("Krew elfów", "fantasy", self.sapkowski)
+        book3 = add_book("Krew elfów", "horror", self.sapkowski)
+
+        # Then
+        self.assertEqual(book1.work_id, book2.work_id)
+        self.assertNotEqual(book1.work_id, book3.work_id)
+        self.assertEqual(
+            (book1.work.title, book1.work.author, book1.work.genre),
+            ("Krew elfów", self.sapkowski, "fantasy"),
+        )
+
+    def test_edits_move_book_to_another_work(self):
+        # Given
+        book = add_book("Krew elfów", "fantasy", self.sapkowski)
+
+        # When
+        book = Book.objects.get(pk=book.pk)
+        book.title = "Czas pogardy"
+        book.save()
+        self.ferriss.publish_book(book)
+
+        # Then
+        book.refresh_from_db()
+        self.assertEqual(
+            (book.work.title, book.work.author), ("Czas pogardy", self.ferriss)
+        )
+
+    def test_bulk_writes_keep_works_in_sync(self):
+        # Given
+        book = add_book("Krew elfów", "fantasy", self.sapkowski)
+
+        # When
+        self.ferriss.publish_books([book, Book(title="4h workweek", genre="biznes")])
+        update_books(Book.objects.all(), genre="poradnik")
+
+        # Then
+        self.assertEqual(
+            sorted(Book.objects.values_list('work__title', 'work__author', 'work__genre')),
+            [("4h workweek", self.ferriss.pk, "poradnik"), ("Krew elfów", self.ferriss.pk, "poradnik")],
+        )
+
+    def test_count_books_by_work(self):
+        # Given
+        add_book("Krew elfów", "fantasy", self.sapkowski, self.library)
+        add_book("Krew elfów", "fantasy", self.sapkowski, self.library)
+        add_book("Krew elfów", "fantasy", self.ferriss, self.library)
+
+        # When
+        with self.assertNumQueries(1):
+            counts = count_books(self.library, by='work')
+
+        # Then
+        self.assertEqual(
+            sorted((work.author_id, count) for work, count in counts.items()),
+            [(self.sapkowski.pk, 2), (self.ferriss.pk, 1)],
+        )
+        self.assertEqual(
+            count_books_in_libraries([self.library], by='work'), {self.library: counts}
+        )
@@ -0,0 +1,125 @@
+import re
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from biblioteka.models import Book
+from biblioteka.utils import *
+
+# The whole table name has to match: a shorter one would let the
+# lookahead see the rest of the name instead of " USING".
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?"?(biblioteka_\w+)\b(?!"? USING)')
+GROUP_BY_SORT = re.compile(r'USE TEMP B-TREE FOR GROUP BY')
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite specific")
+class QueryPlanTestCase(TestCase):
+    """
+    Fails when a helper from biblioteka.utils stops using an index and falls
+    back to scanning a whole catalogue table.
+    """
+
+    def setUp(self):
+        self.author = add_author(name="Sapkowski")
+        self.library = add_library("Plac Politechniki 1")
+        self.book = add_book(
+            title="Krew elfów", genre="fantasy", author=self.author, library=self.library
+        )
+
+    def plans(self, func, *args, **kwargs):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            func(*args, **kwargs)
+        self.assertTrue(recorder.queries, "No SELECT was executed")
+
+        with connection.cursor() as cursor:
+            for sql, params in recorder.queries:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                for row in cursor.fetchall():
+                    yield sql, row[-1]
+
+    def full_scans(self, func, *args, **kwargs):
+        return [
+            f"{detail}: {sql}"
+            for sql, detail in self.plans(func, *args, **kwargs)
+            if FULL_SCAN.search(detail)
+        ]
+
+    def assertUsesIndexes(self, func, *args, **kwargs):
+        scans = self.full_scans(func, *args, **kwargs)
+        self.assertEqual(scans, [], "Full table scans:\n" + "\n".join(scans))
+
+    def assertGroupsWithIndex(self, func, *args, **kwargs):
+        self.assertUsesIndexes(func, *args, **kwargs)
+        sorts = [
+            f"{detail}: {sql}"
+            for sql, detail in self.plans(func, *args, **kwargs)
+            if GROUP_BY_SORT.search(detail)
+        ]
+        self.assertEqual(sorts, [], "GROUP BY without an index:\n" + "\n".join(sorts))
+
+    def test_view_books_by_author(self):
+        self.assertUsesIndexes(view_books_by_author, self.author)
+
+    def test_view_books_by_author_name(self):
+        self.assertUsesIndexes(view_books_by_author, "Sapkowski")
+
+    def test_view_books_in_library(self):
+        self.assertUsesIndexes(view_books_in_library, self.library)
+
+    def test_view_books_in_library_by_location(self):
+        self.assertUsesIndexes(view_books_in_library, "Plac Politechniki 1")
+
+    def test_count_titles(self):
+        self.assertGroupsWithIndex(count_titles, self.library)
+
+    def test_count_books_by_genre(self):
+        self.assertUsesIndexes(count_books, self.library, by='genre')
+
+    def test_count_books_by_author(self):
+        self.assertUsesIndexes(count_books, self.library, by='author')
+
+    def test_view_titles_by_author(self):
+        self.assertGroupsWithIndex(view_titles_by_author, self.author)
+
+    def test_author_bibliography(self):
+        self.assertGroupsWithIndex(author_bibliography, self.author, after="A", details=True)
+
+    def test_find_libraries_with_book(self):
+        self.assertUsesIndexes(find_libraries_with_book, self.book)
+
+    def test_view_books_by_authors(self):
+        self.assertUsesIndexes(view_books_by_authors, ["Sapkowski"])
+
+    def test_count_titles_in_libraries(self):
+        self.assertGroupsWithIndex(count_titles_in_libraries, [self.library])
+
+    def test_find_libraries_with_books(self):
+        self.assertUsesIndexes(find_libraries_with_books, [self.book])
+
+    def test_find_title_availability(self):
+        self.assertUsesIndexes(find_title_availability, "Krew elfów")
+
+    def test_books_by_genre(self):
+        self.assertUsesIndexes(lambda: list(Book.objects.filter(work__genre="fantasy")))
+
+    def test_full_scan_pattern(self):
+        self.assertTrue(FULL_SCAN.search('SCAN biblioteka_book'))
+        self.assertTrue(FULL_SCAN.search('SCAN TABLE "biblioteka_book"'))
+        self.assertFalse(FULL_SCAN.search('SCAN biblioteka_book USING INDEX book_library_work_idx'))
+        self.assertFalse(FULL_SCAN.search('SCAN TABLE "biblioteka_book" USING COVERING INDEX x'))
+
+    def test_detects_full_scan(self):
+        scans = self.full_scans(lambda: list(Book.objects.filter(work__title__contains="elf")))
+        self.assertEqual(len(scans), 1)
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from biblioteka.models import Author, Book
+from biblioteka.routers import PRIMARY_COOKIE, ReplicaRouter, use_primary
+
+
+class FakeHealthRouter(ReplicaRouter):
+    def __init__(self, unhealthy=()):
+        super().__init__()
+        self.unhealthy = set(unhealthy)
+
+    def is_healthy(self, alias):
+        return alias not in self.unhealthy
+
+
+@override_settings(BIBLIOTEKA_DB_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTestCase(SimpleTestCase):
+    def test_reads_rotate_between_replicas(self):
+        # Given
+        router = FakeHealthRouter()
+
+        # When
+        aliases = [router.db_for_read(Book) for _ in range(4)]
+
+        # Then
+        self.assertEqual(aliases, ['replica1', 'replica2', 'replica1', 'replica2'])
+
+    def test_unhealthy_replicas_are_skipped(self):
+        # Given
+        router = FakeHealthRouter(unhealthy=['replica1'])
+
+        # Then
+        self.assertEqual({router.db_for_read(Book) for _ in range(4)}, {'replica2'})
+
+    def test_primary_without_healthy_replicas(self):
+        # Given
+        router = FakeHealthRouter(unhealthy=['replica1', 'replica2'])
+
+        # Then
+        self.assertEqual(router.db_for_read(Book), 'default')
+
+    def test_writes_and_pinned_reads_go_to_primary(self):
+        # Given
+        router = FakeHealthRouter()
+
+        # Then
+        self.assertEqual(router.db_for_write(Book), 'default')
+        with use_primary():
+            self.assertEqual(router.db_for_read(Author), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'biblioteka'))
+
+    def test_missing_replica_is_unhealthy(self):
+        with self.assertLogs('biblioteka.routers', 'WARNING'):
+            self.assertFalse(ReplicaRouter().is_healthy('replica1'))
+
+
+class ReplicaRoutingMiddlewareTestCase(TestCase):
+    def test_write_makes_client_sticky(self):
+        # When
+        response = self.client.post(
+            reverse('biblioteka:library-create'), {'location': "Plac Narutowicza"}
+        )
+
+        # Then
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], 10)
+
+    def test_reads_do_not_set_cookie(self):
+        # When
+        response = self.client.get(reverse('biblioteka:library-list'))
+
+        # Then
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
@@ -0,0 +1,245 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+
+from biblioteka.models import (
+    Author, AuthorStats, Book, GenreStats, GenreTitleCount, Library, LibraryStats,
+    LibraryTitleCount, Work,
+)
+from biblioteka.utils import *
+
+
+def snapshot():
+    return {
+        'libraries': sorted(LibraryStats.objects.values_list('library_id', 'books', 'titles')),
+        'titles': sorted(LibraryTitleCount.objects.values_list('library_id', 'title', 'copies')),
+        'authors': sorted(AuthorStats.objects.values_list('author_id', 'books')),
+        'genres': sorted(GenreStats.objects.values_list('genre', 'books', 'titles')),
+        'genre_titles': sorted(GenreTitleCount.objects.values_list('genre', 'title', 'copies')),
+    }
+
+
+class CountersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sapkowski = add_author(name="Sapkowski")
+        self.ferriss = add_author(name="Tim Ferriss")
+        self.library1 = add_library("Plac Narutowicza")
+        self.library2 = add_library("Marszałkowska")
+        self.book = add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+        add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+        add_book("4h workweek", "biznes", self.ferriss, self.library1)
+
+    def assertCountersMatchRebuild(self):
+        incremental = snapshot()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(incremental, snapshot())
+
+    def test_adding_books(self):
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 3, 'titles': 2})
+        self.assertEqual(author_stats("Sapkowski"), {'books': 2})
+        self.assertEqual(genre_stats("fantasy"), {'books': 2, 'titles': 1})
+        self.assertEqual(library_stats(self.library2), {'books': 0, 'titles': 0})
+        self.assertCountersMatchRebuild()
+
+    def test_counter_row_created_concurrently(self):
+        # Given: the rows appear just after the first UPDATEs found none.
+        update = QuerySet.update
+        missed = []
+
+        def racing_update(queryset, **kwargs):
+            if queryset.model not in missed:
+                missed.append(queryset.model)
+                return 0
+            return update(queryset, **kwargs)
+
+        # When
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 4, 'titles': 2})
+        self.assertEqual(author_stats("Sapkowski"), {'books': 3})
+        self.assertEqual(genre_stats("fantasy"), {'books': 3, 'titles': 1})
+        self.assertCountersMatchRebuild()
+
+    def test_genre_titles_are_distinct(self):
+        # When
+        add_book("Krew elfów", "fantasy", self.ferriss)
+        add_book("Czas pogardy", "fantasy", self.sapkowski)
+
+        # Then
+        self.assertEqual(genre_stats("fantasy"), {'books': 4, 'titles': 2})
+        self.assertCountersMatchRebuild()
+
+    def test_counters_are_written_with_the_book(self):
+        # Given
+        books = Book.objects.count()
+
+        # When
+        with mock.patch('biblioteka.receivers.count_book', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                add_book("Czas pogardy", "fantasy", self.sapkowski, self.library1)
+
+        # Then
+        self.assertEqual(Book.objects.count(), books)
+        self.assertFalse(Work.objects.filter(title="Czas pogardy").exists())
+
+    def test_adding_copy_queries(self):
+        # The work, the book and five counters, in a savepoint of the test.
+        with self.assertNumQueries(9):
+            add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+
+    def test_reads_are_single_queries(self):
+        with self.assertNumQueries(1):
+            library_stats(self.library1)
+        with self.assertNumQueries(1):
+            genre_stats("fantasy")
+
+    def test_moving_book_to_another_library(self):
+        # When
+        self.library2.add_book(Book.objects.get(pk=self.book.pk))
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 2, 'titles': 2})
+        self.assertEqual(library_stats(self.library2), {'books': 1, 'titles': 1})
+        self.assertCountersMatchRebuild()
+
+    def test_editing_title_author_and_genre(self):
+        # Given
+        book = Book.objects.get(pk=self.book.pk)
+
+        # When
+        book.title = "Czas pogardy"
+        book.genre = "dark fantasy"
+        book.author = self.ferriss
+        book.save()
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 3, 'titles': 3})
+        self.assertEqual(author_stats(self.ferriss), {'books': 2})
+        self.assertEqual(genre_stats("dark fantasy"), {'books': 1, 'titles': 1})
+        self.assertCountersMatchRebuild()
+
+    def test_deleting_last_copy_of_title(self):
+        # When
+        Book.objects.filter(work__title="4h workweek").delete()
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 2, 'titles': 1})
+        self.assertEqual(genre_stats("biznes"), {'books': 0, 'titles': 0})
+        self.assertCountersMatchRebuild()
+
+    def test_deleting_author_cascades(self):
+        # When
+        self.sapkowski.delete()
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 1, 'titles': 1})
+        self.assertEqual(genre_stats("fantasy"), {'books': 0, 'titles': 0})
+        self.assertCountersMatchRebuild()
+
+    def test_bulk_publishing(self):
+        # When
+        self.library2.add_books([
+            Book.objects.get(pk=self.book.pk),
+            Book(title="Czas pogardy", genre="fantasy", author=self.sapkowski),
+        ])
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 2, 'titles': 2})
+        self.assertEqual(library_stats(self.library2), {'books': 2, 'titles': 2})
+        self.assertEqual(author_stats(self.sapkowski), {'books': 3})
+        self.assertCountersMatchRebuild()
+
+    def test_bulk_update(self):
+        # When
+        update_books(Book.objects.filter(work__author=self.sapkowski), library=self.library2, genre="horror")
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 1, 'titles': 1})
+        self.assertEqual(library_stats(self.library2), {'books': 2, 'titles': 1})
+        self.assertEqual(genre_stats("fantasy"), {'books': 0, 'titles': 0})
+        self.assertEqual(genre_stats("horror"), {'books': 2, 'titles': 1})
+        self.assertCountersMatchRebuild()
+
+    def test_bulk_delete(self):
+        # When
+        delete_books(Book.objects.filter(work__title="Krew elfów"))
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 1, 'titles': 1})
+        self.assertEqual(author_stats(self.sapkowski), {'books': 0})
+        self.assertCountersMatchRebuild()
+
+    def test_title_availability_follows_writes(self):
+        # Given
+        self.library2.add_book(Book(title="Krew elfów", genre="fantasy", author=self.sapkowski))
+
+        # Then
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                find_title_availability("Krew elfów"), {self.library1: 2, self.library2: 1}
+            )
+
+        # When
+        self.library2.add_book(Book.objects.get(pk=self.book.pk))
+        delete_books(Book.objects.filter(work__title="4h workweek"))
+
+        # Then
+        self.assertEqual(find_title_availability("Krew elfów"), {self.library1: 1, self.library2: 2})
+        self.assertEqual(find_title_availability("4h workweek"), {})
+        with self.assertRaises(ValueError):
+            find_title_availability(None)
+
+    def test_saving_instance_after_bulk_move(self):
+        # Given
+        book = Book.objects.get(pk=self.book.pk)
+        self.library2.add_books([book])
+        self.ferriss.publish_books([book])
+
+        # When
+        book.genre = "horror"
+        book.save()
+
+        # Then
+        self.assertEqual(library_stats(self.library2), {'books': 1, 'titles': 1})
+        self.assertEqual(author_stats(self.ferriss), {'books': 2})
+        self.assertEqual(book.work.author, self.ferriss)
+        self.assertCountersMatchRebuild()
+
+    def test_library_detail_shows_counters(self):
+        # When
+        response = self.client.get(reverse('biblioteka:library-detail', args=[self.library1.pk]))
+
+        # Then
+        self.assertContains(response, "Liczba książek: 3, liczba tytułów: 2")
+
+    def test_library_detail_reads_title_counters(self):
+        # Given
+        LibraryTitleCount.objects.filter(title="Krew elfów").update(copies=5)
+
+        # When
+        response = self.client.get(reverse('biblioteka:library-detail', args=[self.library1.pk]))
+
+        # Then
+        self.assertContains(response, "Krew elfów: 5 książek")
+        self.assertContains(response, "Liczba książek: 6, liczba tytułów: 2")
+
+    def test_rebuild_repairs_drift(self):
+        # Given
+        LibraryStats.objects.update(books=100)
+        GenreStats.objects.all().delete()
+
+        # When
+        call_command('rebuild_counters', stdout=StringIO())
+
+        # Then
+        self.assertEqual(library_stats(self.library1), {'books': 3, 'titles': 2})
+        self.assertEqual(genre_stats("fantasy"), {'books': 2, 'titles': 1})
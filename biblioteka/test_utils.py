@@ -1,9 +1,14 @@
+import re
+
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.db.utils import IntegrityError
 from django.urls import reverse
 
-from biblioteka.models import Author, Book, Library
+from biblioteka.cache import author_names, library_locations
+from biblioteka.models import BULK_BATCH_SIZE, Author, Book, Library
 from biblioteka.utils import *
 
 class UtilsTestCase(TestCase):
@@ -45,7 +50,7 @@ class UtilsTestCase(TestCase):
         )
 
         # When
-        book = Book.objects.get(title=title)
+        book = Book.objects.get(work__title=title)
 
         # Then
         self.assertIsNotNone(book)
@@ -240,8 +245,8 @@ class UtilsTestCase(TestCase):
             author=author
         )
         library1.add_book(book)
-        library2.add_book(book)
-        library3.add_book(book)
+        for library in (library2, library3):
+            library.add_book(Book(title=title, genre="biznes", author=author))
 
         # When
         libraries_with_book = find_libraries_with_book(book)
@@ -256,4 +261,428 @@ class UtilsTestCase(TestCase):
     def test_find_libraries_with_book_with_wrong_name_type(self):
         self.book = 3.14
         with self.assertRaises(ValueError):
-            find_libraries_with_book(self.book)
\ No newline at end of file
+            find_libraries_with_book(self.book)
+
+    def test_count_titles_by_location(self):
+        # Given
+        author = add_author(name="Tim Ferriss")
+        library = add_library("Plac politechniki 1")
+        for _ in range(2):
+            add_book(title="4h workweek", genre="biznes", author=author, library=library)
+
+        # When
+        titles = count_titles("Plac politechniki 1")
+
+        # Then
+        self.assertEqual(titles, {"4h workweek": 2})
+
+    def test_count_books_by_genre_and_author(self):
+        # Given
+        author1 = add_author(name="Tim Ferriss")
+        author2 = add_author(name="Sapkowski")
+        library = add_library("Plac politechniki 1")
+        add_book(title="4h workweek", genre="biznes", author=author1, library=library)
+        add_book(title="Narzędzia tytanów", genre="biznes", author=author1, library=library)
+        add_book(title="Krew elfów", genre="fantasy", author=author2, library=library)
+        add_book(title="Krew elfów", genre="fantasy", author=author2)
+
+        # When
+        genres = count_books(library, by='genre')
+        authors = count_books(library, by='author')
+
+        # Then
+        self.assertEqual(genres, {"biznes": 2, "fantasy": 1})
+        self.assertEqual(authors, {"Tim Ferriss": 2, "Sapkowski": 1})
+
+    def test_count_books_with_unknown_field(self):
+        library = add_library("Plac politechniki 1")
+        with self.assertRaises(ValueError):
+            count_books(library, by='isbn')
+
+
+class SearchBooksTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = add_author(name="Andrzej Sapkowski")
+        self.ferriss = add_author(name="Tim Ferriss")
+        self.book1 = add_book(title="Krew elfów", genre="fantasy", author=self.sapkowski)
+        self.book2 = add_book(title="Czas pogardy", genre="fantasy", author=self.sapkowski)
+        self.book3 = add_book(title="4h workweek", genre="biznes", author=self.ferriss)
+
+    def test_search_by_title_ignores_case_and_diacritics(self):
+        # When
+        books = search_books("krew elfow")
+
+        # Then
+        self.assertEqual(books, [self.book1])
+
+    def test_search_by_author_and_genre(self):
+        # When
+        books = search_books("sapkowski fantasy")
+
+        # Then
+        self.assertEqual(set(books), {self.book1, self.book2})
+
+    def test_search_by_prefix(self):
+        # When
+        books = search_books("work")
+
+        # Then
+        self.assertEqual(books, [self.book3])
+
+    def test_title_match_ranks_first(self):
+        # Given
+        fantasy_author = add_author(name="Pogardy")
+        book = add_book(title="Inna książka", genre="fantasy", author=fantasy_author)
+
+        # When
+        books = search_books("pogardy")
+
+        # Then
+        self.assertEqual(books, [self.book2, book])
+
+    def test_search_pagination(self):
+        # When
+        first = search_books("sapkowski", limit=1)
+        second = search_books("sapkowski", limit=1, offset=1)
+
+        # Then
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first, second)
+
+    def test_index_follows_updates_and_deletes(self):
+        # Given
+        self.sapkowski.name = "Sapkowski A."
+        self.sapkowski.save()
+        self.book3.title = "Narzędzia tytanów"
+        self.book3.save()
+        self.book1.delete()
+
+        # Then
+        self.assertEqual(search_books("andrzej"), [])
+        self.assertEqual(search_books("sapkowski"), [self.book2])
+        self.assertEqual(search_books("tytanow"), [self.book3])
+
+    def test_empty_query(self):
+        self.assertEqual(search_books("  ?! "), [])
+
+    def test_search_with_wrong_query_type(self):
+        with self.assertRaises(ValueError):
+            search_books(3.14)
+
+
+class BatchedLookupsTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = add_author(name="Sapkowski")
+        self.ferriss = add_author(name="Tim Ferriss")
+        self.library1 = add_library("Plac Narutowicza")
+        self.library2 = add_library("Marszałkowska")
+        self.book1 = add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+        self.book2 = add_book("Krew elfów", "fantasy", self.sapkowski, self.library2)
+        self.book3 = add_book("Czas pogardy", "fantasy", self.sapkowski, self.library1)
+        self.book4 = add_book("4h workweek", "biznes", self.ferriss)
+
+    def test_view_books_by_authors(self):
+        # When
+        with self.assertNumQueries(2):
+            books = view_books_by_authors(["Sapkowski", self.ferriss])
+
+        # Then
+        self.assertEqual(books, {
+            self.sapkowski: [self.book1, self.book2, self.book3],
+            self.ferriss: [self.book4],
+        })
+
+    def test_view_books_by_authors_with_wrong_name(self):
+        with self.assertRaises(ValueError):
+            view_books_by_authors(["Sapkowski", "Null Pointer"])
+
+    def test_view_books_in_libraries(self):
+        # Given
+        empty_library = add_library("Złota 44")
+
+        # When
+        with self.assertNumQueries(1):
+            books = view_books_in_libraries([self.library1, self.library2, empty_library])
+
+        # Then
+        self.assertEqual(books[self.library1], [self.book1, self.book3])
+        self.assertEqual(books[self.library2], [self.book2])
+        self.assertEqual(books[empty_library], [])
+
+    def test_view_books_in_libraries_with_wrong_type(self):
+        with self.assertRaises(ValueError):
+            view_books_in_libraries([self.library1, 3.14])
+
+    def test_count_titles_in_libraries(self):
+        # Given
+        add_book("Krew elfów", "fantasy", self.sapkowski, self.library1)
+
+        # When
+        with self.assertNumQueries(2):
+            titles = count_titles_in_libraries(["Plac Narutowicza", "Marszałkowska"])
+
+        # Then
+        self.assertEqual(titles, {
+            self.library1: {"Krew elfów": 2, "Czas pogardy": 1},
+            self.library2: {"Krew elfów": 1},
+        })
+
+    def test_count_books_in_libraries_by_author(self):
+        # When
+        counts = count_books_in_libraries([self.library1], by='author')
+
+        # Then
+        self.assertEqual(counts, {self.library1: {"Sapkowski": 2}})
+
+    def test_find_libraries_with_books(self):
+        # When
+        with self.assertNumQueries(2):
+            libraries = find_libraries_with_books([self.book1, self.book3, self.book4])
+
+        # Then
+        self.assertEqual(libraries, {
+            self.book1: [self.library1, self.library2],
+            self.book3: [self.library1],
+            self.book4: [],
+        })
+
+    def test_find_libraries_with_books_with_wrong_type(self):
+        with self.assertRaises(ValueError):
+            find_libraries_with_books([self.book1, "Krew elfów"])
+
+
+class BulkWritesTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = add_author(name="Sapkowski")
+        self.library1 = add_library("Plac Narutowicza")
+        self.library2 = add_library("Marszałkowska")
+        self.books = [
+            add_book(f"Tom {i}", "fantasy", self.sapkowski, self.library1) for i in range(4)
+        ]
+
+    def test_update_books_moves_books(self):
+        # When
+        count = update_books(self.books[:3], library="Marszałkowska", genre="dark fantasy")
+
+        # Then
+        self.assertEqual(count, 3)
+        self.assertEqual(
+            list(Book.objects.values_list('library_id', 'work__genre')),
+            [(self.library2.pk, "dark fantasy")] * 3 + [(self.library1.pk, "fantasy")],
+        )
+
+    def test_update_books_by_queryset(self):
+        # When
+        count = update_books(Book.objects.filter(library=self.library1), library=None)
+
+        # Then
+        self.assertEqual(count, 4)
+        self.assertFalse(Book.objects.filter(library__isnull=False).exists())
+
+    def test_bulk_writes_do_not_query_per_book(self):
+        # Given
+        more = [add_book(f"Tom {i}", "fantasy", self.sapkowski, self.library1) for i in range(4, 20)]
+
+        # Then
+        with CaptureQueriesContext(connection) as few:
+            update_books(self.books, genre="horror")
+            delete_books(self.books)
+        with CaptureQueriesContext(connection) as many:
+            update_books(more, genre="horror")
+            delete_books(more)
+        self.assertLessEqual(len(many), len(few))
+
+    def test_long_id_lists_are_locked_in_chunks(self):
+        # Given: duplicates and ids of books that do not exist.
+        ids = [book.pk for book in self.books] * 2 + list(range(10**6, 10**6 + BULK_BATCH_SIZE))
+
+        # When
+        with CaptureQueriesContext(connection) as queries:
+            count = update_books(ids, genre="horror")
+
+        # Then
+        self.assertEqual(count, 4)
+        self.assertEqual(Book.objects.filter(work__genre="horror").count(), 4)
+        longest = max(
+            sql.count(',') + 1
+            for query in queries
+            for sql in re.findall(r'IN \(([^)]*)\)', query['sql'])
+        )
+        self.assertLessEqual(longest, BULK_BATCH_SIZE)
+
+    def test_update_books_with_wrong_field(self):
+        with self.assertRaises(ValueError):
+            update_books(self.books, title="Krew elfów")
+        with self.assertRaises(ValueError):
+            update_books(self.books, library="Nieistniejąca")
+
+    def test_delete_books(self):
+        # When
+        count = delete_books([self.books[0].pk, self.books[1]])
+
+        # Then
+        self.assertEqual(count, 2)
+        self.assertEqual(list(Book.objects.all()), self.books[2:])
+        self.assertEqual(delete_books(Book.objects.none()), 0)
+
+    def test_delete_books_with_wrong_type(self):
+        with self.assertRaises(ValueError):
+            delete_books(["Tom 1"])
+        with self.assertRaises(ValueError):
+            delete_books(Author.objects.all())
+
+
+class NameCacheTestCase(TestCase):
+    def setUp(self):
+        author_names.clear()
+        library_locations.clear()
+        self.sapkowski = add_author(name="Sapkowski")
+        self.library = add_library("Plac Narutowicza")
+
+    def resolve(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return author_names.lookup(name)
+
+    def test_hot_lookups_skip_database(self):
+        # Given
+        with self.captureOnCommitCallbacks(execute=True):
+            view_books_by_author("Sapkowski")
+            view_books_in_libraries(["Plac Narutowicza"])
+
+        # Then
+        with self.assertNumQueries(0):
+            self.assertEqual(author_names.lookup("Sapkowski"), self.sapkowski)
+            self.assertEqual(library_locations.lookup("Plac Narutowicza"), self.library)
+
+    def test_uncommitted_lookups_are_not_cached(self):
+        # Given
+        author_names.lookup("Sapkowski")
+
+        # Then
+        with self.assertNumQueries(1):
+            author_names.lookup("Sapkowski")
+
+    def test_rename_and_delete_discard_entries(self):
+        # Given
+        self.resolve("Sapkowski")
+
+        # When
+        self.sapkowski.name = "Andrzej Sapkowski"
+        self.sapkowski.save()
+
+        # Then
+        self.assertIsNone(self.resolve("Sapkowski"))
+        self.assertEqual(self.resolve("Andrzej Sapkowski"), self.sapkowski)
+        self.sapkowski.delete()
+        self.assertIsNone(self.resolve("Andrzej Sapkowski"))
+
+    @override_settings(BIBLIOTEKA_NAME_CACHE_TTL=0)
+    def test_entries_expire(self):
+        # Given
+        self.resolve("Sapkowski")
+
+        # Then
+        with self.assertNumQueries(1):
+            author_names.lookup("Sapkowski")
+
+    @override_settings(BIBLIOTEKA_NAME_CACHE_SIZE=1)
+    def test_least_recently_used_entry_is_evicted(self):
+        # Given
+        add_author(name="Tim Ferriss")
+        self.resolve("Sapkowski")
+        self.resolve("Tim Ferriss")
+
+        # Then
+        self.assertIsNone(author_names.get("Sapkowski"))
+        self.assertEqual(author_names.get("Tim Ferriss").name, "Tim Ferriss")
+
+
+class StreamingResultsTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = add_author(name="Sapkowski")
+        self.library = add_library("Plac Narutowicza")
+        self.books = [
+            add_book(f"Tom {i}", "fantasy", self.sapkowski, self.library) for i in range(5)
+        ]
+
+    def test_streamed_books_are_fetched_lazily(self):
+        # When
+        with self.assertNumQueries(0):
+            books = view_books_by_author(self.sapkowski, stream=True, chunk_size=2)
+
+        # Then
+        with self.assertNumQueries(1):
+            self.assertEqual(next(books), self.books[0])
+        self.assertEqual(list(books), self.books[1:])
+
+    def test_value_tuples(self):
+        # When
+        books = view_books_in_library(
+            "Plac Narutowicza", stream=True, fields=['title', 'author__name']
+        )
+
+        # Then
+        first = next(books)
+        self.assertEqual(first, ("Tom 0", "Sapkowski"))
+        self.assertEqual(first.title, "Tom 0")
+
+    def test_find_libraries_with_book_fields(self):
+        # When
+        libraries = find_libraries_with_book(self.books[0], fields=['location'])
+
+        # Then
+        self.assertEqual(libraries, [("Plac Narutowicza",)])
+
+    def test_wrong_fields_and_chunk_size(self):
+        with self.assertRaises(ValueError):
+            view_books_by_author(self.sapkowski, fields=['isbn'])
+        with self.assertRaises(ValueError):
+            view_books_by_author(self.sapkowski, stream=True, chunk_size=0)
+
+
+class AuthorBibliographyTestCase(TestCase):
+    def setUp(self):
+        self.sapkowski = add_author(name="Sapkowski")
+        self.library = add_library("Plac Narutowicza")
+        for title, genre in [
+            ("Krew elfów", "fantasy"),
+            ("Czas pogardy", "fantasy"),
+            ("Krew elfów", "fantasy"),
+            ("Narrenturm", "fantasy"),
+            ("Narrenturm", "historyczna"),
+        ]:
+            add_book(title, genre, self.sapkowski, self.library)
+
+    def test_view_titles_by_author_keeps_first_appearance_order(self):
+        with self.assertNumQueries(1):
+            titles = view_titles_by_author(self.sapkowski)
+        self.assertEqual(titles, ["Krew elfów", "Czas pogardy", "Narrenturm"])
+
+    def test_titles_are_paginated_alphabetically(self):
+        # When
+        first = author_bibliography(self.sapkowski, limit=2)
+        rest = author_bibliography(self.sapkowski, after=first[-1], limit=2)
+
+        # Then
+        self.assertEqual(first, ["Czas pogardy", "Krew elfów"])
+        self.assertEqual(rest, ["Narrenturm"])
+
+    def test_details(self):
+        # When
+        with self.assertNumQueries(2):
+            titles = author_bibliography(self.sapkowski, after="Czas pogardy", details=True)
+
+        # Then
+        self.assertEqual(titles, [
+            {'title': "Krew elfów", 'copies': 2, 'genres': ["fantasy"]},
+            {'title': "Narrenturm", 'copies': 2, 'genres': ["fantasy", "historyczna"]},
+        ])
+
+    def test_wrong_arguments(self):
+        with self.assertRaises(ValueError):
+            author_bibliography("Null Pointer")
+        with self.assertRaises(ValueError):
+            author_bibliography(self.sapkowski, limit=0)
+        with self.assertRaises(ValueError):
+            author_bibliography(self.sapkowski, after=3)
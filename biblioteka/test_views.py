@@ -0,0 +1,724 @@
+import threading
+import warnings
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.urls import reverse
+
+from biblioteka.aio import gather_reads
+from biblioteka.cache import detail_cache_stats, detail_key, get_catalogue_version
+from biblioteka.models import Author, Book, Library
+from biblioteka.pagination import keyset_paginate
+from biblioteka.profiling import N_PLUS_ONE, QueryProfilingMiddleware, sql_shape
+from biblioteka.utils import *
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.author = add_author(name="Tim Ferriss")
+        self.books = [
+            add_book(title=f"Tytuł {i}", genre="biznes", author=self.author)
+            for i in range(7)
+        ]
+
+    def test_first_page(self):
+        # When
+        page = keyset_paginate(Book.objects.all(), page_size=3)
+
+        # Then
+        self.assertEqual(list(page), self.books[:3])
+        self.assertEqual(page.next_cursor, self.books[2].pk)
+        self.assertIsNone(page.prev_cursor)
+
+    def test_walking_forward_to_last_page(self):
+        # Given
+        page = keyset_paginate(Book.objects.all(), page_size=3)
+        page = keyset_paginate(Book.objects.all(), after=page.next_cursor, page_size=3)
+
+        # When
+        last_page = keyset_paginate(Book.objects.all(), after=page.next_cursor, page_size=3)
+
+        # Then
+        self.assertEqual(list(page), self.books[3:6])
+        self.assertEqual(list(last_page), self.books[6:])
+        self.assertIsNone(last_page.next_cursor)
+        self.assertEqual(last_page.prev_cursor, self.books[6].pk)
+
+    def test_walking_backward(self):
+        # When
+        page = keyset_paginate(Book.objects.all(), before=self.books[6].pk, page_size=3)
+        first_page = keyset_paginate(Book.objects.all(), before=page.prev_cursor, page_size=3)
+
+        # Then
+        self.assertEqual(list(page), self.books[3:6])
+        self.assertEqual(page.next_cursor, self.books[5].pk)
+        self.assertEqual(list(first_page), self.books[:3])
+        self.assertIsNone(first_page.prev_cursor)
+
+    @override_settings(BIBLIOTEKA_MAX_PAGE_SIZE=5)
+    def test_page_size_is_clamped(self):
+        # When
+        page = keyset_paginate(Book.objects.all(), page_size=1000)
+
+        # Then
+        self.assertEqual(len(page), 5)
+
+
+class ListViewsTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        library = add_library("Plac Politechniki 1")
+        for i in range(5):
+            author = add_author(name=f"Autor {i}")
+            add_book(title=f"Tytuł {i}", genre="biznes", author=author, library=library)
+        get_catalogue_version()
+
+    def test_books_list_fetches_authors_in_the_same_query(self):
+        # When: the catalogue version, then books with their authors.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('biblioteka:book-list'))
+
+        # Then
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Autor 4")
+
+    def test_books_list_next_cursor(self):
+        # When
+        response = self.client.get(reverse('biblioteka:book-list'), {'size': 2})
+
+        # Then
+        page = response.context['page']
+        self.assertEqual(len(page), 2)
+        self.assertContains(response, f"?after={page.next_cursor}&size=2")
+
+    def test_authors_list_with_invalid_cursor(self):
+        # When
+        response = self.client.get(reverse('biblioteka:author-list'), {'after': 'abc'})
+
+        # Then
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['authors']), 5)
+
+    def test_libraries_list(self):
+        # When
+        response = self.client.get(reverse('biblioteka:library-list'))
+
+        # Then
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Plac Politechniki 1")
+
+
+class ListCachingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = add_author(name="Sapkowski")
+        self.book = add_book(title="Krew elfów", genre="fantasy", author=self.author)
+
+    def get_books(self, **headers):
+        return self.client.get(reverse('biblioteka:book-list'), **headers)
+
+    def test_rendered_list_is_cached(self):
+        # Given
+        self.get_books()
+
+        # When: only the catalogue version is read.
+        with self.assertNumQueries(1):
+            response = self.get_books()
+
+        # Then
+        self.assertContains(response, "Krew elfów")
+
+    def test_pages_are_cached_separately(self):
+        # Given
+        add_book(title="Czas pogardy", genre="fantasy", author=self.author)
+        self.client.get(reverse('biblioteka:book-list'), {'size': 1})
+
+        # When
+        response = self.client.get(reverse('biblioteka:book-list'), {'size': 1, 'after': self.book.pk})
+
+        # Then
+        self.assertContains(response, "Czas pogardy")
+        self.assertNotContains(response, "Krew elfów")
+
+    def test_unchanged_catalogue_answers_304(self):
+        # Given
+        response = self.get_books()
+
+        # When
+        by_etag = self.get_books(HTTP_IF_NONE_MATCH=response['ETag'])
+        by_date = self.get_books(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        # Then
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_any_change_starts_new_version(self):
+        # Given
+        response = self.get_books()
+
+        # When
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.name = "Andrzej Sapkowski"
+            self.author.save()
+
+        # Then
+        changed = self.get_books(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertContains(changed, "Andrzej Sapkowski")
+
+    def test_version_is_kept_in_the_database(self):
+        # Given
+        response = self.get_books()
+
+        # When: another process has its own, empty cache.
+        cache.clear()
+
+        # Then
+        unchanged = self.get_books(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.library = add_library("Plac Politechniki 1")
+        self.sapkowski = add_author(name="Sapkowski")
+        self.ferriss = add_author(name="Tim Ferriss")
+        self.books = [
+            add_book("Krew elfów", "fantasy", self.sapkowski, self.library),
+            add_book("Czas pogardy", "fantasy", self.sapkowski),
+            add_book("4h workweek", "biznes", self.ferriss, self.library),
+        ]
+
+    def get(self, resource, **params):
+        return self.client.get(reverse('biblioteka:api-list', args=[resource]), params)
+
+    def test_books(self):
+        # When
+        response = self.get('books')
+
+        # Then
+        self.assertEqual(response.json()['data'][0], {
+            'id': self.books[0].pk,
+            'title': "Krew elfów",
+            'genre': "fantasy",
+            'author': self.sapkowski.pk,
+            'library': self.library.pk,
+        })
+        self.assertIsNone(response.json()['next'])
+
+    def test_sparse_fieldset(self):
+        # When
+        response = self.get('books', fields='title')
+
+        # Then
+        self.assertEqual(response.json()['data'][1], {'id': self.books[1].pk, 'title': "Czas pogardy"})
+
+    def test_includes_are_batched(self):
+        # Given
+        params = {'include': 'author,library', 'fields[authors]': 'name'}
+
+        # Then: the catalogue version, books, authors and libraries, one query each.
+        get_catalogue_version()
+        with self.assertNumQueries(4):
+            response = self.get('books', **params)
+        included = response.json()['included']
+        self.assertEqual(included['authors'], [
+            {'id': self.sapkowski.pk, 'name': "Sapkowski"},
+            {'id': self.ferriss.pk, 'name': "Tim Ferriss"},
+        ])
+        self.assertEqual(included['libraries'], [
+            {'id': self.library.pk, 'location': "Plac Politechniki 1"},
+        ])
+
+    def test_cursor_pagination(self):
+        # When
+        first = self.get('books', size=2).json()
+        second = self.get('books', size=2, after=first['next']).json()
+
+        # Then
+        self.assertEqual([book['id'] for book in first['data']], [b.pk for b in self.books[:2]])
+        self.assertEqual([book['id'] for book in second['data']], [self.books[2].pk])
+        self.assertIsNone(second['next'])
+        self.assertEqual(second['previous'], self.books[2].pk)
+
+    def test_detail(self):
+        # When
+        response = self.client.get(
+            reverse('biblioteka:api-detail', args=['authors', self.ferriss.pk])
+        )
+
+        # Then
+        self.assertEqual(response.json(), {'data': {'id': self.ferriss.pk, 'name': "Tim Ferriss"}})
+        self.assertEqual(self.client.get(
+            reverse('biblioteka:api-detail', args=['authors', 0])
+        ).status_code, 404)
+
+    def test_author_bibliography(self):
+        # Given
+        add_book("Krew elfów", "fantasy", self.sapkowski)
+        url = reverse('biblioteka:api-author-bibliography', args=[self.sapkowski.pk])
+
+        # When
+        first = self.client.get(url, {'size': 1, 'details': 1}).json()
+        second = self.client.get(url, {'size': 1, 'after': first['next']}).json()
+
+        # Then
+        self.assertEqual(first, {
+            'data': [{'title': "Czas pogardy", 'copies': 1, 'genres': ["fantasy"]}],
+            'next': "Czas pogardy",
+        })
+        self.assertEqual(second, {'data': ["Krew elfów"], 'next': None})
+
+    def test_title_availability(self):
+        # Given
+        add_book("Krew elfów", "fantasy", self.sapkowski, self.library)
+        url = reverse('biblioteka:api-title-availability')
+
+        # When
+        response = self.client.get(url, {'title': "Krew elfów"})
+
+        # Then
+        self.assertEqual(response.json(), {
+            'title': "Krew elfów",
+            'copies': 2,
+            'libraries': [{'id': self.library.pk, 'location': "Plac Politechniki 1", 'copies': 2}],
+        })
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_invalid_parameters(self):
+        for resource, params in [
+            ('users', {}),
+            ('books', {'fields': 'isbn'}),
+            ('authors', {'include': 'library'}),
+        ]:
+            with self.subTest(resource=resource, params=params):
+                response = self.get(resource, **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class BooksBulkTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(User.objects.create_user('bibliotekarz'))
+        self.library1 = add_library("Plac Politechniki 1")
+        self.library2 = add_library("Marszałkowska")
+        self.author = add_author(name="Sapkowski")
+        self.books = [
+            add_book(f"Tom {i}", "fantasy", self.author, self.library1) for i in range(3)
+        ]
+
+    def post(self, data):
+        return self.client.post(reverse('biblioteka:book-bulk'), data)
+
+    def test_update_by_filter(self):
+        # When
+        response = self.post({
+            'action': 'update', 'library': self.library1.pk,
+            'set_library': self.library2.pk, 'set_genre': "horror",
+        })
+
+        # Then
+        self.assertEqual(response.json(), {'action': 'update', 'count': 3})
+        self.assertEqual(Book.objects.filter(library=self.library2, work__genre="horror").count(), 3)
+
+    def test_delete_by_ids(self):
+        # When
+        response = self.post({'action': 'delete', 'ids': [self.books[0].pk, self.books[2].pk]})
+
+        # Then
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(list(Book.objects.all()), [self.books[1]])
+
+    def test_ids_are_combined_with_filters(self):
+        # Given
+        moved = add_book("Tom 3", "fantasy", self.author, self.library2)
+
+        # When
+        response = self.post({
+            'action': 'delete', 'library': self.library1.pk,
+            'ids': [self.books[0].pk, moved.pk],
+        })
+
+        # Then
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(set(Book.objects.all()), {self.books[1], self.books[2], moved})
+
+    def test_selection_is_required(self):
+        # When
+        response = self.post({'action': 'delete'})
+
+        # Then
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_login_is_required(self):
+        # Given
+        self.client.logout()
+
+        # When
+        response = self.post({'action': 'delete', 'genre': "fantasy"})
+
+        # Then
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Book.objects.count(), 3)
+
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.authors = [add_author(name=f"Autor {i:02}") for i in range(30)]
+        self.sapkowski = add_author(name="Sapkowski")
+        self.library = add_library("Plac Politechniki 1")
+        add_library("Marszałkowska")
+        self.book = add_book("Krew elfów", "fantasy", self.sapkowski, self.library)
+
+    def suggest(self, resource, **params):
+        return self.client.get(reverse('biblioteka:api-suggest', args=[resource]), params)
+
+    def test_suggestions_are_paginated(self):
+        # When
+        first = self.suggest('authors', q="autor", size=20).json()
+        second = self.suggest('authors', q="autor", size=20, after=first['next']).json()
+
+        # Then
+        self.assertEqual(first['results'][0], {'id': self.authors[0].pk, 'text': "Autor 00"})
+        self.assertEqual(first['next'], "Autor 19")
+        self.assertEqual([result['text'] for result in second['results']][-1], "Autor 29")
+        self.assertIsNone(second['next'])
+        self.assertEqual(
+            self.suggest('libraries', q="Plac").json()['results'],
+            [{'id': self.library.pk, 'text': "Plac Politechniki 1"}],
+        )
+        self.assertEqual(self.suggest('books').status_code, 400)
+
+    def test_book_form_renders_only_chosen_options(self):
+        # When
+        response = self.client.get(reverse('biblioteka:book-edit', args=[self.book.pk]))
+
+        # Then
+        content = response.content.decode()
+        self.assertIn('data-autocomplete-url="/api/authors/suggest/"', content)
+        self.assertIn('autocomplete.js', content)
+        self.assertIn('<option value="%d" selected>Sapkowski</option>' % self.sapkowski.pk, content)
+        self.assertNotIn("Autor 00", content)
+        self.assertNotIn("Marszałkowska", content)
+
+    def test_book_form_accepts_any_author(self):
+        # When
+        self.client.post(reverse('biblioteka:book-edit', args=[self.book.pk]), {
+            'title': "Krew elfów", 'genre': "fantasy", 'author': self.authors[5].pk, 'library': '',
+        })
+
+        # Then
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.author, self.book.library), (self.authors[5], None))
+
+    def test_book_form_rejects_invalid_author(self):
+        # When
+        response = self.client.post(reverse('biblioteka:book-edit', args=[self.book.pk]), {
+            'title': "Krew elfów", 'genre': "fantasy", 'author': "abc", 'library': '',
+        })
+
+        # Then
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'author', [
+            "Select a valid choice. That choice is not one of the available choices.",
+        ])
+        self.assertNotIn("Sapkowski", response.content.decode())
+
+    def test_admin_uses_autocomplete(self):
+        # Given
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+
+        # When
+        response = self.client.get(reverse('admin:biblioteka_book_change', args=[self.book.pk]))
+
+        # Then
+        self.assertContains(response, "Sapkowski")
+        self.assertNotContains(response, "Autor 00")
+
+
+class CatalogueExportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        library = add_library("Plac Politechniki 1")
+        author = add_author(name="Sapkowski")
+        add_book(title="Krew elfów", genre="fantasy", author=author, library=library)
+        add_book(title="Czas pogardy", genre="fantasy", author=author)
+
+    def test_books_csv_export_is_streamed(self):
+        # When
+        response = self.client.get(reverse('biblioteka:catalogue-export'))
+
+        # Then
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(content.splitlines(), [
+            "id,title,genre,author,library",
+            f"{Book.objects.get(work__title='Krew elfów').pk},Krew elfów,fantasy,Sapkowski,Plac Politechniki 1",
+            f"{Book.objects.get(work__title='Czas pogardy').pk},Czas pogardy,fantasy,Sapkowski,",
+        ])
+
+    async def test_export_is_streamed_under_asgi(self):
+        # When
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            response = await AsyncClient().get(reverse('biblioteka:catalogue-export'))
+            # As the ASGI handler sends it.
+            content = b''.join([chunk async for chunk in response])
+
+        # Then
+        self.assertEqual(len(content.decode('utf-8').splitlines()), 3)
+        self.assertFalse([w for w in caught if 'StreamingHttpResponse' in str(w.message)])
+
+    def test_libraries_jsonl_export(self):
+        # When
+        response = self.client.get(
+            reverse('biblioteka:catalogue-export'), {'entity': 'libraries', 'format': 'jsonl'}
+        )
+
+        # Then
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('"location": "Plac Politechniki 1"', content)
+
+    def test_unknown_entity(self):
+        # When
+        response = self.client.get(reverse('biblioteka:catalogue-export'), {'entity': 'users'})
+
+        # Then
+        self.assertEqual(response.status_code, 400)
+
+
+
+class DetailCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.library = add_library("Plac Politechniki 1")
+        self.author = add_author(name="Sapkowski")
+        self.book = add_book(
+            title="Krew elfów", genre="fantasy", author=self.author, library=self.library
+        )
+
+    def get_library(self):
+        return self.client.get(reverse('biblioteka:library-detail', args=[self.library.pk]))
+
+    def test_second_request_is_served_from_cache(self):
+        # Given
+        self.get_library()
+        hits = detail_cache_stats()['hits']
+
+        # When
+        with self.assertNumQueries(0):
+            response = self.get_library()
+
+        # Then
+        self.assertContains(response, "Sapkowski - Krew elfów")
+        self.assertEqual(detail_cache_stats()['hits'], hits + 1)
+
+    def test_saving_book_invalidates_library_and_author(self):
+        # Given
+        self.get_library()
+        self.client.get(reverse('biblioteka:author-detail', args=[self.author.pk]))
+
+        # When
+        add_book(title="Czas pogardy", genre="fantasy", author=self.author, library=self.library)
+
+        # Then
+        self.assertContains(self.get_library(), "Czas pogardy")
+        response = self.client.get(reverse('biblioteka:author-detail', args=[self.author.pk]))
+        self.assertContains(response, "Czas pogardy")
+
+    def test_detail_cached_before_commit_is_invalidated(self):
+        # When
+        with self.captureOnCommitCallbacks(execute=True):
+            add_book(title="Czas pogardy", genre="fantasy", author=self.author, library=self.library)
+            # Another request, not seeing the new book yet, caches the old detail.
+            cache.set(detail_key(Library, self.library.pk), {'stale': True})
+
+        # Then
+        self.assertIsNone(cache.get(detail_key(Library, self.library.pk)))
+
+    def test_moving_book_invalidates_previous_library(self):
+        # Given
+        self.get_library()
+        book = Book.objects.get(pk=self.book.pk)
+
+        # When
+        add_library("Złota 44").add_book(book)
+
+        # Then
+        self.assertNotContains(self.get_library(), "Krew elfów")
+
+    def test_bulk_publish_invalidates_library(self):
+        # Given
+        self.get_library()
+
+        # When
+        self.library.add_books([Book(title="Czas pogardy", genre="fantasy", author=self.author)])
+
+        # Then
+        self.assertContains(self.get_library(), "Czas pogardy")
+
+    def test_renaming_author_invalidates_book_detail(self):
+        # Given
+        url = reverse('biblioteka:book-detail', args=[self.book.pk])
+        self.client.get(url)
+
+        # When
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.name = "Andrzej Sapkowski"
+            self.author.save()
+
+        # Then
+        self.assertContains(self.client.get(url), "Andrzej Sapkowski")
+
+    def test_missing_object(self):
+        # When
+        response = self.client.get(reverse('biblioteka:book-detail', args=[self.book.pk + 100]))
+
+        # Then
+        self.assertEqual(response.status_code, 404)
+
+
+class BooksSearchTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        author = add_author(name="Sapkowski")
+        for title in ("Krew elfów", "Czas pogardy", "Chrzest ognia"):
+            add_book(title=title, genre="fantasy", author=author)
+
+    def test_search_results_are_paginated(self):
+        # When
+        response = self.client.get(reverse('biblioteka:book-search'), {'q': 'sapkowski', 'size': 2})
+
+        # Then
+        self.assertEqual(len(response.context['books']), 2)
+        self.assertEqual(response.context['next_page'], 2)
+        self.assertContains(response, "?q=sapkowski&page=2&size=2")
+
+    def test_no_results(self):
+        # When
+        response = self.client.get(reverse('biblioteka:book-search'), {'q': 'Wiedźmin'})
+
+        # Then
+        self.assertContains(response, 'Brak wyników dla "Wiedźmin"')
+
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        author = add_author(name="Sapkowski")
+        add_book(title="Krew elfów", genre="fantasy", author=author)
+
+    def test_metrics_expose_per_route_histograms(self):
+        # Given
+        self.client.get(reverse('biblioteka:book-list'))
+
+        # When
+        response = self.client.get(reverse('biblioteka:metrics'))
+
+        # Then
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        content = response.content.decode()
+        self.assertIn('biblioteka_request_queries_bucket{route="biblioteka:book-list",le="1"}', content)
+        self.assertIn('biblioteka_request_template_seconds_count{route="biblioteka:book-list"}', content)
+        self.assertIn('biblioteka_detail_cache_hits_total', content)
+
+    def test_repeated_query_shape_is_flagged(self):
+        # Given
+        def view_with_n_plus_one(request):
+            for book in Book.objects.all():
+                for _ in range(5):
+                    Author.objects.get(pk=book.author_id)
+            return HttpResponse()
+
+        middleware = QueryProfilingMiddleware(view_with_n_plus_one)
+        request = RequestFactory().get('/')
+        before = N_PLUS_ONE.series['unresolved']
+
+        # When
+        with self.assertLogs('biblioteka.profiling', level='WARNING'):
+            middleware(request)
+
+        # Then
+        self.assertEqual(N_PLUS_ONE.series['unresolved'], before + 1)
+
+    def test_sql_shape_ignores_in_list_length(self):
+        self.assertEqual(
+            sql_shape('SELECT 1 WHERE id IN (%s, %s, %s)'),
+            sql_shape('SELECT 1 WHERE id IN (%s, %s)'),
+        )
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.library = add_library("Plac Politechniki 1")
+        self.author = add_author(name="Sapkowski")
+        add_book(title="Krew elfów", genre="fantasy", author=self.author, library=self.library)
+        add_book(title="Krew elfów", genre="fantasy", author=self.author, library=self.library)
+
+    async def test_library_detail_under_asgi(self):
+        # When
+        response = await AsyncClient().get(
+            reverse('biblioteka:library-detail', args=[self.library.pk])
+        )
+
+        # Then
+        self.assertContains(response, "Liczba książek: 2, liczba tytułów: 1")
+        self.assertContains(response, "Krew elfów: 2 książek")
+
+    async def test_lists_under_asgi(self):
+        for name in ('book-list', 'author-list', 'library-list'):
+            response = await AsyncClient().get(reverse(f'biblioteka:{name}'))
+            self.assertEqual(response.status_code, 200)
+
+    async def test_missing_object_under_asgi(self):
+        response = await AsyncClient().get(reverse('biblioteka:author-detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+class GatherReadsTestCase(TransactionTestCase):
+    async def test_reads_run_in_separate_threads(self):
+        # Given
+        started = threading.Barrier(2, timeout=5)
+
+        def read(value):
+            # Both reads have to be running at once to pass the barrier.
+            started.wait()
+            return value, Library.objects.count()
+
+        # When
+        results = await gather_reads(lambda: read('a'), lambda: read('b'))
+
+        # Then
+        self.assertEqual(results, [('a', 0), ('b', 0)])
+
+    def test_reads_inside_transaction_use_callers_connection(self):
+        # Given
+        add_library("Plac Politechniki 1")
+
+        # When
+        with transaction.atomic():
+            add_library("Marszałkowska")
+            results = async_to_sync(gather_reads)(
+                Library.objects.count, threading.get_ident,
+            )
+
+        # Then
+        self.assertEqual(results, [2, threading.get_ident()])
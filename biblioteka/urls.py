@@ -1,5 +1,6 @@
 from django.urls import include, path
 
+from .profiling import metrics
 from .views import *
 
 app_name = 'biblioteka'
@@ -20,7 +21,19 @@ urlpatterns = [
     path('library/delete/<int:pk>/', LibraryDeleteView.as_view(), name='library-delete'),
     path('libraries/', libraries_list, name='library-list'),
     path('books/', books_list, name='book-list'),
+    path('books/search/', books_search, name='book-search'),
+    path('books/bulk/', books_bulk, name='book-bulk'),
+    path('books/export/', catalogue_export, name='catalogue-export'),
+    path('api/titles/availability/', api_title_availability, name='api-title-availability'),
+    path('api/<str:resource>/suggest/', api_suggest, name='api-suggest'),
+    path('api/<str:resource>/', api_list, name='api-list'),
+    path('api/<str:resource>/<int:pk>/', api_detail, name='api-detail'),
+    path(
+        'api/authors/<int:pk>/bibliography/', api_author_bibliography,
+        name='api-author-bibliography',
+    ),
     path('authors/', authors_list, name='author-list'),
     path('register/', Register.as_view(), name="register"),
     path('profile/', profile, name="profile"),
+    path('metrics', metrics, name="metrics"),
 ]
\ No newline at end of file
@@ -1,97 +1,513 @@
-from biblioteka.models import Author, Book, Library
+from django.core.exceptions import FieldError
+from django.db import connections, router, transaction
+from django.db.models import Count, Exists, F, Min, OuterRef, Q, Subquery
+from django.db.models.query import QuerySet
 
+from biblioteka import search
+from biblioteka.cache import author_names, library_locations
+from biblioteka.models import (
+    Author, AuthorStats, Book, GenreStats, Library, LibraryStats, LibraryTitleCount, Work,
+    book_lookup, chunks, relink_works,
+)
+from biblioteka.routers import use_primary
+from biblioteka.signals import books_changed
+
+# Copies are counted per work on the integer key, then summed per value of
+# these fields of the works; 'work' keeps the counts keyed by Work objects.
+COUNTABLE_FIELDS = {
+    'title': 'work__title',
+    'genre': 'work__genre',
+    'author': 'work__author__name',
+    'work': 'work_id',
+}
+
+BULK_UPDATE_FIELDS = ('library', 'genre')
+
+STREAM_CHUNK_SIZE = 2000
+
+
+@use_primary()
 def add_author(name):
     author = Author.objects.create(name=name)
     return author
 
 
+@use_primary()
 def add_library(location):
     library = Library.objects.create(location=location)
     return library
 
 
-def add_book(title, genre, author, library=None):
+def build_book(title, genre, author, library=None):
     if not type(author) == Author:
         raise ValueError("Author should be a DB object")
     if type(genre) != str or type(title) != str:
         raise ValueError("Title and genre have to be strings!")
-    
-    book = Book.objects.create(
+
+    return Book(
         title=title,
         genre=genre,
         author=author,
         library=library
     )
 
+
+@use_primary()
+def add_book(title, genre, author, library=None):
+    book = build_book(title, genre, author, library)
+    book.save()
     return book
 
 
-def view_books_by_author(author):
+def _get_author(author):
     if type(author) == str:
-        try:
-            author = Author.objects.get(name=author)
-        except Exception:
+        author = author_names.lookup(author)
+        if author is None:
             raise ValueError("Wrong author name!")
     elif type(author) != Author:
         raise ValueError("Parameter should be author name or object!")
-    
-    books = list(Book.objects.filter(author=author))
-    return books
+    return author
 
 
-def view_books_in_library(library):
+def _get_library(library):
     if type(library) == str:
-        try:
-            library = Library.objects.get(location=location)
-        except Exception:
+        library = library_locations.lookup(library)
+        if library is None:
             raise ValueError("Wrong library location!")
     elif type(library) != Library:
         raise ValueError("Parameter should be library location or object!")
-    
-    books = list(Book.objects.filter(library=library))
+    return library
+
+
+def _get_many(names_cache, entities, name_error, type_error):
+    model, field = names_cache.model, names_cache.field
+    entities = list(entities)
+    if any(type(entity) not in (str, model) for entity in entities):
+        raise ValueError(type_error)
+
+    names = {entity for entity in entities if type(entity) == str}
+    found = {}
+    for name in names:
+        obj = names_cache.get(name)
+        if obj is not None:
+            found[name] = obj
+    for chunk in chunks(names - set(found)):
+        for obj in model.objects.filter(**{f'{field}__in': chunk}):
+            found[getattr(obj, field)] = obj
+            names_cache.put(obj)
+    if names - set(found):
+        raise ValueError(name_error)
+
+    resolved = [found[entity] if type(entity) == str else entity for entity in entities]
+    return list(dict.fromkeys(resolved))
+
+
+def _get_authors(authors):
+    return _get_many(
+        author_names, authors,
+        "Wrong author name!", "Parameter should be author name or object!",
+    )
+
+
+def _get_libraries(libraries):
+    return _get_many(
+        library_locations, libraries,
+        "Wrong library location!", "Parameter should be library location or object!",
+    )
+
+
+def _results(queryset, stream=False, chunk_size=STREAM_CHUNK_SIZE, fields=None):
+    """
+    Returns the rows of `queryset` as a list, or with `stream` as an
+    iterator fetching `chunk_size` rows at a time (a server-side cursor
+    where the database has them). With `fields`, rows are named tuples of
+    those fields instead of model instances.
+    """
+    if fields is not None:
+        if queryset.model == Book:
+            # Fields of the work keep their names in the rows.
+            queryset = queryset.annotate(**{
+                field: F(book_lookup(field)) for field in fields if book_lookup(field) != field
+            })
+        try:
+            queryset = queryset.values_list(*fields, named=True)
+        except FieldError as e:
+            raise ValueError(f"Wrong fields: {e}")
+    if not stream:
+        return list(queryset)
+    if type(chunk_size) != int or chunk_size < 1:
+        raise ValueError("Chunk size has to be a positive integer!")
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def view_books_by_author(author, stream=False, chunk_size=STREAM_CHUNK_SIZE, fields=None):
+    author = _get_author(author)
+
+    books = author.books
+    return _results(books, stream, chunk_size, fields)
+
+
+def view_books_in_library(library, stream=False, chunk_size=STREAM_CHUNK_SIZE, fields=None):
+    library = _get_library(library)
+
+    books = Book.objects.filter(library=library).select_related('work__author')
+    return _results(books, stream, chunk_size, fields)
+
+
+def view_books_by_authors(authors):
+    authors = _get_authors(authors)
+
+    books = {author: [] for author in authors}
+    by_pk = {author.pk: author for author in authors}
+    for chunk in chunks(by_pk):
+        for book in Book.objects.filter(work__author_id__in=chunk):
+            books[by_pk[book.author_id]].append(book)
     return books
 
 
+def view_books_in_libraries(libraries):
+    libraries = _get_libraries(libraries)
+
+    books = {library: [] for library in libraries}
+    by_pk = {library.pk: library for library in libraries}
+    for chunk in chunks(by_pk):
+        for book in Book.objects.filter(library_id__in=chunk).select_related('work__author'):
+            books[by_pk[book.library_id]].append(book)
+    return books
+
+
+def _sum_counts(rows):
+    counts = {}
+    for value, count in rows:
+        counts[value] = counts.get(value, 0) + count
+    return counts
+
+
+def count_books(library, by='title'):
+    library = _get_library(library)
+    if by not in COUNTABLE_FIELDS:
+        raise ValueError(f"Books can be counted by: {', '.join(COUNTABLE_FIELDS)}")
+
+    if by == 'work':
+        works = Work.objects.filter(copies__library=library).annotate(count=Count('copies'))
+        return {work: work.count for work in works.order_by()}
+
+    # Grouped on the (library, work) index; each work has a single value.
+    per_work = (
+        Book.objects.filter(library=library)
+        .values_list('work_id')
+        .annotate(value=Min(COUNTABLE_FIELDS[by]), count=Count('pk'))
+        .order_by()
+    )
+    return _sum_counts((value, count) for _, value, count in per_work)
+
+
 def count_titles(library):
-    if type(library) == str:
-        try:
-            library = Library.objects.get(location=location)
-        except Exception:
-            raise ValueError("Wrong library location!")
-    elif type(library) != Library:
-        raise ValueError("Parameter should be library location or object!")
-    
-    titles = dict()
-    books = Book.objects.filter(library=library)
-    for book in books:
-        if book.title in titles:
-            titles[book.title] += 1
-        else:
-            titles[book.title] = 1
-    
-    return titles
+    return count_books(library, by='title')
+
+
+def count_books_in_libraries(libraries, by='title'):
+    libraries = _get_libraries(libraries)
+    if by not in COUNTABLE_FIELDS:
+        raise ValueError(f"Books can be counted by: {', '.join(COUNTABLE_FIELDS)}")
+
+    counts = {library: {} for library in libraries}
+    by_pk = {library.pk: library for library in libraries}
+    for chunk in chunks(by_pk):
+        if by == 'work':
+            works = (
+                Work.objects.filter(copies__library_id__in=chunk)
+                .annotate(library_id=F('copies__library_id'), count=Count('copies'))
+                .order_by()
+            )
+            for work in works:
+                counts[by_pk[work.library_id]][work] = work.count
+            continue
+
+        rows = (
+            Book.objects.filter(library_id__in=chunk)
+            .values_list('library_id', 'work_id')
+            .annotate(value=Min(COUNTABLE_FIELDS[by]), count=Count('pk'))
+            .order_by()
+        )
+        for library_id, _, value, count in rows:
+            library_counts = counts[by_pk[library_id]]
+            library_counts[value] = library_counts.get(value, 0) + count
+    return counts
+
+
+def count_titles_in_libraries(libraries):
+    return count_books_in_libraries(libraries, by='title')
+
+
+def library_stats(library):
+    library = _get_library(library)
+    stats = LibraryStats.objects.filter(library=library).values('books', 'titles').first()
+    return stats or {'books': 0, 'titles': 0}
+
+
+def library_titles(library):
+    """Returns {title: copies} of `library` in title order, from the counters."""
+    library = _get_library(library)
+    counts = LibraryTitleCount.objects.filter(library=library).order_by('title')
+    return dict(counts.values_list('title', 'copies'))
+
+
+def author_stats(author):
+    author = _get_author(author)
+    stats = AuthorStats.objects.filter(author=author).values('books').first()
+    return stats or {'books': 0}
+
+
+def genre_stats(genre):
+    if type(genre) != str:
+        raise ValueError("Genre has to be a string!")
+    stats = GenreStats.objects.filter(genre=genre).values('books', 'titles').first()
+    return stats or {'books': 0, 'titles': 0}
 
 
 def view_titles_by_author(author):
-    if type(author) == str:
-        try:
-            author = Author.objects.get(name=author)
-        except Exception:
-            raise ValueError("Wrong author name!")
-    elif type(author) != Author:
-        raise ValueError("Parameter should be author name or object!")
-    
-    titles = []
-    books = Book.objects.filter(author=author)
-    for book in books:
-        if book.title not in titles:
-            titles.append(book.title)
+    author = _get_author(author)
+
+    # Works in order of their first copy, read from the per-work index;
+    # works of the same title in several genres give it once.
+    first_copy = Book.objects.filter(work=OuterRef('pk')).order_by('pk').values('pk')[:1]
+    titles = (
+        Work.objects.filter(author=author)
+        .annotate(first=Subquery(first_copy))
+        .filter(first__isnull=False)
+        .order_by('first')
+        .values_list('title', flat=True)
+    )
+    return list(dict.fromkeys(titles))
 
-    return titles
 
-def find_libraries_with_book(book):
+def author_bibliography(author, after=None, limit=None, details=False):
+    """
+    Returns the distinct titles of `author` in alphabetical order, starting
+    after the title `after` and at most `limit` of them. With `details`,
+    returns dicts with the title, its number of copies and its genres.
+    """
+    author = _get_author(author)
+    if after is not None and type(after) != str:
+        raise ValueError("After should be a title!")
+    if limit is not None and (type(limit) != int or limit < 1):
+        raise ValueError("Limit has to be a positive integer!")
+
+    # Works without copies left are not part of it.
+    works = Work.objects.filter(author=author, copies__isnull=False)
+    if after is not None:
+        works = works.filter(title__gt=after)
+    titles = works.values('title').annotate(copies=Count('copies')).order_by('title')
+    if limit is not None:
+        titles = titles[:limit]
+    if not details:
+        return [row['title'] for row in titles]
+
+    titles = list(titles)
+    genres = {}
+    for chunk in chunks(row['title'] for row in titles):
+        pairs = (
+            Work.objects.filter(author=author, title__in=chunk)
+            .filter(Exists(Book.objects.filter(work=OuterRef('pk'))))
+            .values_list('title', 'genre')
+            .order_by('title', 'genre')
+        )
+        for title, genre in pairs:
+            genres.setdefault(title, []).append(genre)
+    return [
+        {'title': row['title'], 'copies': row['copies'], 'genres': genres[row['title']]}
+        for row in titles
+    ]
+
+
+def find_libraries_with_book(book, stream=False, chunk_size=STREAM_CHUNK_SIZE, fields=None):
     if type(book) != Book:
         raise ValueError("Parameter should be a Book object!")
 
-    libraries = list(Library.objects.filter(books__in=[book]).distinct())
-    return libraries
+    libraries = (
+        Library.objects.filter(
+            books__work__author_id=book.author_id, books__work__title=book.title
+        )
+        .distinct()
+        .order_by('pk')
+    )
+    return _results(libraries, stream, chunk_size, fields)
+
+
+
+def find_libraries_with_books(books):
+    books = list(dict.fromkeys(books))
+    if any(type(book) != Book for book in books):
+        raise ValueError("Parameter should be a Book object!")
+
+    holdings = {}
+    for chunk in chunks(books):
+        copies = (
+            Book.objects.filter(
+                work__title__in={book.title for book in chunk},
+                work__author_id__in={book.author_id for book in chunk},
+                library__isnull=False,
+            )
+            .values_list('work__title', 'work__author_id', 'library_id')
+            .distinct()
+            .order_by()
+        )
+        for title, author_id, library_id in copies:
+            holdings.setdefault((title, author_id), set()).add(library_id)
+
+    library_ids = set().union(*holdings.values())
+    found = Library.objects.in_bulk(library_ids)
+    return {
+        book: [found[pk] for pk in sorted(holdings.get((book.title, book.author_id), ()))]
+        for book in books
+    }
+
+
+def find_title_availability(title):
+    """
+    Returns {library: copies} of every library holding `title`, by any
+    author, from the counters kept by biblioteka.stats: one indexed query
+    however many libraries there are.
+    """
+    if type(title) != str:
+        raise ValueError("Title has to be a string!")
+
+    holdings = (
+        LibraryTitleCount.objects.filter(title=title, copies__gt=0)
+        .select_related('library')
+        .order_by('library_id')
+    )
+    return {holding.library: holding.copies for holding in holdings}
+
+
+def search_books(query, limit=20, offset=0):
+    if type(query) != str:
+        raise ValueError("Query should be a string!")
+
+    books = Book.objects.select_related('work__author', 'library')
+    if not search.is_supported():
+        words = query.split()
+        if not words:
+            return []
+        condition = Q()
+        for word in words:
+            condition &= (
+                Q(work__title__icontains=word)
+                | Q(work__genre__icontains=word)
+                | Q(work__author__name__icontains=word)
+            )
+        return list(books.filter(condition)[offset:offset + limit])
+
+    ids = search.ranked_book_ids(query, limit, offset)
+    found = books.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def _get_books(books):
+    """
+    Returns `books`, a Book queryset or Book objects and ids, as a list of
+    querysets: the queryset itself, or one per chunk of the ids, so that no
+    IN (...) grows with the number of books.
+    """
+    if isinstance(books, QuerySet):
+        if books.model != Book:
+            raise ValueError("Parameter should be a Book queryset or list!")
+        return [books]
+    ids = set()
+    for book in books:
+        if type(book) == Book:
+            ids.add(book.pk)
+        elif type(book) == int:
+            ids.add(book)
+        else:
+            raise ValueError("Parameter should be a Book queryset or list!")
+    # Sorted, so concurrent calls lock shared rows in the same order.
+    return [Book.objects.filter(pk__in=chunk) for chunk in chunks(sorted(ids))]
+
+
+def _lock_books(books):
+    # The books as they were before the change, for counters and caches.
+    rows = []
+    for queryset in _get_books(books):
+        rows.extend(
+            queryset.select_for_update(of=('self',))
+            .values_list('pk', 'work__author_id', 'library_id', 'work__genre')
+            .order_by()
+        )
+    return rows
+
+
+def _delete_books(ids):
+    # A plain DELETE instead of QuerySet.delete(), whose collector would load
+    # every row to send post_delete to the counter receivers; books_changed
+    # covers them. Nothing references books.
+    with connections[router.db_for_write(Book)].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Book._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+            ids,
+        )
+
+
+@use_primary()
+def update_books(books, **values):
+    """
+    Sets `values` (library and/or genre) on `books`, a Book queryset or a
+    list of books or ids, with UPDATE ... WHERE id IN (...) statements in
+    one transaction. Returns the number of updated books.
+    """
+    if not values or set(values) - set(BULK_UPDATE_FIELDS):
+        raise ValueError(f"Only {' and '.join(BULK_UPDATE_FIELDS)} can be updated in bulk!")
+    if values.get('library') is not None:
+        values['library'] = _get_library(values['library'])
+    if 'genre' in values and type(values['genre']) != str:
+        raise ValueError("Genre has to be a string!")
+
+    with transaction.atomic():
+        rows = _lock_books(books)
+        if not rows:
+            return 0
+        for chunk in chunks(pk for pk, _, _, _ in rows):
+            books = Book.objects.filter(pk__in=chunk)
+            if 'library' in values:
+                books.update(library=values['library'])
+            if 'genre' in values:
+                relink_works(books, genre=values['genre'])
+
+        library_ids = {library_id for _, _, library_id, _ in rows}
+        if 'library' in values:
+            library_ids.add(values['library'] and values['library'].pk)
+        genres = set()
+        if 'genre' in values:
+            genres = {genre for _, _, _, genre in rows} | {values['genre']}
+        books_changed.send(
+            sender=Book,
+            book_ids=[pk for pk, _, _, _ in rows],
+            author_ids={author_id for _, author_id, _, _ in rows},
+            library_ids=library_ids - {None},
+            genres=genres,
+        )
+    return len(rows)
+
+
+@use_primary()
+def delete_books(books):
+    """
+    Deletes `books`, a Book queryset or a list of books or ids, with
+    DELETE ... WHERE id IN (...) statements in one transaction. Returns the
+    number of deleted books.
+    """
+    with transaction.atomic():
+        rows = _lock_books(books)
+        if not rows:
+            return 0
+        for chunk in chunks(pk for pk, _, _, _ in rows):
+            _delete_books(chunk)
+        books_changed.send(
+            sender=Book,
+            book_ids=[pk for pk, _, _, _ in rows],
+            author_ids={author_id for _, author_id, _, _ in rows},
+            library_ids={library_id for _, _, library_id, _ in rows} - {None},
+            genres={genre for _, _, _, genre in rows},
+        )
+    return len(rows)
@@ -1,33 +1,122 @@
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse,
+)
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
 from django.views.generic.detail import DetailView
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, quote_etag
 from django.shortcuts import render, redirect
 from django.views.generic.edit import UpdateView, DeleteView
 from django.views.generic import ListView
 
+from biblioteka.aio import gather_reads
+from biblioteka.api import (
+    api_availability, api_bibliography, api_object, api_page, api_suggestions,
+)
+from biblioteka.cache import aget_catalogue_version, aget_detail, author_names
+from biblioteka.export import CONTENT_TYPES, aiter_chunks, iter_export
+from biblioteka.forms import BookForm, BookTitleForm
 from biblioteka.models import Book, Author, Library
+from biblioteka.pagination import get_page_size, paginate_request
 from biblioteka.utils import *
 
+logger = logging.getLogger(__name__)
+
 
 def index(request):
     return redirect('biblioteka:profile')
 
 
-class BookDetailView(DetailView):
-    model = Book
-    template_name = "detail/detailBook.html"
+def catalogue_conditional(view):
+    """
+    Sends ETag and Last-Modified derived from the catalogue version with an
+    async list view and answers conditional GETs with 304 when nothing in
+    the catalogue changed. The view finds the version in
+    request.catalogue_version for its fragment cache keys.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        version = await aget_catalogue_version()
+        request.catalogue_version = version
+        etag = quote_etag(str(version))
+        last_modified = version // 10 ** 9
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            # Revalidate every time, the catalogue may change at any moment.
+            patch_cache_control(response, no_cache=True)
+        return response
+    return wrapper
+
+
+def list_context(request, name, queryset):
+    # The page is only fetched when the cached fragment is missing.
+    page = SimpleLazyObject(lambda: paginate_request(request, queryset))
+    return {
+        name: page,
+        'page': page,
+        'catalogue_version': request.catalogue_version,
+        'fragment_timeout': getattr(settings, 'BIBLIOTEKA_LIST_CACHE_TIMEOUT', 300),
+    }
+
+
+class CachedDetailMixin:
+    """
+    Serves the object and the extra context of a DetailView from
+    biblioteka.cache; receivers.py drops the entry whenever its data changes.
+    The extra reads of a missing entry run concurrently.
+    """
+
+    def get_detail_reads(self, obj):
+        """Returns {context name: callable} of independent reads."""
+        return {}
+
+    async def build_detail(self):
+        obj = await sync_to_async(super().get_object)()
+        reads = self.get_detail_reads(obj)
+        values = await gather_reads(*reads.values())
+        return {'object': obj, 'extras': dict(zip(reads, values))}
+
+    async def get(self, request, *args, **kwargs):
+        pk = self.kwargs.get(self.pk_url_kwarg)
+        self._detail = await aget_detail(self.model, pk, self.build_detail)
+        self.object = self._detail['object']
+        context = self.get_context_data(object=self.object)
+        return await sync_to_async(self.render_to_response(context).render)()
+
+    def get_object(self, queryset=None):
+        return self._detail['object']
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context.update(self._detail['extras'])
         return context
 
 
+class BookDetailView(CachedDetailMixin, DetailView):
+    model = Book
+    queryset = Book.objects.select_related('work__author', 'library')
+    template_name = "detail/detailBook.html"
+
+
 class BookCreateView(CreateView):
     model = Book
-    fields = ['title', 'genre']
+    use_primary = True
+    form_class = BookTitleForm
     template_name = "create/createBook.html"
     success_message = "Książka została utworzona."
     success_url = reverse_lazy('biblioteka:book-list')
@@ -43,7 +132,7 @@ class BookCreateView(CreateView):
             genre = self.request.POST.get("genre", None)
             author_pk = self.kwargs['author_pk']
             author = Author.objects.get(pk=author_pk)
-            print(title, genre, author.name)
+            logger.debug("Creating book %r (%s) by %s", title, genre, author.name)
             book.title = title
             book.genre = title
             book.author = author
@@ -55,8 +144,9 @@ class BookCreateView(CreateView):
 
 class BookEditView(UpdateView):
     model = Book
-    fields = ['title', 'genre', 'author', 'library']
-    template_name = "edit/editAuthor.html"
+    use_primary = True
+    form_class = BookForm
+    template_name = "edit/editBook.html"
     success_message = "Książka została zedytowana."
     success_url = reverse_lazy('biblioteka:book-list')
 
@@ -67,6 +157,7 @@ class BookEditView(UpdateView):
 
 class BookDeleteView(DeleteView):
     model = Book
+    use_primary = True
     fields = ['title', 'genre', 'author', 'library']
     template_name = "delete/deleteAuthor.html"
     success_message = "Książka została usunięta."
@@ -77,25 +168,154 @@ class BookDeleteView(DeleteView):
         return context
 
 
-def books_list(request):
-    books = Book.objects.all()
-    context = {'books': books}
-    return render(request, "list/books.html", context)
+@catalogue_conditional
+async def books_list(request):
+    context = list_context(request, 'books', Book.objects.select_related('work__author'))
+    return await sync_to_async(render)(request, "list/books.html", context)
+
+
+def books_search(request):
+    query = request.GET.get('q', '')
+    page_size = get_page_size(request.GET.get('size'))
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    books = search_books(query, limit=page_size + 1, offset=(page - 1) * page_size)
+    context = {
+        'query': query,
+        'books': books[:page_size],
+        'page_size': page_size,
+        'previous_page': page - 1 if page > 1 else None,
+        'next_page': page + 1 if len(books) > page_size else None,
+    }
+    return render(request, "list/search.html", context)
+
+
+BULK_FILTERS = {'library': 'library_id', 'author': 'work__author_id', 'genre': 'work__genre'}
 
 
-class AuthorDetailView(DetailView):
+def _bulk_selection(data):
+    filters = {
+        lookup: data[name] or None for name, lookup in BULK_FILTERS.items() if name in data
+    }
+    if data.getlist('ids'):
+        filters['pk__in'] = [int(pk) for pk in data.getlist('ids')]
+    if not filters:
+        # Never act on the whole catalogue by accident.
+        raise ValueError("Give book ids or at least one of: " + ', '.join(BULK_FILTERS))
+    return Book.objects.filter(**filters)
+
+
+def _bulk_values(data):
+    values = {}
+    if 'set_library' in data:
+        values['library'] = None
+        if data['set_library']:
+            values['library'] = Library.objects.filter(pk=int(data['set_library'])).first()
+            if values['library'] is None:
+                raise ValueError("Wrong library id!")
+    if 'set_genre' in data:
+        values['genre'] = data['set_genre']
+    return values
+
+
+@login_required(login_url='/login/')
+@require_POST
+def books_bulk(request):
+    """
+    Updates (set_library, set_genre) or deletes, depending on `action`, the
+    books given by `ids` and/or by the library, author and genre filters.
+    Answers with the number of affected books.
+    """
+    action = request.POST.get('action')
+    try:
+        books = _bulk_selection(request.POST)
+        if action == 'update':
+            count = update_books(books, **_bulk_values(request.POST))
+        elif action == 'delete':
+            count = delete_books(books)
+        else:
+            raise ValueError("Action should be update or delete")
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'action': action, 'count': count})
+
+
+def catalogue_export(request):
+    entity = request.GET.get('entity', 'books')
+    file_format = request.GET.get('format', 'csv')
+    try:
+        content = iter_export(entity, file_format)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if isinstance(request, ASGIRequest):
+        # ASGI servers need an async iterator to stream.
+        content = aiter_chunks(content)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{entity}.{file_format}"'
+    return response
+
+
+@catalogue_conditional
+async def api_list(request, resource):
+    try:
+        data = await sync_to_async(api_page)(resource, request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+@catalogue_conditional
+async def api_detail(request, resource, pk):
+    try:
+        data = await sync_to_async(api_object)(resource, pk, request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if data is None:
+        raise Http404
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+@catalogue_conditional
+async def api_author_bibliography(request, pk):
+    data = await sync_to_async(api_bibliography)(pk, request.GET)
+    if data is None:
+        raise Http404
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+@catalogue_conditional
+async def api_suggest(request, resource):
+    try:
+        data = await sync_to_async(api_suggestions)(resource, request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+@catalogue_conditional
+async def api_title_availability(request):
+    try:
+        data = await sync_to_async(api_availability)(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+
+
+class AuthorDetailView(CachedDetailMixin, DetailView):
     model = Author
     template_name = "detail/detailAuthor.html"
 
-    def get_context_data(self, **kwargs):
-        author_books = view_books_by_author(self.get_object())
-        context = super().get_context_data(**kwargs)
-        context['author_books'] = author_books
-        return context
+    def get_detail_reads(self, author):
+        return {'author_books': lambda: list(view_books_by_author(author))}
 
 class AuthorCreateView(CreateView):
     model = Author
-    fields = ['name', 'books']
+    use_primary = True
+    fields = ['name']
     template_name = "create/createAuthor.html"
     success_message = "Autor został utworzony."
     success_url = reverse_lazy('biblioteka:author-list')
@@ -111,7 +331,7 @@ class AuthorCreateView(CreateView):
             surname = self.request.POST.get("surname", None)
             if first_name:
                 name = f"{first_name.strip()} {surname.strip()}"
-                if Author.objects.filter(name=name):
+                if author_names.lookup(name) is not None:
                     return super(AuthorCreateView, self).form_invalid(form)
                 author.name = name
                 author.save()
@@ -124,7 +344,8 @@ class AuthorCreateView(CreateView):
 
 class AuthorEditView(UpdateView):
     model = Author
-    fields = ['name', 'books']
+    use_primary = True
+    fields = ['name']
     template_name = "create/createAuthor.html"
     success_message = "Autor został zmieniony."
     success_url = reverse_lazy('biblioteka:author-list')
@@ -140,7 +361,7 @@ class AuthorEditView(UpdateView):
             surname = self.request.POST.get("surname", None)
             if first_name:
                 name = f"{first_name.strip()} {surname.strip()}"
-                if Author.objects.filter(name=name):
+                if author_names.lookup(name) is not None:
                     return super(AuthorEditView, self).form_invalid(form)
                 author.name = name
                 author.save()
@@ -153,6 +374,7 @@ class AuthorEditView(UpdateView):
 
 class AuthorDeleteView(DeleteView):
     model = Author
+    use_primary = True
     fields = ['name']
     template_name = "delete/deleteAuthor.html"
     success_message = "Autor został usunięty."
@@ -163,27 +385,32 @@ class AuthorDeleteView(DeleteView):
         return context
 
 
-def authors_list(request):
-    authors = Author.objects.all()
-    context = {'authors': authors}
-    return render(request, "list/authors.html", context)
+@catalogue_conditional
+async def authors_list(request):
+    context = list_context(request, 'authors', Author.objects.all())
+    return await sync_to_async(render)(request, "list/authors.html", context)
 
 
-class LibraryDetailView(DetailView):
+class LibraryDetailView(CachedDetailMixin, DetailView):
     model = Library
     template_name = "detail/detailLibrary.html"
 
+    def get_detail_reads(self, library):
+        return {
+            'titles': lambda: library_titles(library),
+            'books': lambda: list(view_books_in_library(library)),
+        }
+
     def get_context_data(self, **kwargs):
-        titles = count_titles(self.get_object())
-        books = view_books_in_library(self.get_object())
         context = super().get_context_data(**kwargs)
-        context['titles'] = titles
-        context['books'] = books
+        titles = context['titles']
+        context['stats'] = {'books': sum(titles.values()), 'titles': len(titles)}
         return context
 
 
 class LibraryCreateView(CreateView):
     model = Library
+    use_primary = True
     fields = ['location']
     template_name = "create/createLibrary.html"
     success_message = "Biblioteka została dodana."
@@ -206,7 +433,8 @@ class LibraryCreateView(CreateView):
 
 class LibraryEditView(UpdateView):
     model = Library
-    fields = ['location', 'books']
+    use_primary = True
+    fields = ['location']
     template_name = "edit/editLibrary.html"
     success_message = "Biblioteka została zedytowana."
     success_url = reverse_lazy('biblioteka:library-list')
@@ -218,7 +446,8 @@ class LibraryEditView(UpdateView):
 
 class LibraryDeleteView(DeleteView):
     model = Library
-    fields = ['location', 'books']
+    use_primary = True
+    fields = ['location']
     template_name = "delete/deleteLibrary.html"
     success_message = "Biblioteka została usunięa."
     success_url = reverse_lazy('biblioteka:library-list')
@@ -228,10 +457,10 @@ class LibraryDeleteView(DeleteView):
         return context
 
 
-def libraries_list(request):
-    libraries = Library.objects.all()
-    context = {'libraries': libraries}
-    return render(request, "list/libraries.html", context)
+@catalogue_conditional
+async def libraries_list(request):
+    context = list_context(request, 'libraries', Library.objects.all())
+    return await sync_to_async(render)(request, "list/libraries.html", context)
 
 
 class Register(CreateView):
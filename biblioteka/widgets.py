@@ -0,0 +1,60 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    Select for a foreign key that renders only the chosen option instead of
+    every row of the related table. static/autocomplete.js fetches the
+    other options page by page from the api-suggest endpoint of `resource`
+    while the user types.
+    """
+
+    class Media:
+        js = ['autocomplete.js']
+
+    def __init__(self, resource, attrs=None):
+        super().__init__(attrs)
+        self.resource = resource
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse('biblioteka:api-suggest', args=[self.resource])
+        attrs['class'] = f"{attrs.get('class', '')} autocomplete".strip()
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = self._valid_values(field, value)
+        choices = []
+        if not self.is_required:
+            choices.append(('', field.empty_label or ''))
+        if selected:
+            key = field.to_field_name or 'pk'
+            for obj in field.queryset.filter(**{f'{key}__in': selected}):
+                choices.append((field.prepare_value(obj), field.label_from_instance(obj)))
+
+        groups = []
+        for index, (option_value, label) in enumerate(choices):
+            option = self.create_option(
+                name, option_value, label, str(option_value) in value, index, attrs=attrs
+            )
+            groups.append((None, [option], index))
+        return groups
+
+    @staticmethod
+    def _valid_values(field, value):
+        # A rejected form renders the submitted values again, which may be
+        # anything; the field reports them, the query must not see them.
+        opts = field.queryset.model._meta
+        model_field = opts.get_field(field.to_field_name) if field.to_field_name else opts.pk
+        valid = []
+        for item in value:
+            if item in ('', None):
+                continue
+            try:
+                valid.append(model_field.to_python(item))
+            except ValidationError:
+                pass
+        return valid
@@ -1,11 +1,13 @@
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 # Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
+# See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'ixj9-mbe-(n*-walh$#dxb4=3q11r$@!2-sn(86p=dblbxwu(n'
@@ -29,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'biblioteka.profiling.QueryProfilingMiddleware',
+    'biblioteka.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,7 +46,7 @@ ROOT_URLCONF = 'tdd.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'biblioteka.profiling.ProfiledDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -57,21 +61,114 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tdd.wsgi.application'
+ASGI_APPLICATION = 'tdd.asgi.application'
 
 
 # Database
-# https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+# https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+
+# BIBLIOTEKA_DB_ENGINE=postgresql switches to PostgreSQL configured with the
+# BIBLIOTEKA_DB_* variables. BIBLIOTEKA_DB_POOL_SIZE > 0 hands connections out
+# from a per-process pool (biblioteka.db.postgresql_pool, needs psycopg2),
+# otherwise each thread keeps its connection for CONN_MAX_AGE seconds.
+
+DB_ENGINE = os.environ.get('BIBLIOTEKA_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL_SIZE = int(os.environ.get('BIBLIOTEKA_DB_POOL_SIZE', 0))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BIBLIOTEKA_DB_NAME', 'biblioteka'),
+            'USER': os.environ.get('BIBLIOTEKA_DB_USER', ''),
+            'PASSWORD': os.environ.get('BIBLIOTEKA_DB_PASSWORD', ''),
+            'HOST': os.environ.get('BIBLIOTEKA_DB_HOST', ''),
+            'PORT': os.environ.get('BIBLIOTEKA_DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('BIBLIOTEKA_DB_CONN_MAX_AGE', 60)),
+        }
+    }
+    if DB_POOL_SIZE > 0:
+        DATABASES['default'].update({
+            'ENGINE': 'biblioteka.db.postgresql_pool',
+            # Connections go back to the pool at the end of every request.
+            'CONN_MAX_AGE': int(os.environ.get('BIBLIOTEKA_DB_CONN_MAX_AGE', 0)),
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('BIBLIOTEKA_DB_POOL_MIN_SIZE', 1)),
+                    'max_size': DB_POOL_SIZE,
+                    'timeout': float(os.environ.get('BIBLIOTEKA_DB_POOL_TIMEOUT', 10)),
+                },
+            },
+        })
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'biblioteka.db.sqlite3',
+            'NAME': os.environ.get('BIBLIOTEKA_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown BIBLIOTEKA_DB_ENGINE {DB_ENGINE!r}, use sqlite or postgresql")
+
+# Read replicas, e.g. BIBLIOTEKA_DB_REPLICAS=replica1.sqlite3,replica2.sqlite3
+# (SQLite file names) or =10.0.0.2,10.0.0.3 (PostgreSQL hosts). They get the
+# aliases replica1, replica2, ... and serve reads (see biblioteka.routers).
+BIBLIOTEKA_DB_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('BIBLIOTEKA_DB_REPLICAS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME' if DB_ENGINE == 'sqlite' else 'HOST': replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    BIBLIOTEKA_DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['biblioteka.routers.ReplicaRouter']
+
+# Seconds between health checks of a replica
+BIBLIOTEKA_REPLICA_HEALTH_INTERVAL = 5
+
+# Seconds a client reads from the primary after a write (read-your-writes)
+BIBLIOTEKA_REPLICA_STICKY_SECONDS = 10
+
+# PRAGMAs run on every new SQLite connection (see biblioteka.db.sqlite3): WAL
+# lets readers work next to a writer, busy_timeout (ms) makes writers wait
+# for the lock instead of failing with "database is locked".
+BIBLIOTEKA_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': int(os.environ.get('BIBLIOTEKA_SQLITE_BUSY_TIMEOUT', 5000)),
+    'synchronous': 'NORMAL',
+}
 
-DATABASES = {
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'biblioteka',
     }
 }
 
+# Seconds a rendered detail page context stays cached (see biblioteka.cache)
+BIBLIOTEKA_DETAIL_CACHE_TIMEOUT = 300
+
+# Seconds a rendered list fragment stays cached; any catalogue change
+# starts new fragments anyway (see biblioteka.cache.bump_catalogue_version)
+BIBLIOTEKA_LIST_CACHE_TIMEOUT = 300
+
+# Per-process cache of author names and library locations used to resolve
+# the names given to biblioteka.utils (see biblioteka.cache.NameCache).
+BIBLIOTEKA_NAME_CACHE_SIZE = 1024
+BIBLIOTEKA_NAME_CACHE_TTL = 60
+
+
+# Keeps the integer primary keys of existing databases
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
 
 # Password validation
-# https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
+# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -94,10 +191,15 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 STATIC_URL = '/static/'
 
 LOGIN_REDIRECT_URL = '/profile/'
+
+# Requests repeating one SQL statement this many times are logged as N+1
+BIBLIOTEKA_N_PLUS_ONE_THRESHOLD = 5
+
+# Keyset pagination of the catalogue lists (?after=<pk>, ?before=<pk>, ?size=<n>)
+BIBLIOTEKA_PAGE_SIZE = 50
+BIBLIOTEKA_MAX_PAGE_SIZE = 500